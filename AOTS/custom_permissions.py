@@ -52,17 +52,18 @@ def get_allowed_objects_to_view_for_user(qs, user, parameter_switch=False):
     if user.is_anonymous:
         #   ... return the "public" queryset if not
         return public
+    elif user.is_superuser:
+        #   ... superusers can read all projects
+        return qs
     else:
-        #   Check if user is allowed to view the project ...
+        #   Check if user is allowed to view the project, using the cached
+        #   pks of the projects of the user ...
+        project_ids = sorted(user.get_read_project_ids())
         if parameter_switch:
-            restricted = qs.filter(
-                star__project__pk__in=user.get_read_projects().values('pk')
-            )
+            restricted = qs.filter(star__project_id__in=project_ids)
         else:
-            restricted = qs.filter(
-                project__pk__in=user.get_read_projects().values('pk')
-            )
-        if len(restricted) > 0:
+            restricted = qs.filter(project_id__in=project_ids)
+        if project_ids and restricted.exists():
             #   ... if this is the case return the specific queryset ...
             return restricted
         else:
@@ -0,0 +1,313 @@
+"""
+Streaming bulk export of the stars, photometry, parameters, spectra and light
+curves of a project as CSV, VOTable or Parquet.
+
+The rows are read with `values_list(...).iterator(chunk_size=CHUNK_SIZE)` and
+encoded as they arrive, so the memory use does not depend on the number of
+rows:
+
+    /api/export/stars/?project=<slug>&format=csv
+
+Parquet files are written one row group per chunk and need the optional
+pyarrow package. `stream_zip` streams stored files as a ZIP archive in the
+same way.
+"""
+
+import csv
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from django.apps import apps
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from rest_framework.decorators import api_view
+from rest_framework.negotiation import DefaultContentNegotiation
+
+from AOTS.custom_permissions import get_allowed_objects_to_view_for_user
+
+#   Number of rows read from the database (and written to a Parquet row
+#   group) at once
+CHUNK_SIZE = 2000
+
+#   Exported tables: name -> (app label, model, the project is that of the
+#   star, exported fields)
+TABLES = {
+    'stars': ('stars', 'Star', False, [
+        'pk', 'name', 'project__slug', 'ra', 'dec', 'classification',
+        'classification_type', 'observing_status', 'n_photometry',
+        'n_spectra', 'n_lightcurves', 'n_datasets', 'n_raw_science',
+    ]),
+    'photometry': ('observations', 'Photometry', True, [
+        'pk', 'star_id', 'star__name', 'band', 'wavelength', 'measurement',
+        'error', 'unit', 'upper_limit', 'lower_limit', 'source',
+    ]),
+    'parameters': ('analysis', 'Parameter', True, [
+        'pk', 'star_id', 'star__name', 'data_source__name', 'component',
+        'name', 'value', 'error_l', 'error_u', 'unit', 'average', 'valid',
+    ]),
+    'spectra': ('observations', 'Spectrum', False, [
+        'pk', 'star_id', 'project__slug', 'objectname', 'hjd', 'ra', 'dec',
+        'exptime', 'instrument', 'telescope', 'resolution', 'snr', 'minwave',
+        'maxwave', 'valid', 'fluxcal',
+    ]),
+    'lightcurves': ('observations', 'LightCurve', False, [
+        'pk', 'star_id', 'project__slug', 'objectname', 'hjd', 'hjd_start',
+        'hjd_end', 'duration', 'ra', 'dec', 'exptime', 'cadence', 'passband',
+        'instrument', 'telescope', 'valid',
+    ]),
+}
+
+#   Internal type of a model field -> (VOTable datatype, Parquet type name)
+FIELD_TYPES = {
+    'AutoField': ('long', 'int64'),
+    'BigIntegerField': ('long', 'int64'),
+    'IntegerField': ('long', 'int64'),
+    'ForeignKey': ('long', 'int64'),
+    'FloatField': ('double', 'float64'),
+    'BooleanField': ('boolean', 'bool_'),
+}
+
+
+def column_name(field):
+    return field.replace('__', '_')
+
+
+def field_type(model, path):
+    """
+        (VOTable datatype, Parquet type name) of a field path, fx.
+        'star__name'
+    """
+    if path == 'pk':
+        path = model._meta.pk.name
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    field = model._meta.get_field(name)
+    return FIELD_TYPES.get(field.get_internal_type(), ('char', 'string'))
+
+
+def get_rows(table, user, project=None):
+    """
+        Model, fields and the iterator over the rows of the table the user
+        can see
+    """
+    app_label, model_name, via_star, fields = TABLES[table]
+    model = apps.get_model(app_label, model_name)
+
+    queryset = model.objects.all()
+    if project is not None:
+        queryset = queryset.filter(**{
+            'star__project' if via_star else 'project': project
+        })
+    queryset = get_allowed_objects_to_view_for_user(queryset, user, parameter_switch=via_star)
+
+    rows = queryset.order_by('pk').values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+    return model, fields, rows
+
+
+def chunked(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Echo:
+    """
+        File-like object that returns the written value, used to stream a
+        csv.writer
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(model, fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column_name(f) for f in fields])
+    for chunk in chunked(rows):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def votable_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'T' if value else 'F'
+    return escape(str(value))
+
+
+def stream_votable(model, fields, rows, name=''):
+    yield '<?xml version="1.0" encoding="utf-8"?>\n' \
+          '<VOTABLE version="1.4" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">\n' \
+          '<RESOURCE>\n<TABLE name={}>\n'.format(quoteattr(name))
+    for field in fields:
+        datatype = field_type(model, field)[0]
+        arraysize = ' arraysize="*"' if datatype == 'char' else ''
+        yield '<FIELD name={} datatype="{}"{}/>\n'.format(
+            quoteattr(column_name(field)), datatype, arraysize,
+        )
+    yield '<DATA>\n<TABLEDATA>\n'
+    for chunk in chunked(rows):
+        yield ''.join(
+            '<TR>' + ''.join('<TD>{}</TD>'.format(votable_value(v)) for v in row) + '</TR>\n'
+            for row in chunk
+        )
+    yield '</TABLEDATA>\n</DATA>\n</TABLE>\n</RESOURCE>\n</VOTABLE>\n'
+
+
+class Buffer:
+    """
+        File-like object that collects the written bytes until they are
+        taken, used to stream a Parquet writer
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_parquet(model, fields, rows):
+    #   Optional dependency, checked before the response is started
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        (column_name(f), getattr(pa, field_type(model, f)[1])()) for f in fields
+    ])
+    buffer = Buffer()
+    writer = pq.ParquetWriter(buffer, schema)
+    for chunk in chunked(rows):
+        columns = list(zip(*chunk))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(c, type=t) for c, t in zip(columns, schema.types)],
+            schema=schema,
+        ))
+        yield buffer.take()
+    writer.close()
+    yield buffer.take()
+
+
+def stream_zip(entries, chunk_size=1024 * 1024):
+    """
+        Stream a ZIP archive of (archive name, FieldFile) entries. The files
+        are read from the storage in chunks and stored without compression
+        (FITS files hardly compress), so that the memory use does not depend
+        on the size or number of the files and no temporary files are used.
+    """
+    buffer = Buffer()
+    #   The Buffer can not seek, so the sizes and checksums of the entries
+    #   are written in data descriptors after the data
+    archive = zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED)
+    for name, field_file in entries:
+        info = zipfile.ZipInfo(name, date_time=field_file.storage.get_modified_time(
+            field_file.name).timetuple()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        #   The size decides if ZIP64 extensions are needed
+        info.file_size = field_file.size
+
+        with field_file.open('rb') as source, archive.open(info, mode='w') as target:
+            for chunk in source.chunks(chunk_size):
+                target.write(chunk)
+                yield buffer.take()
+        yield buffer.take()
+    archive.close()
+    yield buffer.take()
+
+
+class FileFormatNegotiation(DefaultContentNegotiation):
+    """
+        Content negotiation of the file views, which read the file format
+        from the `format` parameter themselves. DRF would otherwise look for
+        a renderer of that format and answer 404. Errors are rendered with
+        the first renderer (JSON).
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def file_format_negotiation(func):
+    """
+        Decorator of the file views to use FileFormatNegotiation, like the
+        policy decorators of DRF (apply it below @api_view)
+    """
+    func.content_negotiation_class = FileFormatNegotiation
+    return func
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv', 'csv'),
+    'votable': (stream_votable, 'application/x-votable+xml', 'xml'),
+    'parquet': (stream_parquet, 'application/vnd.apache.parquet', 'parquet'),
+}
+
+
+@api_view(['GET'])
+@file_format_negotiation
+def export_table(request, table):
+    """
+        Stream a table as CSV (default), VOTable or Parquet (`format`),
+        optionally restricted to one `project` (slug)
+    """
+    from stars.models import Project
+
+    if table not in TABLES:
+        return HttpResponseBadRequest(
+            "Unknown table, choose from: {}".format(', '.join(TABLES))
+        )
+
+    file_format = request.GET.get('format', 'csv')
+    if file_format not in FORMATS:
+        return HttpResponseBadRequest(
+            "Unknown format, choose from: {}".format(', '.join(FORMATS))
+        )
+    if file_format == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            return HttpResponseBadRequest("Parquet export requires pyarrow")
+
+    project = None
+    if 'project' in request.GET:
+        project = Project.objects.filter(slug__exact=request.GET['project']).first()
+        if project is None:
+            return HttpResponseBadRequest("Unknown project")
+
+    model, fields, rows = get_rows(table, request.user, project=project)
+
+    stream, content_type, extension = FORMATS[file_format]
+    if file_format == 'votable':
+        content = stream(model, fields, rows, name=table)
+    else:
+        content = stream(model, fields, rows)
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    filename = '{}{}.{}'.format(
+        table, '_' + project.slug if project is not None else '', extension,
+    )
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
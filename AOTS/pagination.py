@@ -0,0 +1,172 @@
+"""
+Pagination of the API listings.
+
+Besides the page number and DataTables pagination, listings can be iterated
+with a keyset (cursor) by adding `cursor` to the query (empty for the first
+page). Every page continues after the (sort key, pk) of the last object on
+the previous page, instead of skipping an OFFSET, so that every page of a
+large table takes the same time:
+
+    /api/observations/specfiles/?cursor=&page_size=500
+    -> {"next": ".../?cursor=eyJ...", "results": [...]}
+
+The sort key is the first ordering of the listing (fx. the DataTables order
+column), the pk breaks ties. The total count is only returned on request
+(`count=exact`, or `count=estimate` for the planner estimate on PostgreSQL).
+"""
+
+import base64
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_datatables.pagination import DatatablesPageNumberPagination
+
+
+def encode_cursor(value, pk):
+    data = json.dumps([value, pk], cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        raise NotFound("Invalid cursor")
+    return value, pk
+
+
+def estimate_count(queryset):
+    """
+        Number of objects in the queryset, estimated by the query planner on
+        PostgreSQL and counted on other databases
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_sort_key(queryset):
+    """
+        Field and direction of the first ordering of the queryset. Listings
+        that are not ordered on a field are iterated on pk.
+    """
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    if ordering and isinstance(ordering[0], str) and ordering[0] != '?':
+        field = ordering[0].lstrip('-')
+        if field not in ('pk', 'id'):
+            return field, ordering[0].startswith('-')
+        return None, ordering[0].startswith('-')
+    return None, False
+
+
+class AOTSPagination(DatatablesPageNumberPagination):
+    """
+        Page number pagination (DataTables aware) with a keyset mode
+    """
+
+    cursor_query_param = 'cursor'
+    cursor_page_size_query_param = 'page_size'
+    max_cursor_page_size = 10000
+    count_query_param = 'count'
+
+    def get_cursor_page_size(self, request):
+        try:
+            size = int(request.query_params[self.cursor_page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_cursor_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params and \
+            request.accepted_renderer.format != 'datatables'
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.is_datatable_request = False
+        page_size = self.get_cursor_page_size(request)
+
+        field, descending = get_sort_key(queryset)
+        if field is not None:
+            #   Nulls are sorted last in both directions on every database
+            key = F(field).desc(nulls_last=True) if descending \
+                else F(field).asc(nulls_last=True)
+            queryset = queryset.annotate(keyset_value=F(field)) \
+                .order_by(key, '-pk' if descending else 'pk')
+        else:
+            queryset = queryset.order_by('-pk' if descending else 'pk')
+
+        #   Total count before the cursor is applied
+        self.count = None
+        count = request.query_params.get(self.count_query_param)
+        if count == 'exact':
+            self.count = queryset.count()
+        elif count == 'estimate':
+            self.count = estimate_count(queryset)
+
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            value, pk = decode_cursor(cursor)
+            queryset = queryset.filter(self.after(field, descending, value, pk))
+
+        #   One extra object tells if there is a next page
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+
+        self.next_cursor = None
+        if self.has_next:
+            last = page[-1]
+            self.next_cursor = encode_cursor(
+                getattr(last, 'keyset_value', None) if field is not None else None,
+                last.pk,
+            )
+        return page
+
+    @staticmethod
+    def after(field, descending, value, pk):
+        """
+            Filter on the objects after (value, pk) in the ordering
+        """
+        pk_after = Q(pk__lt=pk) if descending else Q(pk__gt=pk)
+        if field is None:
+            return pk_after
+
+        if value is None:
+            #   Only nulls are sorted after a null
+            return Q(**{field + '__isnull': True}) & pk_after
+
+        lookup = '__lt' if descending else '__gt'
+        return Q(**{field + lookup: value}) | \
+            (Q(**{field: value}) & pk_after) | \
+            Q(**{field + '__isnull': True})
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
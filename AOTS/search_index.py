@@ -0,0 +1,235 @@
+"""
+Search index over stars, identifiers, tags and spectra.
+
+Every registered model has a `SearchDocument` with the normalized (lower
+case, single spaced) search terms of the object, which is updated on save and
+removed on delete. The text of the documents is indexed for substring search:
+with a pg_trgm GIN index on PostgreSQL and an FTS5 trigram table on SQLite
+(created after migrate, see `create_index`). On other databases, and for
+search terms shorter than the trigrams, the documents are scanned.
+
+`search` returns the matching documents of all kinds, ranked by exact, prefix
+and substring matches of the title, then by kind (stars before identifiers,
+tags and spectra).
+"""
+
+import logging
+
+from django.apps import apps
+from django.db import connections, DatabaseError
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length
+from django.db.models.signals import post_save, post_delete, post_migrate
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'stars_searchdocument'
+FTS_TABLE = 'stars_searchdocument_fts'
+
+#   Order of the kinds in the ranking
+KIND_RANK = {'star': 4, 'identifier': 3, 'tag': 2, 'spectrum': 1}
+
+#   Registered models: model -> (kind, function returning the document)
+_registry = {}
+
+
+def normalize(text):
+    return ' '.join(str(text).split()).lower()
+
+
+def _document_model():
+    return apps.get_model('stars', 'SearchDocument')
+
+
+def register(model, kind, document):
+    """
+        Maintain the search document of the model on save and delete.
+
+        `document(instance)` returns a dictionary with the `project`, the
+        `star` (or None), the `title` and a list of search `terms`, or None
+        if the object should not be searchable.
+    """
+    _registry[model] = (kind, document)
+    label = model._meta.label_lower
+    post_save.connect(_update, sender=model, dispatch_uid='search_index_save_' + label)
+    post_delete.connect(_remove, sender=model, dispatch_uid='search_index_delete_' + label)
+
+
+def build_document(instance):
+    """
+        Unsaved SearchDocument of an object of a registered model, None if
+        the object is not searchable
+    """
+    kind, document = _registry[type(instance)]
+    values = document(instance)
+    if values is None:
+        return None
+
+    terms = [normalize(t) for t in [values['title']] + list(values['terms']) if t]
+    return _document_model()(
+        kind=kind,
+        object_id=instance.pk,
+        star=values['star'],
+        project=values['project'],
+        title=str(values['title'])[:200],
+        key=normalize(values['title'])[:200],
+        text=' | '.join(dict.fromkeys(terms)),
+    )
+
+
+def _update(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    document = build_document(instance)
+    if document is None:
+        _remove(sender, instance)
+        return
+
+    _document_model().objects.update_or_create(
+        kind=document.kind,
+        object_id=document.object_id,
+        defaults={
+            'star': document.star,
+            'project': document.project,
+            'title': document.title,
+            'key': document.key,
+            'text': document.text,
+        },
+    )
+
+
+def _remove(sender, instance, **kwargs):
+    kind = _registry[type(instance)][0]
+    _document_model().objects.filter(kind=kind, object_id=instance.pk).delete()
+
+
+def rebuild(batch_size=2000):
+    """
+        Recreate the documents of all registered models. Returns the number
+        of documents per kind.
+    """
+    SearchDocument = _document_model()
+    counts = {}
+    for model, (kind, _) in _registry.items():
+        SearchDocument.objects.filter(kind=kind).delete()
+
+        counts[kind], batch = 0, []
+        for instance in model.objects.iterator(chunk_size=batch_size):
+            document = build_document(instance)
+            if document is not None:
+                batch.append(document)
+            if len(batch) >= batch_size:
+                SearchDocument.objects.bulk_create(batch)
+                counts[kind] += len(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+        counts[kind] += len(batch)
+    return counts
+
+
+def create_index(using='default'):
+    """
+        Create the substring index of the document text, if the database
+        supports one
+    """
+    connection = connections[using]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS {table}_text_trgm ON {table} "
+                    "USING gin (text gin_trgm_ops)".format(table=TABLE)
+                )
+            elif connection.vendor == 'sqlite':
+                #   External content table, kept in sync by triggers
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(text, "
+                    "content='{table}', content_rowid='id', tokenize='trigram')"
+                    .format(fts=FTS_TABLE, table=TABLE)
+                )
+                for statement in [
+                    "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} "
+                    "BEGIN INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text); END",
+                    "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} "
+                    "BEGIN INSERT INTO {fts}({fts}, rowid, text) "
+                    "VALUES ('delete', old.id, old.text); END",
+                    "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} "
+                    "BEGIN INSERT INTO {fts}({fts}, rowid, text) "
+                    "VALUES ('delete', old.id, old.text); "
+                    "INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text); END",
+                ]:
+                    cursor.execute(statement.format(fts=FTS_TABLE, table=TABLE))
+                cursor.execute(
+                    "INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE)
+                )
+    except DatabaseError as e:
+        #   fx. pg_trgm can not be installed or SQLite has no trigram tokenizer
+        logger.warning("Search index not created, searches scan the documents: %s", e)
+
+
+def _create_index_after_migrate(sender, using='default', **kwargs):
+    if sender.label == 'stars':
+        create_index(using=using)
+
+
+post_migrate.connect(_create_index_after_migrate, dispatch_uid='search_index_create')
+
+
+def _has_fts(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [FTS_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def matching(q, kinds=None, using='default'):
+    """
+        Unordered queryset of the documents that contain q
+    """
+    documents = _document_model().objects.using(using)
+    if kinds:
+        documents = documents.filter(kind__in=kinds)
+
+    q = normalize(q)
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and len(q) >= 3 and _has_fts(connection):
+        #   A quoted string is a substring query for the trigram tokenizer
+        return documents.filter(id__in=RawSQL(
+            "SELECT rowid FROM {fts} WHERE {fts} MATCH %s".format(fts=FTS_TABLE),
+            ['"{}"'.format(q.replace('"', '""'))],
+        ))
+
+    #   On PostgreSQL the trigram index is used for LIKE '%q%'
+    return documents.filter(text__contains=q)
+
+
+def search(q, user=None, kinds=None, project=None, limit=50):
+    """
+        Ranked documents that contain q, restricted to the projects the user
+        can see if a user is given
+    """
+    documents = matching(q, kinds=kinds)
+    if project is not None:
+        documents = documents.filter(project=project)
+    if user is not None:
+        from AOTS.custom_permissions import get_allowed_objects_to_view_for_user
+        documents = get_allowed_objects_to_view_for_user(documents, user)
+
+    key = normalize(q)
+    return documents.select_related('project').annotate(
+        match=Case(
+            When(key__exact=key, then=Value(2)),
+            When(key__startswith=key, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        kind_rank=Case(
+            *[When(kind=kind, then=Value(rank)) for kind, rank in KIND_RANK.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+    ).order_by('-match', '-kind_rank', Length('key'), 'pk')[:limit]
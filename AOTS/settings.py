@@ -98,7 +98,9 @@ REST_FRAMEWORK = {
         'rest_framework_datatables.filters.DatatablesFilterBackend',
     ),
 
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework_datatables.pagination.DatatablesPageNumberPagination',
+    #   Page number and DataTables pagination, with a keyset mode for
+    #   iterating large listings (see AOTS.pagination)
+    'DEFAULT_PAGINATION_CLASS': 'AOTS.pagination.AOTSPagination',
     'PAGE_SIZE': 10,
 }
 
@@ -166,6 +168,56 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_ROOT = 'media'
 MEDIA_URL = '/media/'
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#   A file based cache is used, so that the web workers and the processes
+#   ingesting new data share the cached results (e.g. ephemerides)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env("CACHE_DIR", default='/tmp/aots_cache/'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+#   Length of the time buckets (in seconds) used to cache Sun and Moon
+#   ephemerides per observatory. Values within a bucket are interpolated.
+EPHEMERIS_CACHE_BUCKET = 600
+
+#   Sliding window (in seconds) over which the per-stage timings of the
+#   ingest pipelines are kept and aggregated
+INGEST_TIMING_WINDOW = 86400
+
+#   Radius (in degree) within which uploaded spectra, raw files and light
+#   curves are associated with an existing star
+STAR_MATCH_RADIUS = 0.1
+
+#   Directory with local catalog extracts (see stars.catalog_providers). If
+#   set, systems are populated from these files instead of Vizier and Simbad.
+CATALOG_LOCAL_DIR = env("CATALOG_LOCAL_DIR", default='')
+
+#   Time (in seconds) for which Vizier and Simbad responses are cached
+CATALOG_CACHE_TIMEOUT = 30 * 86400
+
+#   Number of catalogs queried at the same time for a system, and the time
+#   (in seconds) after which catalogs that did not answer are queried again
+#   in the background
+CATALOG_QUERY_WORKERS = 8
+CATALOG_QUERY_TIMEOUT = 10
+
+#   Time (in seconds) for which the projects a user can read and edit are
+#   cached. Changes of the project members clear the cache of those users.
+PROJECT_PERMISSION_CACHE_TIMEOUT = 60
+
+#   Time (in seconds) for which the serialized responses of the projects,
+#   observatories, methods, tags and star details are cached (see
+#   AOTS.versions). Changes of these objects give new ETags, so that the
+#   cached responses are not used anymore.
+API_RESPONSE_CACHE_TIMEOUT = 3600
+
 # Load specific settings for developement of production
 if env("DEVICE") in platform.node():
     from .settings_production import DEBUG, ALLOWED_HOSTS, DATABASES, LOGGING, DEFAULT_FROM_EMAIL
@@ -0,0 +1,288 @@
+"""
+HEALPix sky index for models with ra/dec coordinates (degree).
+
+Every registered model has an indexed integer `healpix` column that stores
+the nested HEALPix pixel (order ORDER) of its coordinates. The column is
+updated on save. `cone_search` turns a search radius, padded with the pixel
+size, into a few ranges of pixels that cover the cone, which can be looked
+up in the B-tree index, and then applies an exact great-circle filter.
+Matches therefore work the same near the poles and across RA = 0/360.
+
+For matching many positions at once, `SphericalTree` builds a KD-tree on
+the unit vectors of the coordinates.
+"""
+
+import math
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import Angle
+from astropy_healpix import HEALPix
+from scipy.spatial import cKDTree
+from django.db.models import F, Q
+from django.db.models.functions import (
+    ACos,
+    Cos,
+    Degrees,
+    Greatest,
+    Least,
+    Radians,
+    Sin,
+)
+from django.db.models.signals import pre_save
+
+#   Order of the stored pixels: nside = 2**16, pixels of ~3.2 arcsec
+ORDER = 16
+
+#   Resolution of the order 0 pixels (degree)
+ORDER_0_RESOLUTION = 58.6
+
+
+def ang2pix_many(ra, dec):
+    """
+        Nested HEALPix pixels (order ORDER) of arrays of coordinates
+        (degree). Invalid coordinates get None.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    valid = np.isfinite(ra) & np.isfinite(dec) & (np.abs(dec) <= 90.)
+
+    healpix = HEALPix(nside=2 ** ORDER, order='nested')
+    pixels = healpix.lonlat_to_healpix(
+        (ra[valid] % 360.) * u.deg,
+        dec[valid] * u.deg,
+    )
+
+    result = [None] * len(ra)
+    for i, pixel in zip(np.flatnonzero(valid), pixels.tolist()):
+        result[i] = int(pixel)
+    return result
+
+
+def ang2pix(ra, dec):
+    """
+        Nested HEALPix pixel (order ORDER) of the coordinates (degree), or
+        None if the coordinates are not valid
+    """
+    try:
+        ra, dec = float(ra), float(dec)
+    except (TypeError, ValueError):
+        return None
+    return ang2pix_many([ra], [dec])[0]
+
+
+def cone_ranges(ra, dec, radius):
+    """
+        Inclusive ranges of pixels (order ORDER) that cover the cone with
+        the given radius (degree) around ra, dec (degree)
+    """
+    #   Search on an order with pixels about the size of the radius, so
+    #   that only a handful of pixels are returned
+    if radius > 0:
+        order = int(math.floor(math.log2(ORDER_0_RESOLUTION / radius)))
+    else:
+        order = ORDER
+    order = min(max(order, 0), ORDER)
+
+    #   cone_search_lonlat is not conservative, it can miss pixels that
+    #   overlap the edge of the cone. The radius is padded with the pixel
+    #   resolution, which is larger than the largest distance between the
+    #   center and a corner of a pixel.
+    padding = ORDER_0_RESOLUTION / 2 ** order
+
+    healpix = HEALPix(nside=2 ** order, order='nested')
+    pixels = np.sort(healpix.cone_search_lonlat(
+        (ra % 360.) * u.deg,
+        dec * u.deg,
+        radius=(max(radius, 0.) + padding) * u.deg,
+    ))
+
+    #   Every pixel contains 4**(ORDER - order) consecutive pixels on ORDER,
+    #   merge neighbouring pixels into one range
+    shift = 2 * (ORDER - order)
+    ranges = []
+    for pixel in pixels.tolist():
+        start, end = pixel << shift, ((pixel + 1) << shift) - 1
+        if ranges and ranges[-1][1] + 1 == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+    return [tuple(r) for r in ranges]
+
+
+def parse_coordinates(ra, dec):
+    """
+        Convert ra and dec given in degree or sexagesimal (ra in hours, fx.
+        '18:36:56.3' or '18h36m56.3s') to degree
+    """
+    ra, dec = str(ra).strip(), str(dec).strip()
+
+    if any(c in ra for c in ': hms'):
+        ra = Angle(ra, unit='hour').degree
+    else:
+        ra = Angle(ra, unit='degree').degree
+
+    dec = Angle(dec, unit='degree').degree
+
+    return ra, dec
+
+
+def angular_distance(ra, dec, ra_field='ra', dec_field='dec'):
+    """
+        Database expression for the great-circle distance (degree) between
+        the object and ra, dec (degree)
+    """
+    ra_r, dec_r = math.radians(ra), math.radians(dec)
+
+    cos_distance = (
+            Sin(Radians(F(dec_field))) * math.sin(dec_r) +
+            Cos(Radians(F(dec_field))) * math.cos(dec_r) *
+            Cos(Radians(F(ra_field)) - ra_r)
+    )
+
+    #   Clip rounding errors, otherwise ACOS fails for identical positions
+    return Degrees(ACos(Least(Greatest(cos_distance, -1.), 1.)))
+
+
+def cone_search(queryset, ra, dec, radius, field='healpix', ra_field='ra',
+                dec_field='dec'):
+    """
+        Filter the queryset on objects within radius (degree) from ra, dec
+        (degree). The returned objects are annotated with their `distance`
+        (degree), so that fx. `.order_by('distance')` returns the closest
+        object first.
+
+        Objects without a pixel (created before the index existed) are not
+        found, see the `build_sky_index` management command.
+    """
+    ranges = cone_ranges(ra, dec, radius)
+
+    pixels = Q()
+    for start, end in ranges:
+        pixels |= Q(**{field + '__range': (start, end)})
+
+    return queryset.filter(pixels) \
+        .annotate(distance=angular_distance(ra, dec, ra_field, dec_field)) \
+        .filter(distance__lte=radius)
+
+
+def separation(ra1, dec1, ra2, dec2):
+    """
+        Great-circle distance (degree) between two positions (degree)
+    """
+    xyz = radec_to_xyz([ra1, ra2], [dec1, dec2])
+    chord = np.linalg.norm(xyz[0] - xyz[1])
+    return float(np.degrees(2. * np.arcsin(min(chord / 2., 1.))))
+
+
+def radec_to_xyz(ra, dec):
+    """
+        Unit vectors (N x 3) of the coordinates (degree)
+    """
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    return np.column_stack([
+        np.cos(dec) * np.cos(ra),
+        np.cos(dec) * np.sin(ra),
+        np.sin(dec),
+    ])
+
+
+class SphericalTree:
+    """
+        KD-tree on the unit vectors of a list of coordinates (degree), used to
+        match many positions in one pass. Distances are converted between
+        angles and chords, so matches are exact great-circle matches.
+    """
+
+    def __init__(self, ra, dec):
+        self.size = len(ra)
+        self.tree = cKDTree(radec_to_xyz(ra, dec)) if self.size > 0 else None
+
+    @staticmethod
+    def chord(angle):
+        return 2. * np.sin(np.radians(angle) / 2.)
+
+    @staticmethod
+    def angle(chord):
+        return np.degrees(2. * np.arcsin(np.clip(chord / 2., 0., 1.)))
+
+    def nearest(self, ra, dec, radius):
+        """
+            Closest entry within radius (degree) for every position
+
+            Returns
+            -------
+            index               : `numpy.ndarray`
+                Index of the closest entry, -1 if there is none
+            separation          : `numpy.ndarray`
+                Separation (degree), nan if there is no match
+        """
+        n = len(np.atleast_1d(ra))
+        index = np.full(n, -1, dtype=int)
+        separation = np.full(n, np.nan)
+        if self.tree is None or n == 0:
+            return index, separation
+
+        distance, nearest = self.tree.query(
+            radec_to_xyz(ra, dec),
+            distance_upper_bound=self.chord(radius),
+        )
+        found = np.isfinite(distance)
+        index[found] = nearest[found]
+        separation[found] = self.angle(distance[found])
+        return index, separation
+
+    def within(self, ra, dec, radius):
+        """
+            All entries within radius (degree) of one position
+
+            Returns
+            -------
+            index               : `numpy.ndarray`
+                Indices of the entries
+            separation          : `numpy.ndarray`
+                Separations (degree)
+        """
+        if self.tree is None:
+            return np.zeros(0, dtype=int), np.zeros(0)
+
+        xyz = radec_to_xyz([ra], [dec])[0]
+        index = np.asarray(
+            self.tree.query_ball_point(xyz, self.chord(radius)),
+            dtype=int,
+        )
+        chords = np.linalg.norm(self.tree.data[index] - xyz, axis=1)
+        return index, self.angle(chords)
+
+    def count(self, ra, dec, radius):
+        """
+            Number of entries within radius (degree) of every position
+        """
+        n = len(np.atleast_1d(ra))
+        if self.tree is None or n == 0:
+            return np.zeros(n, dtype=int)
+        return np.asarray(self.tree.query_ball_point(
+            radec_to_xyz(ra, dec),
+            self.chord(radius),
+            return_length=True,
+        ), dtype=int)
+
+
+def update_healpix(sender, instance, **kwargs):
+    """
+        pre_save handler that keeps the pixel of an object up to date
+    """
+    instance.healpix = ang2pix(instance.ra, instance.dec)
+
+
+def register(model):
+    """
+        Maintain the `healpix` column of the model on save
+    """
+    pre_save.connect(
+        update_healpix,
+        sender=model,
+        dispatch_uid='sky_index_{}'.format(model._meta.label_lower),
+    )
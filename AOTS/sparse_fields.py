@@ -0,0 +1,92 @@
+"""
+Sparse fieldsets of the API.
+
+GET requests select the returned fields of the objects with `fields` and
+`expand`:
+
+    /api/observations/spectra/?fields=pk,hjd
+    /api/observations/spectra/?fields=pk,hjd&expand=star
+
+`fields` lists the returned fields, `expand` adds nested fields (the
+`expandable_fields` of the serializer Meta, fx. the star of a spectrum). With
+only `expand`, all plain fields are returned plus the expanded nested fields.
+DataTables requests return the fields of their columns, as the DataTables
+renderer would.
+
+Fields that are not returned are not computed, and the `setup_eager_loading`
+of the serializers skips the joins and prefetches that only they need.
+"""
+
+from rest_framework_datatables.utils import get_param
+
+
+def split(value):
+    return {f.strip() for f in value.split(',') if f.strip()}
+
+
+def requested_fields(request, serializer_class):
+    """
+        Set of requested field names, None if all fields are requested
+    """
+    if request is None or request.method != 'GET':
+        return None
+    meta = getattr(serializer_class, 'Meta', None)
+
+    accepted_renderer = getattr(request, 'accepted_renderer', None)
+    if getattr(accepted_renderer, 'format', None) == 'datatables':
+        columns, i = set(), 0
+        while get_param(request, 'columns[%d][data]' % i) is not None:
+            columns.add(get_param(request, 'columns[%d][data]' % i).split('.')[0])
+            i += 1
+        if not columns:
+            return None
+        return columns | set(getattr(meta, 'datatables_always_serialize', ())) | \
+            split(request.query_params.get('keep', ''))
+
+    params = getattr(request, 'query_params', request.GET)
+    if 'fields' not in params and 'expand' not in params:
+        return None
+
+    expand = split(params.get('expand', ''))
+    if 'fields' in params:
+        return split(params['fields']) | expand
+
+    all_fields = set(getattr(meta, 'fields', None) or ())
+    return all_fields - set(getattr(meta, 'expandable_fields', ())) | expand
+
+
+def wanted(fields, *names):
+    """
+        True if any of the fields is requested (fields is None: all are)
+    """
+    return fields is None or any(name in fields for name in names)
+
+
+class SparseFieldsMixin:
+    """
+        Serializer mixin that returns only the requested fields
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = requested_fields(self.context.get('request'), type(self))
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class EagerLoadingMixin:
+    """
+        Viewset mixin that loads the relations the serializer needs for the
+        requested fields with the objects (the `setup_eager_loading` of the
+        serializer)
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_class = self.get_serializer_class()
+        if hasattr(serializer_class, 'setup_eager_loading'):
+            queryset = serializer_class.setup_eager_loading(
+                queryset, fields=requested_fields(self.request, serializer_class),
+            )
+        return queryset
@@ -21,6 +21,8 @@ from django.urls import include, path
 from django.views.generic import RedirectView, TemplateView
 from rest_framework import routers
 
+from AOTS.export import export_table
+from observations.api.views import coneSearch
 from stars import views as star_views
 from stars.api.views import ProjectViewSet
 
@@ -83,6 +85,8 @@ urlpatterns = [
                   ),
 
                   path('api/', include(router.urls), name='project-api'),
+                  path('api/cone/', coneSearch, name='cone-search'),
+                  path('api/export/<slug:table>/', export_table, name='export'),
                   path(
                       'api/systems/',
                       include("stars.api.urls", namespace='systems-api')
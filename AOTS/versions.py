@@ -0,0 +1,194 @@
+"""
+Change versions of the projects, for HTTP caching of the API.
+
+Every registered model has a version per project in the cache, which is
+increased after an object of the model in that project is saved or deleted
+(after the transaction is committed). The version is the time of the last
+change in milliseconds, or the previous version + 1 if that is larger, so
+that it increases monotonically and also gives the Last-Modified time.
+
+`ConditionalGetMixin` derives the ETag of the API responses from the URL,
+the permissions of the user and the versions of the models and projects a
+response depends on. Requests with a matching `If-None-Match` get 304 Not
+Modified before anything is loaded or serialized, and the serialized data of
+the other responses is cached under their ETag for API_RESPONSE_CACHE_TIMEOUT
+seconds.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+def version_key(label, project_id):
+    return 'api_version:{}:{}'.format(label, project_id)
+
+
+def now():
+    return int(time.time() * 1000)
+
+
+def bump(label, project_ids):
+    """
+        Increase the version of the model (label) in the projects
+    """
+    keys = [version_key(label, pk) for pk in set(project_ids) if pk is not None]
+    if not keys:
+        return
+    versions = cache.get_many(keys)
+    timestamp = now()
+    cache.set_many(
+        {key: max(versions.get(key, 0) + 1, timestamp) for key in keys},
+        timeout=None,
+    )
+
+
+def bump_on_commit(label, project_ids):
+    project_ids = set(project_ids)
+    transaction.on_commit(lambda: bump(label, project_ids))
+
+
+def get_versions(labels, project_ids):
+    """
+        Versions of the models (labels) in the projects. Versions that are
+        not in the cache (anymore) start at the current time.
+    """
+    keys = [version_key(label, pk) for label in labels for pk in project_ids]
+    versions = cache.get_many(keys)
+    missing = {key: now() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def register(model, project=None):
+    """
+        Bump the version of the model in the project of its objects on save
+        and delete. `project(instance)` returns the project pk, by default
+        `instance.project_id`.
+    """
+    label = model._meta.label_lower
+    if project is None:
+        def project(instance):
+            return instance.project_id
+
+    def changed(sender, instance, raw=False, **kwargs):
+        if not raw:
+            bump_on_commit(label, [project(instance)])
+
+    uid = 'api_version_{}'.format(label)
+    post_save.connect(changed, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(changed, sender=model, weak=False, dispatch_uid=uid)
+
+
+def register_m2m(model, through):
+    """
+        Bump the version of the model on changes of a many-to-many relation
+        between objects of the same project (fx. the tags of the stars)
+    """
+    label = model._meta.label_lower
+
+    def changed(sender, instance, action, **kwargs):
+        if action.startswith('post_'):
+            bump_on_commit(label, [instance.project_id])
+
+    m2m_changed.connect(
+        changed, sender=through, weak=False,
+        dispatch_uid='api_version_{}'.format(through._meta.label_lower),
+    )
+
+
+class ConditionalGetMixin:
+    """
+        Viewset mixin with ETags, Last-Modified, conditional GET and a cache
+        of the serialized responses for the `conditional_actions`. The
+        responses depend on the `version_models` (labels) in the projects
+        of `get_version_projects`.
+    """
+
+    conditional_actions = ('list', 'retrieve')
+    version_models = ()
+
+    def get_version_projects(self, request):
+        """
+            Pks of the projects the response can depend on: the projects the
+            user can see
+        """
+        from stars.models import Project
+
+        projects = Project.objects.values_list('pk', 'is_public')
+        user = request.user
+        if user.is_superuser:
+            return [pk for pk, is_public in projects]
+        readable = set() if user.is_anonymous else user.get_read_project_ids()
+        return [pk for pk, is_public in projects if is_public or pk in readable]
+
+    def get_permission_key(self, request):
+        user = request.user
+        if user.is_anonymous:
+            return 'anonymous'
+        if user.is_superuser:
+            return 'superuser'
+        return sorted(user.get_read_project_ids())
+
+    def get_etag(self, request):
+        """
+            ETag and Last-Modified time (seconds) of the response
+        """
+        project_ids = sorted(self.get_version_projects(request))
+        versions = get_versions(self.version_models, project_ids)
+        key = json.dumps([
+            request.build_absolute_uri(),
+            request.accepted_media_type,
+            self.get_permission_key(request),
+            project_ids,
+            versions,
+        ])
+        etag = '"{}"'.format(hashlib.sha1(key.encode()).hexdigest())
+        last_modified = max(versions) // 1000 if versions else None
+        return etag, last_modified
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+
+        etag, last_modified = self.get_etag(request)
+        #   Only the ETag is compared: the response also changes when the
+        #   permissions of the user change, which the time does not show
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            cache_key = 'api_response:' + etag
+            data = cache.get(cache_key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(
+                    cache_key, response.data,
+                    timeout=getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 3600),
+                )
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        #   Revalidated on every use, with the ETag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Accept', 'Cookie'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
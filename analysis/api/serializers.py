@@ -4,11 +4,13 @@ from astropy.time import Time
 from django.urls import reverse
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
+from AOTS.sparse_fields import SparseFieldsMixin, wanted
+
 from analysis.models import Method, DataSet, Parameter
 from stars.api.serializers import SimpleStarSerializer
 
 
-class MethodSerializer(ModelSerializer):
+class MethodSerializer(SparseFieldsMixin, ModelSerializer):
     data_type_display = SerializerMethodField()
 
     class Meta:
@@ -30,7 +32,7 @@ class MethodSerializer(ModelSerializer):
         return obj.get_data_type_display()
 
 
-class DataSetListSerializer(ModelSerializer):
+class DataSetListSerializer(SparseFieldsMixin, ModelSerializer):
     star = SerializerMethodField()
     method = SerializerMethodField()
     href = SerializerMethodField()
@@ -53,7 +55,17 @@ class DataSetListSerializer(ModelSerializer):
             'added_on',
         ]
         read_only_fields = ('pk', 'file_url',)
-
+        expandable_fields = ('star', 'method')
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wanted(fields, 'href'):
+            queryset = queryset.select_related('project')
+        if wanted(fields, 'star'):
+            queryset = queryset.select_related('star__project')
+        if wanted(fields, 'method'):
+            queryset = queryset.select_related('method')
+        return queryset
 
     def get_added_on(self, obj):
         return Time(obj.history.earliest().history_date, precision=0).iso
@@ -80,7 +92,7 @@ class DataSetListSerializer(ModelSerializer):
         return obj.datafile.url
 
 
-class ParameterListSerializer(ModelSerializer):
+class ParameterListSerializer(SparseFieldsMixin, ModelSerializer):
     project = SerializerMethodField()
 
     class Meta:
@@ -99,6 +111,12 @@ class ParameterListSerializer(ModelSerializer):
         ]
         read_only_fields = ('pk',)
 
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wanted(fields, 'project'):
+            queryset = queryset.select_related('star__project')
+        return queryset
+
     def get_project(self, obj):
         return obj.star.project.name
 
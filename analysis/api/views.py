@@ -3,6 +3,8 @@ from rest_framework import viewsets
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
+from AOTS.sparse_fields import EagerLoadingMixin
+from AOTS.versions import ConditionalGetMixin
 from analysis.auxil import process_datasets
 from analysis.models import Method, DataSet, Parameter
 from .filter import DataSetFilter, MethodFilter, ParameterFilter
@@ -13,7 +15,7 @@ from .serializers import MethodSerializer, DataSetListSerializer, ParameterListS
 # DataSet
 # ===============================================================
 
-class DatasetViewSet(viewsets.ModelViewSet):
+class DatasetViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = DataSet.objects.all()
     serializer_class = DataSetListSerializer
 
@@ -25,10 +27,12 @@ class DatasetViewSet(viewsets.ModelViewSet):
 # Methods
 # ===============================================================
 
-class MethodViewSet(viewsets.ModelViewSet):
+class MethodViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Method.objects.all()
     serializer_class = MethodSerializer
 
+    version_models = ('analysis.method',)
+
     filter_backends = (DjangoFilterBackend,)
     filterset_class = MethodFilter
 
@@ -37,7 +41,7 @@ class MethodViewSet(viewsets.ModelViewSet):
 # Parameter
 # ===============================================================
 
-class ParameterViewSet(viewsets.ModelViewSet):
+class ParameterViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Parameter.objects.all()
     serializer_class = ParameterListSerializer
 
@@ -1,8 +1,9 @@
 import random
 
-from django.db.models import F, ExpressionWrapper, FloatField
-
 from analysis.models import DataSource, DataSet, Method, DerivedParameter
+from AOTS import sky_index
+from observations.auxil import timing
+from stars.association import star_association
 from stars.models import Star
 from . import read_datasets
 
@@ -70,22 +71,28 @@ def sort_modified_created(model):
         return datetime.fromisoformat("19700101")
 
 
+@timing.timed_pipeline('process_analysis_file')
 def process_analysis_file(file_id):
     #   analfile == dataset
     analfile = DataSet.objects.get(pk=file_id)
 
     try:
-        data = analfile.get_data()
+        with timing.stage('read_file'):
+            data = analfile.get_data()
     except Exception as e:
         return False, 'Not added, file has wrong format / file is unreadable'
 
     # read the basic data
     try:
-        systemname, ra, dec, name, note, reference, atype = read_datasets.get_basic_info(data)
+        with timing.stage('extract_header_info'):
+            systemname, ra, dec, name, note, reference, atype = read_datasets.get_basic_info(data)
     except Exception as e:
         print(e)
         return False, 'Not added, basic info unreadable'
 
+    #   Timings of analysis files are grouped by method instead of instrument
+    timing.set_instrument(atype)
+
     #   Filter Method for project and slug
     d_method = Method.objects.filter(slug__exact=atype)
     d_method = d_method.filter(project__exact=analfile.project)
@@ -116,29 +123,24 @@ def process_analysis_file(file_id):
     analfile.save()
 
     # -- try to find corresponding star
-    if ra != 0.0 and dec != 0.0:
-        star = Star.objects.filter(ra__range=(ra - 0.01, ra + 0.01),
-                                   dec__range=(dec - 0.01, dec + 0.01),
-                                   project__exact=analfile.project.pk)
-    else:
-        star = Star.objects.filter(
-            name__iexact=systemname,
-            project__exact=analfile.project.pk,
-        )
-        if not star:
-            #   There is no way to add this star, cause no coordinates are
-            #   known.
-            return False, "Not added, no system information present"
+    with timing.stage('star_match'):
+        if ra != 0.0 and dec != 0.0:
+            star = star_association.nearest(analfile.project, ra, dec, 0.01)
+        else:
+            star = Star.objects.filter(
+                name__iexact=systemname,
+                project__exact=analfile.project.pk,
+            ).annotate(distance=sky_index.angular_distance(ra, dec)) \
+                .order_by('distance').first()
+        star_found = star is not None
+
+    if not star_found and (ra == 0.0 or dec == 0.0):
+        #   There is no way to add this star, cause no coordinates are
+        #   known.
+        return False, "Not added, no system information present"
 
     message += "Validated the analysis file"
-    if star:
-        #   There is an existing star, pick the closest star
-        star = star.annotate(
-            distance=ExpressionWrapper(
-                ((F('ra') - ra) ** 2 + (F('dec') - dec) ** 2) ** (1. / 2.),
-                output_field=FloatField()
-            )
-        ).order_by('distance')[0]
+    if star_found:
         star.dataset_set.add(analfile)
         message += f", added to existing System {star} "
         message += f"(_r = {star.distance})"
@@ -157,7 +159,8 @@ def process_analysis_file(file_id):
 
     # -- Add parameters
     try:
-        npars = create_parameters(analfile, data)
+        with timing.stage('parameters'):
+            npars = create_parameters(analfile, data)
         if npars == 0:
             analfile.valid = False
             analfile.save()
@@ -174,11 +177,12 @@ def process_analysis_file(file_id):
 
     # -- Check if star already has this type of dataset, if so, replace
     #   only do so at the end so only valid datasets can replace an old one.
-    similar = sorted(DataSet.objects.filter(
-        method__exact=analfile.method,
-        star__exact=star,
-        project__exact=analfile.project.pk,
-    ), key=sort_modified_created, reverse=True)
+    with timing.stage('duplicates'):
+        similar = sorted(DataSet.objects.filter(
+            method__exact=analfile.method,
+            star__exact=star,
+            project__exact=analfile.project.pk,
+        ), key=sort_modified_created, reverse=True)
 
     if len(similar) > 1:
         #   Update old dataset entry
@@ -8,6 +8,8 @@ from simple_history.models import HistoricalRecords
 
 from analysis.auxil import fileio
 from analysis.auxil import plot_datasets
+from AOTS import versions
+from stars import counters
 from stars.models import Star, Project
 # -- all constants are the roud_value function are imported from default values
 from .default_values import *
@@ -235,3 +237,10 @@ def dataSet_post_delete_handler(sender, **kwargs):
     if not same_datafile:
         storage, path = analmethod.datafile.storage, analmethod.datafile.path
         storage.delete(path)
+
+
+# -- keep the number of datasets of the star up to date
+counters.register(DataSet, 'n_datasets')
+
+# -- bump the API version of the methods of the project on changes
+versions.register(Method)
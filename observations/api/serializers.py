@@ -1,7 +1,10 @@
 from astropy.time import Time
+from django.db.models import OuterRef, Prefetch, Subquery
 from django.urls import reverse
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
+from AOTS.sparse_fields import SparseFieldsMixin, wanted
+
 from observations.models import (
     Spectrum,
     UserInfo,
@@ -9,15 +12,42 @@ from observations.models import (
     RawSpecFile,
     LightCurve,
     Observatory,
+    UploadSession,
 )
 from stars.api.serializers import SimpleStarSerializer
+from stars.models import Star
+
+
+def first_history(model):
+    """
+        Annotations with the date and user name of the first history record
+        (the upload) of the objects of the model
+    """
+    history = model.history.model.objects.filter(id=OuterRef('pk')) \
+        .order_by('history_date', 'history_id')
+    return {
+        'first_history_date': Subquery(history.values('history_date')[:1]),
+        'first_history_user': Subquery(history.values('history_user__username')[:1]),
+    }
+
+
+def get_first_history(obj):
+    """
+        Date and user name of the first history record, from the annotations
+        if available
+    """
+    if hasattr(obj, 'first_history_date'):
+        return obj.first_history_date, obj.first_history_user
+    first = obj.history.earliest()
+    user = first.history_user.username if first.history_user is not None else None
+    return first.history_date, user
 
 
 # ===============================================================
 # SPECTRA
 # ===============================================================
 
-class SpectrumListSerializer(ModelSerializer):
+class SpectrumListSerializer(SparseFieldsMixin, ModelSerializer):
     star = SerializerMethodField()
     specfiles = SerializerMethodField()
     href = SerializerMethodField()
@@ -40,6 +70,17 @@ class SpectrumListSerializer(ModelSerializer):
             'resolution',
         ]
         read_only_fields = ('pk',)
+        expandable_fields = ('star', 'specfiles')
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wanted(fields, 'href'):
+            queryset = queryset.select_related('project')
+        if wanted(fields, 'star'):
+            queryset = queryset.select_related('star__project')
+        if wanted(fields, 'specfiles'):
+            queryset = queryset.prefetch_related('specfile_set')
+        return queryset
 
     def get_star(self, obj):
         if obj.star is None:
@@ -48,14 +89,14 @@ class SpectrumListSerializer(ModelSerializer):
             return SimpleStarSerializer(obj.star).data
 
     def get_specfiles(self, obj):
-        specfiles = SimpleSpecFileSerializer(obj.specfile_set, many=True).data
+        specfiles = SimpleSpecFileSerializer(obj.specfile_set.all(), many=True).data
         return specfiles
 
     def get_href(self, obj):
         return reverse('observations:spectrum_detail', kwargs={'project': obj.project.slug, 'spectrum_id': obj.pk})
 
 
-class SpectrumSerializer(ModelSerializer):
+class SpectrumSerializer(SparseFieldsMixin, ModelSerializer):
     star = SerializerMethodField()
     observatory = SerializerMethodField()
     specfiles = SerializerMethodField()
@@ -84,6 +125,19 @@ class SpectrumSerializer(ModelSerializer):
             'resolution',
         ]
         read_only_fields = ('pk',)
+        expandable_fields = ('star', 'observatory', 'specfiles')
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wanted(fields, 'href'):
+            queryset = queryset.select_related('project')
+        if wanted(fields, 'star'):
+            queryset = queryset.select_related('star__project')
+        if wanted(fields, 'observatory'):
+            queryset = queryset.select_related('observatory')
+        if wanted(fields, 'specfiles'):
+            queryset = queryset.prefetch_related('specfile_set')
+        return queryset
 
     def get_star(self, obj):
         if obj.star is None:
@@ -99,14 +153,14 @@ class SpectrumSerializer(ModelSerializer):
             return ''
 
     def get_specfiles(self, obj):
-        specfiles = SimpleSpecFileSerializer(obj.specfile_set, many=True).data
+        specfiles = SimpleSpecFileSerializer(obj.specfile_set.all(), many=True).data
         return specfiles
 
     def get_href(self, obj):
         return reverse('observations:spectrum_detail', kwargs={'project': obj.project.slug, 'spectrum_id': obj.pk})
 
 
-class UserInfoSerializer(ModelSerializer):
+class UserInfoSerializer(SparseFieldsMixin, ModelSerializer):
     spectrum = SerializerMethodField()
     observatory = SerializerMethodField()
 
@@ -134,7 +188,7 @@ class UserInfoSerializer(ModelSerializer):
 # SPECFILE
 # ===============================================================
 
-class SpecFileSerializer(ModelSerializer):
+class SpecFileSerializer(SparseFieldsMixin, ModelSerializer):
     star = SerializerMethodField()
     star_pk = SerializerMethodField()
     spectrum = SerializerMethodField()
@@ -159,6 +213,17 @@ class SpecFileSerializer(ModelSerializer):
             'project',
         ]
         read_only_fields = ('pk', 'star', 'star_pk')
+        expandable_fields = ('star',)
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wanted(fields, 'star', 'spectrum'):
+            queryset = queryset.select_related('project')
+        if wanted(fields, 'star', 'star_pk', 'spectrum'):
+            queryset = queryset.select_related('spectrum__star')
+        if wanted(fields, 'added_on'):
+            queryset = queryset.annotate(**first_history(SpecFile))
+        return queryset
 
     def get_star(self, obj):
         if obj.spectrum is None or obj.spectrum.star is None:
@@ -183,7 +248,8 @@ class SpecFileSerializer(ModelSerializer):
         )
 
     def get_added_on(self, obj):
-        return Time(obj.history.earliest().history_date, precision=0).iso
+        date = get_first_history(obj)[0]
+        return '' if date is None else Time(date, precision=0).iso
 
     def get_filename(self, obj):
         return obj.specfile.name.split('/')[-1]
@@ -205,7 +271,7 @@ class SimpleSpecFileSerializer(ModelSerializer):
 # RAWSPECFILE
 # ===============================================================
 
-class RawSpecFileSerializer(ModelSerializer):
+class RawSpecFileSerializer(SparseFieldsMixin, ModelSerializer):
     systems = SerializerMethodField()
     added_on = SerializerMethodField()
     filename = SerializerMethodField()
@@ -228,6 +294,25 @@ class RawSpecFileSerializer(ModelSerializer):
             'added_by',
         ]
         read_only_fields = ('pk', 'systems',)
+        expandable_fields = ('systems',)
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wanted(fields, 'systems'):
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'specfile',
+                    queryset=SpecFile.objects.select_related('project', 'spectrum__star'),
+                ),
+                Prefetch('star', queryset=Star.objects.select_related('project')),
+            )
+        else:
+            for name in ['specfile', 'star']:
+                if wanted(fields, name):
+                    queryset = queryset.prefetch_related(name)
+        if wanted(fields, 'added_on', 'added_by'):
+            queryset = queryset.annotate(**first_history(RawSpecFile))
+        return queryset
 
     def get_systems(self, obj):
         SystemDict = {}
@@ -256,23 +341,22 @@ class RawSpecFileSerializer(ModelSerializer):
         return SystemDict
 
     def get_added_on(self, obj):
-        return Time(obj.history.earliest().history_date, precision=0).iso
+        date = get_first_history(obj)[0]
+        return '' if date is None else Time(date, precision=0).iso
 
     def get_filename(self, obj):
         return obj.rawfile.name.split('/')[-1]
 
     def get_added_by(self, obj):
-        if obj.history.earliest().history_user is None:
-            return '-'
-
-        return obj.history.earliest().history_user.username
+        user = get_first_history(obj)[1]
+        return '-' if user is None else user
 
 
 # ===============================================================
 # Licht Curves
 # ===============================================================
 
-class LightCurveSerializer(ModelSerializer):
+class LightCurveSerializer(SparseFieldsMixin, ModelSerializer):
     star = SerializerMethodField()
     href = SerializerMethodField()
 
@@ -291,6 +375,15 @@ class LightCurveSerializer(ModelSerializer):
             'href',
         ]
         read_only_fields = ('pk',)
+        expandable_fields = ('star',)
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wanted(fields, 'href'):
+            queryset = queryset.select_related('project')
+        if wanted(fields, 'star'):
+            queryset = queryset.select_related('star__project')
+        return queryset
 
     def get_star(self, obj):
         if obj.star is None:
@@ -306,7 +399,7 @@ class LightCurveSerializer(ModelSerializer):
 # Observatory
 # ===============================================================
 
-class ObservatorySerializer(ModelSerializer):
+class ObservatorySerializer(SparseFieldsMixin, ModelSerializer):
     class Meta:
         model = Observatory
         fields = [
@@ -324,3 +417,74 @@ class ObservatorySerializer(ModelSerializer):
             'weatherurl',
         ]
         read_only_fields = ('pk',)
+
+
+# ===============================================================
+# UPLOAD SESSIONS
+# ===============================================================
+
+class UploadSessionSerializer(ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'upload_id',
+            'project',
+            'filetype',
+            'filename',
+            'size',
+            'received',
+            'status',
+            'message',
+            'specfile',
+            'rawfile',
+        ]
+        read_only_fields = fields
+
+
+# ===============================================================
+# CONE SEARCH
+# ===============================================================
+
+class ConeSearchSerializer(ModelSerializer):
+    """
+    Base serializer for the results of a cone search. The objects need to be
+    annotated with their `distance` (degree), which is returned in arcsec.
+    """
+    distance = SerializerMethodField()
+    project = SerializerMethodField()
+    href = SerializerMethodField()
+
+    def get_distance(self, obj):
+        return obj.distance * 3600.
+
+    def get_project(self, obj):
+        return obj.project.slug
+
+
+class ConeStarSerializer(ConeSearchSerializer):
+    class Meta:
+        model = Star
+        fields = ['pk', 'name', 'project', 'ra', 'dec', 'distance', 'href']
+
+    def get_href(self, obj):
+        return reverse('systems:star_detail', kwargs={'project': obj.project.slug, 'star_id': obj.pk})
+
+
+class ConeSpectrumSerializer(ConeSearchSerializer):
+    class Meta:
+        model = Spectrum
+        fields = ['pk', 'objectname', 'project', 'star', 'ra', 'dec', 'hjd', 'instrument',
+                  'distance', 'href']
+
+    def get_href(self, obj):
+        return reverse('observations:spectrum_detail', kwargs={'project': obj.project.slug, 'spectrum_id': obj.pk})
+
+
+class ConeLightCurveSerializer(ConeSearchSerializer):
+    class Meta:
+        model = LightCurve
+        fields = ['pk', 'objectname', 'project', 'star', 'ra', 'dec', 'hjd', 'instrument',
+                  'distance', 'href']
+
+    def get_href(self, obj):
+        return reverse('observations:lightcurve_detail', kwargs={'project': obj.project.slug, 'lightcurve_id': obj.pk})
@@ -7,6 +7,7 @@ from .views import (
     SpecFileViewSet,
     RawSpecFileViewSet,
     processSpectrum,
+    getSpectrumData,
     processSpecfile,
     processRawSpecfile,
     getSpecfileHeader,
@@ -18,7 +19,12 @@ from .views import (
     getRawSpecfilePath,
     getSpecfileRawPath,
     getLightCurvePath,
-    bulkUploadSpectra, bulkDownloadSpectra
+    getLightCurveData,
+    bulkUploadSpectra, bulkDownloadSpectra,
+    createUploadSession,
+    uploadSessionChunk,
+    finalizeUploadSession,
+    getIngestTimings,
 )
 
 app_name = 'observations-api'
@@ -39,6 +45,11 @@ urlpatterns = [
         processSpectrum,
         name='process_spectrum',
     ),
+    path(
+        'spectra/<int:spectrum_pk>/data/',
+        getSpectrumData,
+        name='spectrum_data',
+    ),
     #    SpecFiles
     path(
         'specfiles/<int:specfile_pk>/process/',
@@ -87,11 +98,37 @@ urlpatterns = [
         getLightCurvePath,
         name='lightcurve_path',
     ),
+    path(
+        'lightcurves/<int:lightcurve_pk>/data/',
+        getLightCurveData,
+        name='lightcurve_data',
+    ),
     path(
         'api-spec-upload/',
         bulkUploadSpectra,
         name='api-spec-upload',
     ),
+    #    Ingest timings
+    path(
+        'ingest-timings/',
+        getIngestTimings,
+        name='ingest_timings',
+    ),
+    path(
+        'api-upload/',
+        createUploadSession,
+        name='api-upload',
+    ),
+    path(
+        'api-upload/<uuid:upload_id>/',
+        uploadSessionChunk,
+        name='api-upload-chunk',
+    ),
+    path(
+        'api-upload/<uuid:upload_id>/finalize/',
+        finalizeUploadSession,
+        name='api-upload-finalize',
+    ),
     path(
         'api-spec-download/',
         bulkDownloadSpectra,
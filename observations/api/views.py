@@ -1,3 +1,5 @@
+import math
+
 # from rest_framework.generics import (
 # CreateAPIView,
 # DestroyAPIView,
@@ -6,20 +8,20 @@
 # RetrieveAPIView,
 # RetrieveUpdateAPIView
 # )
-import os
-import shutil
-import tempfile
-import zipfile
-import random
-
-from django.http import FileResponse
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from django.core.exceptions import ObjectDoesNotExist
 
-from observations.auxil import read_spectrum, read_lightcurve
+from AOTS import sky_index
+from AOTS.custom_permissions import get_allowed_objects_to_view_for_user
+from AOTS.export import file_format_negotiation, stream_zip
+from AOTS.sparse_fields import EagerLoadingMixin
+from AOTS.versions import ConditionalGetMixin
+from observations.auxil import read_spectrum, read_lightcurve, chunked_upload, timing, arrays
 from observations.models import (
     Spectrum,
     UserInfo,
@@ -27,8 +29,9 @@ from observations.models import (
     RawSpecFile,
     LightCurve,
     Observatory,
+    UploadSession,
 )
-from stars.models import Project
+from stars.models import Project, Star
 from users.models import User
 from .filter import (
     SpectrumFilter,
@@ -45,6 +48,10 @@ from .serializers import (
     SpecFileSerializer,
     LightCurveSerializer,
     ObservatorySerializer,
+    UploadSessionSerializer,
+    ConeStarSerializer,
+    ConeSpectrumSerializer,
+    ConeLightCurveSerializer,
 )
 from users.api_auth import authenticate_API_key
 from rest_framework import status
@@ -53,14 +60,12 @@ from rest_framework import status
 # from django_filters import rest_framework as filters
 
 
-# from AOTS.custom_permissions import get_allowed_objects_to_view_for_user
-
 
 # ===============================================================
 # Spectrum
 # ===============================================================
 
-class SpectrumViewSet(viewsets.ModelViewSet):
+class SpectrumViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Spectrum.objects.all()
     serializer_class = SpectrumSerializer
 
@@ -76,7 +81,70 @@ def processSpectrum(request, spectrum_pk):
     return Response(SpectrumSerializer(spectrum).data)
 
 
-class UserInfoViewSet(viewsets.ModelViewSet):
+def get_visible_or_404(model, user, pk):
+    objects = get_allowed_objects_to_view_for_user(model.objects.filter(pk=pk), user)
+    obj = objects.first()
+    if obj is None:
+        raise Http404("No {} with this id".format(model._meta.verbose_name))
+    return obj
+
+
+def get_array_options(request, window):
+    """
+        Window, rebin, normalize, format and dtype options of the data
+        endpoints, raises ValueError for invalid values
+    """
+    options = {}
+    for name in window:
+        if request.GET.get(name, '') != '':
+            options[name] = float(request.GET[name])
+    options['rebin'] = int(request.GET.get('rebin', 1))
+    options['normalize'] = request.GET.get('normalize', '').lower() in ('1', 'true', 'yes')
+
+    file_format = request.GET.get('format', 'npy')
+    dtype = request.GET.get('dtype', 'float64')
+    if file_format not in arrays.CONTENT_TYPES:
+        raise ValueError("Unknown format, choose from: {}".format(', '.join(arrays.CONTENT_TYPES)))
+    if dtype not in arrays.DTYPES:
+        raise ValueError("Unknown dtype, choose from: {}".format(', '.join(arrays.DTYPES)))
+    return options, file_format, dtype
+
+
+@api_view(['GET'])
+@file_format_negotiation
+def getSpectrumData(request, spectrum_pk):
+    """
+        Decoded wave and flux of a spectrum as binary arrays, see
+        observations.auxil.arrays. Options: wmin, wmax, rebin, normalize,
+        specfile (pk, default the first file), format (npy or bin) and dtype
+        (float64 or float32). Supports range requests.
+    """
+    spectrum = get_visible_or_404(Spectrum, request.user, spectrum_pk)
+
+    try:
+        options, file_format, dtype = get_array_options(request, ['wmin', 'wmax'])
+        specfile = None
+        if 'specfile' in request.GET:
+            specfile = spectrum.specfile_set.filter(pk=int(request.GET['specfile'])).first()
+            if specfile is None:
+                raise ValueError("Unknown specfile of this spectrum")
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    wave, flux = arrays.spectrum_arrays(spectrum, specfile=specfile, **options)
+    data = arrays.encode(
+        {'wave': wave, 'flux': flux},
+        file_format=file_format,
+        dtype=dtype,
+        meta={'spectrum': spectrum.pk, 'normalized': options['normalize'] or spectrum.normalized},
+    )
+    return arrays.range_response(
+        request, data, arrays.CONTENT_TYPES[file_format],
+        filename='spectrum_{}.{}'.format(spectrum.pk, file_format),
+    )
+
+
+class UserInfoViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = UserInfo.objects.all()
     serializer_class = UserInfoSerializer
 
@@ -88,7 +156,7 @@ class UserInfoViewSet(viewsets.ModelViewSet):
 # SpecFile
 # ===============================================================
 
-class SpecFileViewSet(viewsets.ModelViewSet):
+class SpecFileViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = SpecFile.objects.all()
     serializer_class = SpecFileSerializer
 
@@ -135,7 +203,7 @@ def getSpecfileRawPath(request, specfile_pk):
 # RawSpecFile
 # ===============================================================
 
-class RawSpecFileViewSet(viewsets.ModelViewSet):
+class RawSpecFileViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = RawSpecFile.objects.all()
     serializer_class = RawSpecFileSerializer
 
@@ -163,7 +231,7 @@ def getRawSpecfilePath(request, rawspecfile_pk):
 # LightCurve
 # ===============================================================
 
-class LightCurveViewSet(viewsets.ModelViewSet):
+class LightCurveViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = LightCurve.objects.all()
     serializer_class = LightCurveSerializer
 
@@ -195,18 +263,133 @@ def getLightCurvePath(request, lightcurve_pk):
     return Response(path)
 
 
+@api_view(['GET'])
+@file_format_negotiation
+def getLightCurveData(request, lightcurve_pk):
+    """
+        Decoded time and flux of a light curve as binary arrays. Options:
+        tmin, tmax, rebin, normalize (to the median flux), format and dtype
+        as for the spectra. Supports range requests.
+    """
+    lightcurve = get_visible_or_404(LightCurve, request.user, lightcurve_pk)
+
+    try:
+        options, file_format, dtype = get_array_options(request, ['tmin', 'tmax'])
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    time, flux = arrays.lightcurve_arrays(lightcurve, **options)
+    data = arrays.encode(
+        {'time': time, 'flux': flux},
+        file_format=file_format,
+        dtype=dtype,
+        meta={'lightcurve': lightcurve.pk, 'normalized': options['normalize']},
+    )
+    return arrays.range_response(
+        request, data, arrays.CONTENT_TYPES[file_format],
+        filename='lightcurve_{}.{}'.format(lightcurve.pk, file_format),
+    )
+
+
 # ===============================================================
 # Observatory
 # ===============================================================
 
-class ObservatoryViewSet(viewsets.ModelViewSet):
+class ObservatoryViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Observatory.objects.all()
     serializer_class = ObservatorySerializer
 
+    version_models = ('observations.observatory',)
+
     filter_backends = (DjangoFilterBackend,)
     filterset_class = ObservatoryFilter
 
 
+# ===============================================================
+# Cone search
+# ===============================================================
+
+#   Maximum number of objects of each type returned by the cone search
+CONE_SEARCH_LIMIT = 10000
+
+
+@api_view(['GET'])
+def coneSearch(request):
+    """
+        Stars, spectra and light curves within `radius` (arcsec, default 10)
+        of `ra` and `dec` (degree or sexagesimal), sorted by their angular
+        distance (arcsec). Optionally restricted to one `project` (slug) and
+        to at most `limit` objects of each type.
+    """
+    try:
+        ra, dec = sky_index.parse_coordinates(
+            request.query_params['ra'],
+            request.query_params['dec'],
+        )
+        radius = float(request.query_params.get('radius', 10.))
+        limit = min(
+            int(request.query_params.get('limit', CONE_SEARCH_LIMIT)),
+            CONE_SEARCH_LIMIT,
+        )
+        if not 0 <= ra <= 360 or not -90 <= dec <= 90:
+            raise ValueError("Coordinates out of range")
+        if limit < 1 or not math.isfinite(radius) or radius <= 0:
+            raise ValueError("Invalid radius or limit")
+    except (KeyError, ValueError):
+        return Response(
+            status=status.HTTP_400_BAD_REQUEST,
+            data="ra (0 to 360) and dec (-90 to 90) degree and optionally "
+                 "radius (arcsec, > 0) and limit (>= 1) are required",
+        )
+
+    result = {'ra': ra, 'dec': dec, 'radius': radius}
+
+    for key, model, serializer in [
+        ('stars', Star, ConeStarSerializer),
+        ('spectra', Spectrum, ConeSpectrumSerializer),
+        ('lightcurves', LightCurve, ConeLightCurveSerializer),
+    ]:
+        objects = sky_index.cone_search(
+            model.objects.select_related('project'),
+            ra,
+            dec,
+            radius / 3600.,
+        )
+        if 'project' in request.query_params:
+            objects = objects.filter(project__slug__exact=request.query_params['project'])
+
+        objects = get_allowed_objects_to_view_for_user(objects, request.user)
+
+        result[key] = serializer(objects.order_by('distance')[:limit], many=True).data
+
+    return Response(result)
+
+
+# ===============================================================
+# Ingest timings
+# ===============================================================
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getIngestTimings(request):
+    """
+        p50/p95 duration (s) per stage and instrument of the ingest pipelines
+        over the sliding window. The window (s) and pipeline can be passed as
+        query parameters.
+    """
+    try:
+        window = float(request.query_params.get('window', timing.get_window()))
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    statistics = timing.get_statistics(
+        window=window,
+        pipeline=request.query_params.get('pipeline', None),
+    )
+
+    return Response(statistics)
+
+
 # ===============================================================
 # API call handling
 # ===============================================================
@@ -275,6 +458,121 @@ def bulkUploadSpectra(request, **kwargs):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+def get_project_from_header(request):
+    """
+        Returns the project given by pk or name in the PROJECTID header, or
+        None if it is missing or does not exist
+    """
+    project_pk = request.META.get("HTTP_PROJECTID")
+    if project_pk is None:
+        return None
+
+    try:
+        return Project.objects.get(pk=int(project_pk))
+    except ValueError:
+        return Project.objects.filter(name__exact=project_pk).first()
+    except ObjectDoesNotExist:
+        return None
+
+
+@api_view(('POST',))
+@authentication_classes([])
+@permission_classes([])
+@authenticate_API_key
+def createUploadSession(request, **kwargs):
+    """
+        Start a resumable upload of a single spectrum or raw file. Expects the
+        file name, its total size in bytes and optionally the file type
+        ('spectrum' or 'raw').
+    """
+    project = get_project_from_header(request)
+    if project is None:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        session = chunked_upload.create_session(
+            project,
+            request.user,
+            request.data.get('filename', ''),
+            request.data.get('size', 0),
+            filetype=request.data.get('filetype', UploadSession.SPECTRUM),
+        )
+    except (chunked_upload.UploadError, ValueError, TypeError) as e:
+        return Response(status=status.HTTP_400_BAD_REQUEST, data=str(e))
+
+    return Response(
+        status=status.HTTP_201_CREATED,
+        data=UploadSessionSerializer(session).data,
+    )
+
+
+@api_view(('GET', 'PUT', 'DELETE'))
+@authentication_classes([])
+@permission_classes([])
+@authenticate_API_key
+def uploadSessionChunk(request, upload_id, **kwargs):
+    """
+        GET returns the state of the upload (use `received` to resume), PUT
+        writes the chunk given by the Content-Range header, DELETE aborts the
+        upload.
+    """
+    try:
+        session = UploadSession.objects.get(upload_id=upload_id, user=request.user)
+    except ObjectDoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == "PUT":
+        try:
+            start, end = chunked_upload.parse_content_range(
+                request.META.get('HTTP_CONTENT_RANGE'),
+                session.size,
+            )
+            #   Read the raw body from the stream, it is never buffered
+            chunked_upload.write_chunk(session, request.stream, start, end)
+        except chunked_upload.UploadError as e:
+            session.refresh_from_db()
+            data = UploadSessionSerializer(session).data
+            data['message'] = str(e)
+            return Response(status=e.status, data=data)
+
+    elif request.method == "DELETE":
+        chunked_upload.abort_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    return Response(
+        status=status.HTTP_200_OK,
+        data=UploadSessionSerializer(session).data,
+    )
+
+
+@api_view(('POST',))
+@authentication_classes([])
+@permission_classes([])
+@authenticate_API_key
+def finalizeUploadSession(request, upload_id, **kwargs):
+    """
+        Verify the SHA-256 checksum of the completed upload and queue the file
+        for processing
+    """
+    try:
+        session = UploadSession.objects.get(upload_id=upload_id, user=request.user)
+    except ObjectDoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        session = chunked_upload.finalize_session(
+            session,
+            request.data.get('sha256', ''),
+        )
+    except chunked_upload.UploadError as e:
+        return Response(status=e.status, data=str(e))
+
+    return Response(
+        status=status.HTTP_202_ACCEPTED,
+        data=UploadSessionSerializer(session).data,
+    )
+
+
 @api_view(('GET',))
 @authentication_classes([])
 @permission_classes([])
@@ -294,9 +592,6 @@ def bulkDownloadSpectra(request, **kwargs):
         except ObjectDoesNotExist:
             return Response(status.HTTP_400_BAD_REQUEST)
 
-        files_to_return = []
-        preferred_filenames = []
-
         # Check if identifiers or pks
         list_contains_names = False
         try:
@@ -306,47 +601,25 @@ def bulkDownloadSpectra(request, **kwargs):
 
         if list_contains_names:
             spectra_to_return = Spectrum.objects.filter(project=project,
-                                                        star__name__in=requested_stars).prefetch_related('specfile_set')
+                                                        star__name__in=requested_stars)
         else:
-            spectra_to_return = Spectrum.objects.filter(project=project, pk__in=requested_stars).prefetch_related(
-                'specfile_set')
-
-        for spec in spectra_to_return:
-            spfiles = list(spec.specfile_set.all())
-            for i, specfile in enumerate(spfiles):
-                files_to_return.append(specfile.specfile.path)
-                preferred_filenames.append("spec_"+spec.star.name+f"_{i}.fits")
-
-        # Create a temporary directory to store the files
-        cwd = os.getcwd()
-        temp_directory = os.path.join(cwd, f'tmp{str(random.random()).replace(".", "")}/')
-        subdir = os.path.join(temp_directory, "spec_dir/")
-
-        # Create the temporary directory and subdirectory
-        os.mkdir(temp_directory)
-        os.mkdir(subdir)
-
-        # Copy the files to the temporary directory
-        temp_file_paths = []
-        for path, name in zip(files_to_return, preferred_filenames):
-            temp_path = os.path.join(subdir, name)
-            shutil.copy2(path, temp_path)
-            temp_file_paths.append(temp_path)
-
-        # Create a zip file containing the files
-        zip_file_path = os.path.join(temp_directory, 'files')
-        shutil.make_archive(zip_file_path, 'zip', subdir)
-
-        with open(zip_file_path+".zip", 'rb') as archive_to_download:
-            tmp = tempfile.TemporaryFile()
-            tmp.write(archive_to_download.read())
-            tmp.seek(0)
-
-        # Create a response with the zip file
-        response = FileResponse(tmp, as_attachment=True, filename='files.zip', status=status.HTTP_200_OK)
-
-        # Clean up the temporary files
-        shutil.rmtree(temp_directory)
+            spectra_to_return = Spectrum.objects.filter(project=project, pk__in=requested_stars)
+        spectra_to_return = spectra_to_return.select_related('star').prefetch_related('specfile_set')
+
+        # Archive names: spec_<star>_<i>.fits, numbered per star
+        entries = []
+        n_files = {}
+        for spec in spectra_to_return.order_by('pk'):
+            star_name = spec.star.name if spec.star is not None else spec.objectname
+            for specfile in spec.specfile_set.all():
+                i = n_files.get(star_name, 0)
+                n_files[star_name] = i + 1
+                entries.append((f"spec_{star_name}_{i}.fits", specfile.specfile))
+
+        # Stream the zip file, the spectra are read while it is sent
+        response = StreamingHttpResponse(stream_zip(entries), content_type='application/zip',
+                                         status=status.HTTP_200_OK)
+        response['Content-Disposition'] = 'attachment; filename="files.zip"'
 
         return response
     else:
@@ -0,0 +1,185 @@
+"""
+Decoded spectrum and light curve data as binary arrays.
+
+The data of a spectrum (wave, flux) or light curve (time, flux) is read from
+its file, optionally cut to a window, rebinned and normalized, and encoded
+column by column as:
+
+    npy     a NumPy structured array (np.load(..., allow_pickle=False))
+    bin     a little-endian uint32 with the length of a JSON header, the
+            JSON header ({"columns": [...], "dtype": "<f4", "length": n,
+            ...}) and the columns one after another
+
+In the `bin` format the offset of every column follows from the header, so
+that clients can request a part of a column with an HTTP range request (see
+`range_response`).
+"""
+
+import json
+import re
+import struct
+from io import BytesIO
+
+import numpy as np
+from astropy import units as u
+from django.http import HttpResponse
+from specutils import Spectrum1D
+
+from observations.auxil import tools as spectools
+
+DTYPES = {'float32': '<f4', 'float64': '<f8'}
+
+CONTENT_TYPES = {
+    'npy': 'application/x-npy',
+    'bin': 'application/octet-stream',
+}
+
+
+def cut_window(x, y, xmin=None, xmax=None):
+    """
+        Select the points with xmin <= x <= xmax
+    """
+    selection = np.ones(len(x), dtype=bool)
+    if xmin is not None:
+        selection &= x >= xmin
+    if xmax is not None:
+        selection &= x <= xmax
+    return x[selection], y[selection]
+
+
+def spectrum_arrays(spectrum, specfile=None, wmin=None, wmax=None,
+                    rebin=1, normalize=False, porder=3):
+    """
+        Barycentric corrected wave and flux of a spectrum file (default: the
+        first file of the spectrum). Echelle orders are merged.
+    """
+    if specfile is None:
+        specfile = spectrum.specfile_set.order_by('filetype').first()
+        if specfile is None:
+            return np.array([]), np.array([])
+
+    wave, flux, header = specfile.get_spectrum()
+
+    #   Barycentric correction
+    if not spectrum.barycor_bool:
+        if isinstance(wave[0], np.ndarray):
+            wave = np.array([spectools.doppler_shift(w, spectrum.barycor) for w in wave])
+        else:
+            wave = spectools.doppler_shift(wave, spectrum.barycor)
+
+    #   If the spectrum is already normalized, the mean keeps the continuum
+    #   at ~1
+    if rebin and rebin > 1:
+        wave, flux = spectools.rebin_spectrum(
+            wave, flux, binsize=rebin, mean=spectrum.normalized,
+        )
+
+    if isinstance(wave[0], np.ndarray):
+        #   Echelle spectrum: cut the orders before merging, so that only
+        #   the orders in the window are normalized
+        orders = [
+            cut_window(np.asarray(w, dtype=float), np.asarray(f, dtype=float), wmin, wmax)
+            for w, f in zip(wave, flux)
+        ]
+        orders = [(w, f) for w, f in orders if len(w) > 4]
+        if not orders:
+            return np.array([]), np.array([])
+        if normalize:
+            wave, flux = spectools.norm_merge_spectra(
+                [Spectrum1D(spectral_axis=w * u.AA, flux=f * u.ct) for w, f in orders],
+                order=porder,
+            )
+            return np.asarray(wave.value), np.asarray(flux)
+        return spectools.merge_spectra([w for w, f in orders], [f for w, f in orders])
+
+    wave, flux = cut_window(np.asarray(wave, dtype=float), np.asarray(flux, dtype=float), wmin, wmax)
+    if normalize and len(wave) > porder + 1:
+        spec, std = spectools.norm_spectrum(
+            Spectrum1D(spectral_axis=wave * u.AA, flux=flux * u.ct), order=porder,
+        )
+        wave, flux = np.asarray(spec.spectral_axis), np.asarray(spec.flux)
+    return wave, flux
+
+
+def lightcurve_arrays(lightcurve, tmin=None, tmax=None, rebin=1, normalize=False):
+    """
+        Time and flux of a light curve, normalized to the median flux on
+        request
+    """
+    time, flux, header = lightcurve.get_lightcurve()
+    time, flux = cut_window(np.asarray(time, dtype=float), np.asarray(flux, dtype=float), tmin, tmax)
+
+    if rebin and rebin > 1 and len(time) >= rebin:
+        time, flux = spectools.rebin_core(time, flux, binsize=rebin, mean=True)
+    if normalize and len(flux):
+        flux = flux / np.nanmedian(flux)
+    return time, flux
+
+
+def encode(columns, file_format='npy', dtype='float64', meta=None):
+    """
+        Encode a dictionary of equally long arrays in the npy or bin format
+    """
+    dtype = DTYPES[dtype]
+    length = len(next(iter(columns.values()))) if columns else 0
+
+    if file_format == 'npy':
+        data = np.empty(length, dtype=[(name, dtype) for name in columns])
+        for name, values in columns.items():
+            data[name] = values
+        buffer = BytesIO()
+        np.save(buffer, data, allow_pickle=False)
+        return buffer.getvalue()
+
+    header = dict(meta or {}, columns=list(columns), dtype=dtype, length=length)
+    header = json.dumps(header).encode()
+    return b''.join(
+        [struct.pack('<I', len(header)), header] +
+        [np.ascontiguousarray(values, dtype=dtype).tobytes() for values in columns.values()]
+    )
+
+
+def parse_range(value, size):
+    """
+        (start, end) of a single `bytes=` range (end inclusive). Returns None
+        if the header is not a single byte range, which is answered with the
+        full content, and raises ValueError if the range is not satisfiable.
+    """
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', value or '')
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+
+    start, end = match.groups()
+    if start == '':
+        #   Suffix range: the last bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def range_response(request, data, content_type, filename=None):
+    """
+        Response with the data, or with the requested byte range of it
+    """
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), len(data))
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(len(data))
+        return response
+
+    if byte_range is None:
+        response = HttpResponse(data, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = HttpResponse(data[start:end + 1], content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(data))
+
+    response['Accept-Ranges'] = 'bytes'
+    if filename is not None:
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
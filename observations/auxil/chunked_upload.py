@@ -0,0 +1,299 @@
+"""
+Resumable, chunked uploads of spectra and raw files.
+
+An upload session reserves the final storage name of the file. Chunks are
+written straight into a partial file (`<name>.part`) in the final storage
+directory, so neither the request body nor the file is ever held in memory.
+On finalize the checksum of the partial file is verified, the file is renamed
+to its final name and the SpecFile/RawSpecFile is created and queued for
+processing.
+"""
+
+import hashlib
+import os
+import re
+import threading
+
+from django.core.files.storage import default_storage
+from django.db import transaction, close_old_connections
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from observations.auxil import read_spectrum, fileio
+from observations.models import UploadSession, SpecFile, RawSpecFile
+
+#   Size of the blocks read from the request stream and from disk (bytes)
+BLOCK_SIZE = 1024 * 1024
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class UploadError(Exception):
+    """
+        Raised for invalid chunks or finalize requests. `status` is the HTTP
+        status code that should be returned to the client.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def get_part_path(session):
+    return default_storage.path(session.name) + '.part'
+
+
+def create_session(project, user, filename, size, filetype=UploadSession.SPECTRUM):
+    """
+        Create a new upload session and reserve the final storage name
+
+        Parameters
+        ----------
+        project             : `stars.models.Project`
+            Project the file will belong to
+
+        user                : `users.models.User`
+            User that uploads the file
+
+        filename            : `string`
+            Original name of the file
+
+        size                : `integer`
+            Total size of the file in bytes
+
+        filetype            : `string`, optional
+            'spectrum' or 'raw'
+
+        Returns
+        -------
+        session             : `observations.models.UploadSession`
+    """
+    if filetype not in dict(UploadSession.FILE_TYPES):
+        raise UploadError("Unknown file type: {}".format(filetype))
+    if int(size) <= 0:
+        raise UploadError("The file size needs to be larger than 0")
+
+    filename = os.path.basename(filename)
+    if filename == '':
+        raise UploadError("No file name given")
+
+    session = UploadSession(
+        project=project,
+        user=user,
+        filetype=filetype,
+        filename=filename,
+        size=int(size),
+    )
+
+    if filetype == UploadSession.SPECTRUM:
+        name = fileio.get_specfile_path(session, filename)
+    else:
+        name = fileio.get_rawfile_path(session, filename)
+
+    #   Reserve the name by creating the (empty) partial file, the name is
+    #   taken if either the final or the partial file exist
+    name = default_storage.get_available_name(name)
+    os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+    while True:
+        try:
+            fd = os.open(
+                default_storage.path(name) + '.part',
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+            )
+            os.close(fd)
+            break
+        except FileExistsError:
+            name = default_storage.get_available_name(
+                default_storage.get_alternative_name(*os.path.splitext(name))
+            )
+
+    session.name = name
+    session.save()
+
+    return session
+
+
+def parse_content_range(header, size):
+    """
+        Parse a `Content-Range: bytes <start>-<end>/<total>` header and
+        return start and end (inclusive) of the chunk
+    """
+    match = CONTENT_RANGE.match((header or '').strip())
+    if match is None:
+        raise UploadError("Missing or invalid Content-Range header")
+
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+
+    if total != '*' and int(total) != size:
+        raise UploadError("Total size does not match the upload session")
+    if end < start or end >= size:
+        raise UploadError("Chunk is outside of the file", status=416)
+
+    return start, end
+
+
+def write_chunk(session, stream, start, end):
+    """
+        Write the bytes start-end (inclusive) read from the stream to the
+        partial file. Chunks need to be contiguous: a chunk may overlap the
+        bytes already received (a retry), but may not leave a gap.
+
+        Returns the number of contiguous bytes received.
+    """
+    if session.status != UploadSession.OPEN:
+        raise UploadError("Upload is already finalized", status=409)
+    if start > session.received:
+        raise UploadError(
+            "Chunk starts at {} but only {} bytes were received".format(
+                start, session.received),
+            status=409,
+        )
+
+    length = end - start + 1
+    written = 0
+
+    with open(get_part_path(session), 'r+b') as part:
+        part.seek(start)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            written += len(block)
+
+    #   Keep the largest contiguous offset, also when chunks are uploaded
+    #   concurrently
+    UploadSession.objects.filter(pk=session.pk).update(
+        received=Greatest(F('received'), start + written),
+    )
+    session.refresh_from_db()
+
+    if written < length:
+        raise UploadError(
+            "Chunk incomplete: received {} of {} bytes".format(written, length)
+        )
+
+    return session.received
+
+
+def file_checksum(path):
+    """
+        SHA-256 checksum of a file, read in blocks
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def finalize_session(session, checksum):
+    """
+        Verify the size and SHA-256 checksum of the uploaded file, move it to
+        its final name and create the SpecFile or RawSpecFile. Processing of
+        the file is started in the background once the transaction is
+        committed.
+    """
+    if session.status != UploadSession.OPEN:
+        raise UploadError("Upload is already finalized", status=409)
+    if session.received != session.size:
+        raise UploadError(
+            "Upload incomplete: received {} of {} bytes".format(
+                session.received, session.size),
+            status=409,
+        )
+
+    part_path = get_part_path(session)
+    if (checksum or '').lower() != file_checksum(part_path):
+        raise UploadError("Checksum mismatch")
+
+    #   Move the file in place, the partial file is in the same directory so
+    #   no data is copied
+    os.replace(part_path, default_storage.path(session.name))
+
+    with transaction.atomic():
+        if session.filetype == UploadSession.SPECTRUM:
+            newfile = SpecFile(project=session.project)
+            newfile.specfile.name = session.name
+            newfile.save()
+            session.specfile = newfile
+        else:
+            newfile = RawSpecFile(project=session.project)
+            newfile.rawfile.name = session.name
+            newfile.save()
+            session.rawfile = newfile
+
+        session.status = UploadSession.QUEUED
+        session.save()
+
+        transaction.on_commit(lambda: queue_processing(session.pk))
+
+    return session
+
+
+def abort_session(session):
+    """
+        Remove the partial file and the upload session
+    """
+    if session.status == UploadSession.OPEN:
+        try:
+            os.remove(get_part_path(session))
+        except FileNotFoundError:
+            pass
+    session.delete()
+
+
+def queue_processing(session_pk):
+    """
+        Process the uploaded file in a background thread
+    """
+    thread = threading.Thread(
+        target=_process_in_thread,
+        args=(session_pk,),
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _process_in_thread(session_pk):
+    try:
+        process_session(session_pk)
+    finally:
+        close_old_connections()
+
+
+def process_session(session_pk):
+    """
+        Process the file of a finalized upload session in the same way as the
+        files uploaded by `bulkUploadSpectra`. Failed files are removed again.
+    """
+    session = UploadSession.objects.get(pk=session_pk)
+    session.status = UploadSession.PROCESSING
+    session.save()
+
+    try:
+        if session.filetype == UploadSession.SPECTRUM:
+            success, message = read_spectrum.process_specfile(
+                session.specfile_id,
+                create_new_star=True,
+                user_info={},
+            )
+        else:
+            result = read_spectrum.add_and_process_science_raw_spec(
+                session.rawfile_id,
+            )
+            success, message = result[0], result[1]
+    except Exception as e:
+        success, message = False, str(e)
+        for newfile in (session.specfile, session.rawfile):
+            if newfile is not None:
+                newfile.delete()
+
+    session.refresh_from_db()
+    session.status = UploadSession.DONE if success else UploadSession.FAILED
+    session.message = message
+    session.save()
+
+    return success, message
@@ -0,0 +1,238 @@
+"""
+Cached Sun and Moon ephemerides and barycentric corrections.
+
+The positions of the Sun and the Moon only depend on the observatory and the
+time of the observation. They are calculated on a grid of time nodes (one
+node per time bucket, see EPHEMERIS_CACHE_BUCKET in the settings), stored in
+the Django cache and linearly interpolated within a bucket. Since the cache
+is shared between processes, spectra of the same night at the same
+observatory only trigger the expensive astropy calculations once.
+"""
+
+import astropy.units as u
+import numpy as np
+from astroplan.moon import moon_illumination
+from astropy.coordinates import SkyCoord, AltAz, get_body
+from astropy.time import Time
+from django.conf import settings
+from django.core.cache import cache
+
+#   Quantities stored for each time node
+EPHEMERIS_KEYS = [
+    'moon_ra',
+    'moon_dec',
+    'moon_alt',
+    'moon_az',
+    'moon_illumination',
+    'sun_alt',
+    'sun_az',
+]
+
+#   Quantities that are angles in the range [0, 360[ and need special care
+#   during interpolation
+WRAPPED_KEYS = ['moon_ra', 'moon_az', 'sun_az']
+
+
+def get_bucket_size():
+    """
+        Length of the time buckets in days
+    """
+    return getattr(settings, 'EPHEMERIS_CACHE_BUCKET', 600) / 86400.
+
+
+def _location_key(observatory):
+    """
+        Cache key component identifying the observatory. The location is
+        included so that cached values are ignored after the coordinates of
+        an observatory were changed.
+    """
+    return '{}:{:.5f}:{:.5f}:{:.0f}'.format(
+        observatory.pk,
+        observatory.latitude,
+        observatory.longitude,
+        observatory.altitude,
+    )
+
+
+def _node_key(observatory, bucket, index):
+    return 'ephemeris:{}:{:.0f}:{}'.format(
+        _location_key(observatory),
+        bucket * 86400.,
+        index,
+    )
+
+
+def _compute_nodes(observatory, jds):
+    """
+        Calculate the Sun and Moon ephemerides for the given times (JD)
+        in one vectorized astropy call
+    """
+    times = Time(jds, format='jd')
+    location = observatory.get_EarthLocation()
+    frame = AltAz(obstime=times, location=location)
+
+    moon = get_body('moon', times, location=location)
+    sun = get_body('sun', times, location=location)
+    moon_altaz = moon.transform_to(frame)
+    sun_altaz = sun.transform_to(frame)
+
+    return {
+        'moon_ra': np.atleast_1d(moon.ra.degree),
+        'moon_dec': np.atleast_1d(moon.dec.degree),
+        'moon_alt': np.atleast_1d(moon_altaz.alt.degree),
+        'moon_az': np.atleast_1d(moon_altaz.az.degree),
+        'moon_illumination': np.atleast_1d(moon_illumination(times)),
+        'sun_alt': np.atleast_1d(sun_altaz.alt.degree),
+        'sun_az': np.atleast_1d(sun_altaz.az.degree),
+    }
+
+
+def _get_nodes(observatory, indices, bucket):
+    """
+        Load the ephemerides for the given node indices from the cache and
+        calculate the missing ones
+    """
+    keys = {index: _node_key(observatory, bucket, index) for index in indices}
+    cached = cache.get_many(list(keys.values()))
+
+    nodes = {}
+    missing = []
+    for index, key in keys.items():
+        if key in cached:
+            nodes[index] = cached[key]
+        else:
+            missing.append(index)
+
+    if missing:
+        data = _compute_nodes(observatory, np.array(missing) * bucket)
+
+        new_nodes = {}
+        for i, index in enumerate(missing):
+            node = {k: float(data[k][i]) for k in EPHEMERIS_KEYS}
+            nodes[index] = node
+            new_nodes[keys[index]] = node
+
+        #   Ephemerides do not change -> no expiration
+        cache.set_many(new_nodes, timeout=None)
+
+    return nodes
+
+
+def _interpolate(value_0, value_1, fraction, wrapped=False):
+    if wrapped:
+        difference = (value_1 - value_0 + 180.) % 360. - 180.
+        return (value_0 + fraction * difference) % 360.
+    return value_0 + fraction * (value_1 - value_0)
+
+
+def get_sun_moon(observatory, jd):
+    """
+        Returns the Sun and Moon ephemerides at the given time(s) as seen
+        from the observatory.
+
+        Parameters
+        ----------
+        observatory         : `observations.models.Observatory`
+            Observatory of the observation
+
+        jd                  : `float` or `numpy.ndarray`
+            Julian date(s)
+
+        Returns
+        -------
+        ephemeris           : `dict`
+            Dictionary with the Moon position (moon_ra, moon_dec; degree),
+            the altitude and azimuth of Moon and Sun (moon_alt, moon_az,
+            sun_alt, sun_az; degree) and the moon illumination
+            (moon_illumination; fraction). The values are floats for a scalar
+            input and arrays otherwise.
+    """
+    bucket = get_bucket_size()
+
+    jds = np.atleast_1d(np.asarray(jd, dtype=float))
+    indices = np.floor(jds / bucket).astype(np.int64)
+    fractions = jds / bucket - indices
+
+    needed = sorted(set(indices.tolist()) | set((indices + 1).tolist()))
+    nodes = _get_nodes(observatory, needed, bucket)
+
+    ephemeris = {}
+    for key in EPHEMERIS_KEYS:
+        value_0 = np.array([nodes[i][key] for i in indices])
+        value_1 = np.array([nodes[i + 1][key] for i in indices])
+        ephemeris[key] = _interpolate(
+            value_0,
+            value_1,
+            fractions,
+            wrapped=key in WRAPPED_KEYS,
+        )
+
+    if np.ndim(jd) == 0:
+        ephemeris = {k: float(v[0]) for k, v in ephemeris.items()}
+
+    return ephemeris
+
+
+def moon_separation(ra, dec, ephemeris):
+    """
+        Angular distance (degree) between a target and the Moon position
+        returned by `get_sun_moon`
+    """
+    ra, dec = np.radians(ra), np.radians(dec)
+    moon_ra = np.radians(ephemeris['moon_ra'])
+    moon_dec = np.radians(ephemeris['moon_dec'])
+
+    cos_sep = (np.sin(dec) * np.sin(moon_dec) +
+               np.cos(dec) * np.cos(moon_dec) * np.cos(ra - moon_ra))
+
+    return np.degrees(np.arccos(np.clip(cos_sep, -1., 1.)))
+
+
+def get_sunset_sunrise(observatory, jd):
+    """
+        Cached version of `Observatory.get_sunset_sunrise`. Returns the sunset
+        and sunrise of the night containing the time (JD) as astropy Time
+        objects.
+    """
+    bucket = get_bucket_size()
+    key = 'sunset_sunrise:{}:{:.0f}:{}'.format(
+        _location_key(observatory),
+        bucket * 86400.,
+        int(np.floor(jd / bucket)),
+    )
+
+    value = cache.get(key)
+    if value is None:
+        sunset, sunrise = observatory.get_sunset_sunrise(
+            Time(jd, format='jd')
+        )
+        value = (float(sunset.jd), float(sunrise.jd))
+        cache.set(key, value, timeout=None)
+
+    return Time(value[0], format='jd'), Time(value[1], format='jd')
+
+
+def get_barycentric_correction(ra, dec, observatory, jd):
+    """
+        Barycentric correction in km/s for a target (ra, dec in degree)
+        observed at the observatory at time jd. Results are memoized per
+        target, observatory and time.
+    """
+    key = 'barycor:{}:{:.6f}:{:.6f}:{:.6f}'.format(
+        _location_key(observatory),
+        ra,
+        dec,
+        jd,
+    )
+
+    value = cache.get(key)
+    if value is None:
+        sky = SkyCoord(ra=ra * u.deg, dec=dec * u.deg, )
+        value = sky.radial_velocity_correction(
+            obstime=Time(jd, format='jd'),
+            location=observatory.get_EarthLocation(),
+        ).to(u.km / u.s).value
+        value = float(value)
+        cache.set(key, value, timeout=None)
+
+    return value
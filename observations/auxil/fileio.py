@@ -3,6 +3,8 @@ import os
 import numpy as np
 from astropy.io import fits, ascii
 
+from . import timing
+
 
 def istext(filename):
     """
@@ -221,7 +223,10 @@ def read_spectrum(filename, return_header=False):
     """
 
     # Check if file is a text file
-    if istext(filename):
+    with timing.stage('istext'):
+        is_text_file = istext(filename)
+
+    if is_text_file:
         #   Assume that this file has 2 columns containing wavelength and flux
         #   Text files are considered to not contain a header!
         data = ascii.read(filename, names=['wave', 'flux'])
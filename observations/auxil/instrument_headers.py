@@ -9,6 +9,7 @@ from astropy.coordinates.angles import Angle
 from astropy.time import Time
 
 from observations.models import Observatory
+from .observatory_resolver import observatory_resolver
 
 
 def extract_header_info(header, user_info={}):
@@ -75,27 +76,12 @@ def extract_header_raw(header, user_info={}):
     return data
 
 
-def get_observatory(header, project):
+def get_header_location(header):
     """
-        Finds a suitable observatory or if not possible, create a new one.
+        Returns the location of the observatory stored in the header as an
+        astropy EarthLocation. Falls back to lat=lon=alt=0 if the header
+        contains no geodetic information.
     """
-
-    #   Maximum tolerable deviation in the coordinates
-    #   -> a difference of 0.1 degree in latitude and longitude is roughly 10 km
-    d = 0.1
-
-    #    Try to find the observatory on name match
-    if 'TELESCOP' in header:
-        try:
-            obs = Observatory.objects.get(
-                telescopes__icontains=header['TELESCOP'],
-                project__exact=project,
-            )
-            return obs
-        except Exception as e:
-            telescope = header.get('TELESCOP', 'UK')
-
-    #   Try to find observatory on location match
     if 'OBSGEO-X' in header:
         x, y = header.get('OBSGEO-X', 0), header.get('OBSGEO-Y', 0)
         z = header.get('OBSGEO-Z', 0)
@@ -141,16 +127,38 @@ def get_observatory(header, project):
             height=0 * u.m,
         )
 
-    #   We look for an observatory that is within 1 degree from location stored
-    #   in the header, altitude is not checked.
-    obs = Observatory.objects.filter(
-        latitude__range=(loc.lat.degree - d, loc.lat.degree + d),
-        longitude__range=(loc.lon.degree - d, loc.lon.degree + d),
-        project__exact=project,
+    return loc
+
+
+def get_observatory(header, project):
+    """
+        Finds a suitable observatory or if not possible, create a new one.
+
+        The observatories of the project are resolved in memory by the
+        observatory resolver, which is invalidated whenever an observatory
+        is saved or deleted.
+    """
+    telescope = header.get('TELESCOP', 'UK')
+
+    #    Try to find the observatory on name match
+    if 'TELESCOP' in header:
+        obs = observatory_resolver.by_telescope(project, header['TELESCOP'])
+        if obs is not None:
+            return obs
+
+    #   Try to find observatory on location match
+    loc = get_header_location(header)
+
+    #   We look for an observatory that is within 0.1 degree (roughly 10 km)
+    #   from location stored in the header, altitude is not checked.
+    obs = observatory_resolver.by_location(
+        project,
+        loc.lat.degree,
+        loc.lon.degree,
     )
 
-    if len(obs) > 0:
-        return obs[0]
+    if obs is not None:
+        return obs
 
     #   If still no observatory exists, create a new one.
     obs = Observatory(
@@ -0,0 +1,131 @@
+"""
+In-process index of the observatories of a project, used to resolve the
+observatory of an uploaded file from its header without querying the
+database for every file.
+"""
+
+import threading
+import time
+from math import floor
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from observations.models import Observatory
+
+
+class ObservatoryResolver:
+    """
+        Loads the observatories of a project once and resolves telescope
+        names and geodetic positions in memory.
+
+        The index of a project is dropped when one of its observatories is
+        saved or deleted (see the signal handlers below). Since other
+        processes do not receive these signals, an index is in addition
+        rebuilt after `max_age` seconds.
+    """
+
+    def __init__(self, tolerance=0.1, max_age=300):
+        #   Maximum tolerable deviation in the coordinates (degree)
+        self.tolerance = tolerance
+        self.max_age = max_age
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, project_pk=None):
+        """
+            Drop the index of one project or, if no project is given, of all
+            projects
+        """
+        with self._lock:
+            if project_pk is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(project_pk, None)
+
+    def _cell(self, lat, lon):
+        return floor(lat / self.tolerance), floor(lon / self.tolerance)
+
+    def _get_index(self, project):
+        project_pk = getattr(project, 'pk', project)
+
+        with self._lock:
+            index = self._indices.get(project_pk)
+            if index is not None and time.monotonic() - index['created'] < self.max_age:
+                return index
+
+        observatories = list(
+            Observatory.objects.filter(project__exact=project_pk).order_by('pk')
+        )
+
+        #   Grid with a cell size equal to the tolerance, so that only the
+        #   neighbouring cells need to be searched
+        grid = {}
+        for obs in observatories:
+            grid.setdefault(self._cell(obs.latitude, obs.longitude), []).append(obs)
+
+        index = {
+            'created': time.monotonic(),
+            'observatories': observatories,
+            'grid': grid,
+            'telescopes': {},
+        }
+
+        with self._lock:
+            self._indices[project_pk] = index
+
+        return index
+
+    def by_telescope(self, project, telescope):
+        """
+            Returns the observatory whose telescope list contains the
+            telescope name (case-insensitive). None is returned if no or more
+            than one observatory matches.
+        """
+        index = self._get_index(project)
+        key = str(telescope).lower()
+
+        if key not in index['telescopes']:
+            matches = [obs for obs in index['observatories']
+                       if key in obs.telescopes.lower()]
+            index['telescopes'][key] = matches[0] if len(matches) == 1 else None
+
+        return index['telescopes'][key]
+
+    def by_location(self, project, latitude, longitude):
+        """
+            Returns the first observatory (by creation) within the tolerance
+            of the given latitude and longitude (degree), None otherwise.
+            The altitude is not checked.
+        """
+        index = self._get_index(project)
+        d = self.tolerance
+
+        cell_lat, cell_lon = self._cell(latitude, longitude)
+        candidates = []
+        for i in (cell_lat - 1, cell_lat, cell_lat + 1):
+            for j in (cell_lon - 1, cell_lon, cell_lon + 1):
+                for obs in index['grid'].get((i, j), []):
+                    if (latitude - d <= obs.latitude <= latitude + d and
+                            longitude - d <= obs.longitude <= longitude + d):
+                        candidates.append(obs)
+
+        if len(candidates) == 0:
+            return None
+
+        return min(candidates, key=lambda obs: obs.pk)
+
+
+#   Resolver shared by all ingest paths of this process
+observatory_resolver = ObservatoryResolver()
+
+
+@receiver(post_save, sender=Observatory)
+@receiver(post_delete, sender=Observatory)
+def invalidate_observatory_resolver(sender, **kwargs):
+    """
+        Drop the cached observatories of the project when an observatory
+        is added, changed or removed
+    """
+    observatory = kwargs['instance']
+    observatory_resolver.invalidate(observatory.project_id)
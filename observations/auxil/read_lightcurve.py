@@ -1,13 +1,15 @@
 import astropy.units as u
 import numpy as np
-from astroplan.moon import moon_illumination
-from astropy.coordinates import SkyCoord, AltAz, get_body
+from astropy.coordinates import SkyCoord, AltAz
 from astropy.time import Time
-from django.db.models import F, ExpressionWrapper, FloatField
 
+from AOTS import sky_index
 from observations.models import LightCurve
+from stars.association import star_association
 from stars.models import Star
+from . import ephemeris as ephemeris_cache
 from . import instrument_headers
+from . import timing
 
 
 def isfloat(value):
@@ -29,10 +31,12 @@ def derive_lightcurve_info(lightcurve_pk):
 
     # -- get lightcurve
     lightcurve = LightCurve.objects.get(pk=lightcurve_pk)
-    hjd, flux, header = lightcurve.get_lightcurve()
+    with timing.stage('read_file'):
+        hjd, flux, header = lightcurve.get_lightcurve()
 
     # -- load info from lightcurve header
-    data = instrument_headers.extract_header_info(header)
+    with timing.stage('extract_header_info'):
+        data = instrument_headers.extract_header_info(header)
 
     # HJD
     lightcurve.hjd = data.get('hjd', 2400000)
@@ -67,7 +71,8 @@ def derive_lightcurve_info(lightcurve_pk):
     lightcurve.seeing = data.get('seeing', -1)
 
     # -- observatory
-    lightcurve.observatory = instrument_headers.get_observatory(header, lightcurve.project)
+    with timing.stage('observatory'):
+        lightcurve.observatory = instrument_headers.get_observatory(header, lightcurve.project)
 
     # -- save the changes
     lightcurve.save()
@@ -76,37 +81,37 @@ def derive_lightcurve_info(lightcurve_pk):
     if lightcurve.observatory.space_craft:
         return
 
-    # -- calculate moon parameters
-    time = Time(lightcurve.hjd, format='jd')
+    with timing.stage('observing_conditions'):
+        # -- calculate moon parameters from the cached ephemerides
+        time = Time(lightcurve.hjd, format='jd')
+        ephemeris = ephemeris_cache.get_sun_moon(lightcurve.observatory, lightcurve.hjd)
 
-    # moon illumination wit astroplan (astroplan returns a fraction, but we store percentage)
-    lightcurve.moon_illumination = np.round(moon_illumination(time=time) * 100, 1)
+        # moon illumination (the ephemeris contains a fraction, but we store percentage)
+        lightcurve.moon_illumination = np.round(ephemeris['moon_illumination'] * 100, 1)
 
-    # get the star and moon coordinates at time and location of observations
-    star = SkyCoord(ra=lightcurve.ra * u.deg, dec=lightcurve.dec * u.deg, )
-    moon = get_body('moon', time)
+        # store the separation between moon and target
+        lightcurve.moon_separation = np.round(
+            ephemeris_cache.moon_separation(lightcurve.ra, lightcurve.dec, ephemeris), 1)
 
-    observatory = lightcurve.observatory.get_EarthLocation()
-    frame = AltAz(obstime=time, location=observatory)
+        # -- get object alt-az and airmass if not stored in header
+        if lightcurve.alt == 0 or lightcurve.az == 0 or lightcurve.airmass <= 0:
+            star = SkyCoord(ra=lightcurve.ra * u.deg, dec=lightcurve.dec * u.deg, )
+            observatory = lightcurve.observatory.get_EarthLocation()
+            frame = AltAz(obstime=time, location=observatory)
+            star = star.transform_to(frame)
 
-    star = star.transform_to(frame)
-    moon = moon.transform_to(frame)
-
-    # store the separation between moon and target
-    lightcurve.moon_separation = np.round(star.separation(moon).degree, 1)
-
-    # -- get object alt-az and airmass if not stored in header
-    if lightcurve.alt == 0:
-        lightcurve.alt = star.alt.degree
-    if lightcurve.az == 0:
-        lightcurve.az = star.az.degree
-    if lightcurve.airmass <= 0:
-        lightcurve.airmass = np.round(star.secz.value, 2)
+            if lightcurve.alt == 0:
+                lightcurve.alt = star.alt.degree
+            if lightcurve.az == 0:
+                lightcurve.az = star.az.degree
+            if lightcurve.airmass <= 0:
+                lightcurve.airmass = np.round(star.secz.value, 2)
 
     # -- save the changes
     lightcurve.save()
 
 
+@timing.timed_pipeline('process_lightcurve')
 def process_lightcurve(lightcurve_id, create_new_star=True):
     """
     Check if the specfile is a duplicate, and if not, add it to a spectrum
@@ -119,19 +124,26 @@ def process_lightcurve(lightcurve_id, create_new_star=True):
 
     message = ""
 
-    derive_lightcurve_info(lightcurve_id)
+    with timing.stage('derive_lightcurve_info'):
+        derive_lightcurve_info(lightcurve_id)
 
     lightcurve = LightCurve.objects.get(pk=lightcurve_id)
+    timing.set_instrument(lightcurve.instrument)
 
     # -- check for duplicates
-    duplicates = LightCurve.objects.exclude(id__exact=lightcurve_id) \
-        .filter(ra__range=[lightcurve.ra - 1 / 3600., lightcurve.ra + 1 / 3600.]) \
-        .filter(dec__range=[lightcurve.dec - 1 / 3600., lightcurve.dec + 1 / 3600.]) \
-        .filter(hjd__exact=lightcurve.hjd) \
-        .filter(instrument__iexact=lightcurve.instrument) \
-        .filter(project__exact=lightcurve.project.pk)
-
-    if len(duplicates) > 0:
+    with timing.stage('duplicates'):
+        duplicates = sky_index.cone_search(
+            LightCurve.objects.exclude(id__exact=lightcurve_id),
+            lightcurve.ra,
+            lightcurve.dec,
+            1 / 3600.,
+        ) \
+            .filter(hjd__exact=lightcurve.hjd) \
+            .filter(instrument__iexact=lightcurve.instrument) \
+            .filter(project__exact=lightcurve.project.pk)
+        n_duplicates = len(duplicates)
+
+    if n_duplicates > 0:
         # this specfile already exists, so remove it
         lightcurve.lcfile.delete()
         lightcurve.delete()
@@ -140,15 +152,14 @@ def process_lightcurve(lightcurve_id, create_new_star=True):
     message += "New light curve"
 
     # -- add the lightcurve to existing or new star if the spectrum is newly created
-    star = Star.objects.filter(project__exact=lightcurve.project) \
-        .filter(ra__range=(lightcurve.ra - 0.1, lightcurve.ra + 0.1)) \
-        .filter(dec__range=(lightcurve.dec - 0.1, lightcurve.dec + 0.1))
-
-    if len(star) > 0:
-        # there is one or more stars returned, select the closest star
-        star = star.annotate(
-            distance=ExpressionWrapper(((F('ra') - lightcurve.ra) ** 2 + (F('dec') - lightcurve.dec) ** 2) ** (1. / 2.),
-                                       output_field=FloatField())).order_by('distance')[0]
+    with timing.stage('star_match'):
+        star = star_association.nearest(
+            lightcurve.project,
+            lightcurve.ra,
+            lightcurve.dec,
+        )
+
+    if star is not None:
         star.lightcurve_set.add(lightcurve)
         message += ", added to existing System {} (_r = {})".format(star, star.distance)
         return True, message
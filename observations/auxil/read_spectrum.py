@@ -1,10 +1,9 @@
 import astropy.units as u
 import numpy as np
-from astroplan.moon import moon_illumination
-from astropy.coordinates import SkyCoord, AltAz, get_body
+from astropy.coordinates import SkyCoord, AltAz
 from astropy.time import Time
-from django.db.models import F, ExpressionWrapper, DecimalField
 
+from AOTS import sky_index
 from observations.models import (
     Spectrum,
     UserInfo,
@@ -12,8 +11,11 @@ from observations.models import (
     RawSpecFile,
     Observatory,
 )
+from stars.association import star_association
 from stars.models import Star
+from . import ephemeris as ephemeris_cache
 from . import instrument_headers
+from . import timing
 
 
 ###############################################################################
@@ -62,14 +64,16 @@ def derive_spectrum_info(spectrum_pk, user_info={}):
     """
     #   Get spectrum
     spectrum = Spectrum.objects.get(pk=spectrum_pk)
-    wave, flux, header = spectrum.get_spectrum()
+    with timing.stage('read_file'):
+        wave, flux, header = spectrum.get_spectrum()
 
     #   Get min and max wavelength
     spectrum.minwave = np.min(np.array(wave).flatten())
     spectrum.maxwave = np.max(np.array(wave).flatten())
 
     #   Load info from spectrum header
-    data = instrument_headers.extract_header_info(header, user_info=user_info)
+    with timing.stage('extract_header_info'):
+        data = instrument_headers.extract_header_info(header, user_info=user_info)
 
     #   HJD
     spectrum.hjd = data.get('hjd', 2400000)
@@ -124,68 +128,72 @@ def derive_spectrum_info(spectrum_pk, user_info={}):
     spectrum.note = data.get('note', '')
 
     #    Observatory
-    if 'obs_pk' in user_info.keys():
-        #   Selection from dropdown in the user info form
-        spectrum.observatory = Observatory.objects.get(pk=user_info['obs_pk'])
-    elif 'observatory_id' in user_info.keys():
-        #   Selection based on the information given in the user info form
-        if user_info['observatory_id'] == None:
-            #   If form contains no information try header
+    with timing.stage('observatory'):
+        if 'obs_pk' in user_info.keys():
+            #   Selection from dropdown in the user info form
+            spectrum.observatory = Observatory.objects.get(pk=user_info['obs_pk'])
+        elif 'observatory_id' in user_info.keys():
+            #   Selection based on the information given in the user info form
+            if user_info['observatory_id'] == None:
+                #   If form contains no information try header
+                spectrum.observatory = instrument_headers.get_observatory(
+                    header,
+                    spectrum.project,
+                )
+            else:
+                spectrum.observatory = Observatory.objects.get(
+                    pk=user_info['observatory_id']
+                )
+        else:
+            #   Extract observatory infos from header or create a new observatory
             spectrum.observatory = instrument_headers.get_observatory(
                 header,
                 spectrum.project,
             )
-        else:
-            spectrum.observatory = Observatory.objects.get(
-                pk=user_info['observatory_id']
-            )
-    else:
-        #   Extract observatory infos from header or create a new observatory
-        spectrum.observatory = instrument_headers.get_observatory(
-            header,
-            spectrum.project,
-        )
 
     #   Save the changes
     spectrum.save()
 
-    #   Calculate moon parameters
-    time = Time(spectrum.hjd, format='jd')
-
-    #   Moon illumination wit astroplan (astroplan returns a fraction, but we
-    #   store percentage)
-    spectrum.moon_illumination = np.round(moon_illumination(time=time) * 100, 1)
-
-    #   Get the sky and moon coordinates at time and location of observations
-    sky = SkyCoord(ra=spectrum.ra * u.deg, dec=spectrum.dec * u.deg, )
-    moon = get_body('moon', time)
-
-    #   Set observatory and transform sky coordinates to altitude & azimuth
-    observatory = spectrum.observatory.get_EarthLocation()
-    frame = AltAz(obstime=time, location=observatory)
-
-    star = sky.transform_to(frame)
-    moon = moon.transform_to(frame)
-
-    #   Store the separation between moon and target
-    spectrum.moon_separation = np.round(star.separation(moon).degree, 1)
+    with timing.stage('observing_conditions'):
+        #   Calculate moon parameters from the cached ephemerides
+        time = Time(spectrum.hjd, format='jd')
+        ephemeris = ephemeris_cache.get_sun_moon(spectrum.observatory, spectrum.hjd)
 
-    #   Get object alt-az and airmass if not stored in header
-    if spectrum.alt <= 0:
-        spectrum.alt = star.alt.degree
-    if spectrum.az <= 0:
-        spectrum.az = star.az.degree
-    if spectrum.airmass <= 0:
-        spectrum.airmass = np.round(star.secz.value, 2)
+        #   Moon illumination (the ephemeris contains a fraction, but we
+        #   store percentage)
+        spectrum.moon_illumination = np.round(
+            ephemeris['moon_illumination'] * 100,
+            1,
+        )
 
-    #   Barycentric correction
-    if not spectrum.barycor_bool:
-        vb = sky.radial_velocity_correction(
-            obstime=time,
-            location=observatory,
+        #   Store the separation between moon and target
+        spectrum.moon_separation = np.round(
+            ephemeris_cache.moon_separation(spectrum.ra, spectrum.dec, ephemeris),
+            1,
         )
-        vb = vb.to(u.km / u.s)
-        spectrum.barycor = vb.value
+
+        #   Get object alt-az and airmass if not stored in header
+        observatory = spectrum.observatory.get_EarthLocation()
+        if spectrum.alt <= 0 or spectrum.az <= 0 or spectrum.airmass <= 0:
+            sky = SkyCoord(ra=spectrum.ra * u.deg, dec=spectrum.dec * u.deg, )
+            frame = AltAz(obstime=time, location=observatory)
+            star = sky.transform_to(frame)
+
+            if spectrum.alt <= 0:
+                spectrum.alt = star.alt.degree
+            if spectrum.az <= 0:
+                spectrum.az = star.az.degree
+            if spectrum.airmass <= 0:
+                spectrum.airmass = np.round(star.secz.value, 2)
+
+        #   Barycentric correction
+        if not spectrum.barycor_bool:
+            spectrum.barycor = ephemeris_cache.get_barycentric_correction(
+                spectrum.ra,
+                spectrum.dec,
+                spectrum.observatory,
+                spectrum.hjd,
+            )
 
     #   Save the changes
     spectrum.save()
@@ -203,10 +211,12 @@ def derive_specfile_info(specfile_id, user_info={}):
     specfile = SpecFile.objects.get(pk=specfile_id)
 
     #   Read Data & Header
-    wave, flux, h = specfile.get_spectrum()
+    with timing.stage('read_file'):
+        wave, flux, h = specfile.get_spectrum()
 
     #   Extract info from Header
-    data = instrument_headers.extract_header_info(h, user_info=user_info)
+    with timing.stage('extract_header_info'):
+        data = instrument_headers.extract_header_info(h, user_info=user_info)
 
     #   Set variables
     specfile.hjd = data.get('hjd', 2400000)
@@ -225,6 +235,7 @@ def derive_specfile_info(specfile_id, user_info={}):
     return "File details added/updated", True
 
 
+@timing.timed_pipeline('process_specfile')
 def process_specfile(specfile_id, create_new_star=True,
                      add_to_existing_spectrum=True, user_info={}):
     """
@@ -243,17 +254,23 @@ def process_specfile(specfile_id, create_new_star=True,
     derive_specfile_info(specfile_id, user_info=user_info)
 
     specfile = SpecFile.objects.get(pk=specfile_id)
+    timing.set_instrument(specfile.instrument)
 
     # -- check for duplicates
-    duplicates = SpecFile.objects.exclude(id__exact=specfile_id) \
-        .filter(ra__range=[specfile.ra - 1 / 3600., specfile.ra + 1 / 3600.]) \
-        .filter(dec__range=[specfile.dec - 1 / 3600., specfile.dec + 1 / 3600.]) \
-        .filter(hjd__range=[specfile.hjd - 0.00000001, specfile.hjd + 0.00000001]) \
-        .filter(instrument__iexact=specfile.instrument) \
-        .filter(filetype__iexact=specfile.filetype) \
-        .filter(project__exact=specfile.project.pk)
-
-    if len(duplicates) > 0:
+    with timing.stage('duplicates'):
+        duplicates = sky_index.cone_search(
+            SpecFile.objects.exclude(id__exact=specfile_id),
+            specfile.ra,
+            specfile.dec,
+            1 / 3600.,
+        ) \
+            .filter(hjd__range=[specfile.hjd - 0.00000001, specfile.hjd + 0.00000001]) \
+            .filter(instrument__iexact=specfile.instrument) \
+            .filter(filetype__iexact=specfile.filetype) \
+            .filter(project__exact=specfile.project.pk)
+        n_duplicates = len(duplicates)
+
+    if n_duplicates > 0:
         #     This specfile already exists, so remove it
         message += (f"Specfile {specfile.specfile.name.split('/')[-1]} "
                     f"is a duplicate and was not added!")
@@ -261,13 +278,18 @@ def process_specfile(specfile_id, create_new_star=True,
         return False, message
 
     # -- add specfile to existing or new spectrum
-    spectrum = Spectrum.objects.filter(project__exact=specfile.project) \
-        .filter(ra__range=[specfile.ra - 1 / 3600., specfile.ra + 1 / 3600.]) \
-        .filter(dec__range=[specfile.dec - 1 / 3600., specfile.dec + 1 / 3600.]) \
-        .filter(instrument__iexact=specfile.instrument) \
-        .filter(hjd__range=(specfile.hjd - 0.001, specfile.hjd + 0.001))
-
-    if len(spectrum) > 0 and add_to_existing_spectrum:
+    with timing.stage('spectrum_match'):
+        spectrum = sky_index.cone_search(
+            Spectrum.objects.filter(project__exact=specfile.project),
+            specfile.ra,
+            specfile.dec,
+            1 / 3600.,
+        ) \
+            .filter(instrument__iexact=specfile.instrument) \
+            .filter(hjd__range=(specfile.hjd - 0.001, specfile.hjd + 0.001))
+        n_spectra = len(spectrum)
+
+    if n_spectra > 0 and add_to_existing_spectrum:
         spectrum = spectrum[0]
         spectrum.specfile_set.add(specfile)
         message += "Specfile added to existing Spectrum {} (Target: {})" \
@@ -279,29 +301,24 @@ def process_specfile(specfile_id, create_new_star=True,
         spectrum.specfile_set.add(specfile)
 
         #     Load extra information for the spectrum
-        derive_spectrum_info(
-            spectrum.id,
-            user_info=user_info,
-        )
+        with timing.stage('derive_spectrum_info'):
+            derive_spectrum_info(
+                spectrum.id,
+                user_info=user_info,
+            )
         spectrum.refresh_from_db()  # spectrum is not updated automatically!
         message += "Specfile added to new Spectrum {} (Target: {})" \
             .format(spectrum, spectrum.objectname)
 
     # -- add the spectrum to existing or new star if the spectrum is newly created
-    star = Star.objects.filter(project__exact=spectrum.project) \
-        .filter(ra__range=(spectrum.ra - 0.1, spectrum.ra + 0.1)) \
-        .filter(dec__range=(spectrum.dec - 0.1, spectrum.dec + 0.1))
-
-    if len(star) > 0:
-        #     If there is one or more stars returned, select the closest star
-        star = star.annotate(
-            distance=ExpressionWrapper(
-                ((F('ra') - spectrum.ra) ** 2 +
-                 (F('dec') - spectrum.dec) ** 2
-                 ) ** (1. / 2.),
-                output_field=DecimalField()
-            )
-        ).order_by('distance')[0]
+    with timing.stage('star_match'):
+        star = star_association.nearest(
+            spectrum.project,
+            spectrum.ra,
+            spectrum.dec,
+        )
+
+    if star is not None:
         star.spectrum_set.add(spectrum)
         message += ", and added to existing System {} (_r = {})".format(
             star,
@@ -364,16 +381,20 @@ def derive_raw_file_info(raw_file_id, return_object_properties=False):
     """
     #   Initialize file and read Header
     raw_file = RawSpecFile.objects.get(pk=raw_file_id)
-    header = raw_file.get_header()
+    with timing.stage('read_file'):
+        header = raw_file.get_header()
 
     #   Extract info from Header
-    data = instrument_headers.extract_header_raw(header)
+    with timing.stage('extract_header_info'):
+        data = instrument_headers.extract_header_raw(header)
 
     #   Set variables
     raw_file.hjd = data['hjd']
     raw_file.instrument = data['instrument']
     raw_file.filetype = data['filetype']
     raw_file.exptime = data['exptime']
+    raw_file.ra = data.get('ra', -1)
+    raw_file.dec = data.get('dec', -1)
     raw_file.obs_date = Time(data['hjd'], format='jd', precision=0).iso
 
     #   Save file
@@ -384,6 +405,7 @@ def derive_raw_file_info(raw_file_id, return_object_properties=False):
         return data['objectname'], data['ra'], data['dec']
 
 
+@timing.timed_pipeline('add_and_process_science_raw_spec')
 def add_and_process_science_raw_spec(raw_file_id, create_new_star=True):
     """
         Processes raw spectrum files, attempts to identify science spectra
@@ -429,6 +451,7 @@ def add_and_process_science_raw_spec(raw_file_id, create_new_star=True):
     #   Initialize raw file instance and extract file name
     raw_file = RawSpecFile.objects.get(pk=raw_file_id)
     raw_file_name = raw_file.rawfile.name.split('/')[-1]
+    timing.set_instrument(raw_file.instrument)
 
     if raw_file.filetype == 'Science' and object_name != '' and ra != 0. and dec != 0.:
         ###
@@ -438,18 +461,20 @@ def add_and_process_science_raw_spec(raw_file_id, create_new_star=True):
         #         Add a switch that avoids this check?
         #         Resolve object name with Simbad to get coordinates?
         #         But object might be a cluster or so...
-        other_raw_spec_files = RawSpecFile.objects \
-            .exclude(id__exact=raw_file_id) \
-            .filter(hjd__range=[
-                raw_file.hjd - 0.00000001,
-                raw_file.hjd + 0.00000001
-            ]) \
-            .filter(instrument__iexact=raw_file.instrument) \
-            .filter(filetype__iexact=raw_file.filetype) \
-            .filter(project__exact=raw_file.project.pk)
+        with timing.stage('duplicates'):
+            other_raw_spec_files = RawSpecFile.objects \
+                .exclude(id__exact=raw_file_id) \
+                .filter(hjd__range=[
+                    raw_file.hjd - 0.00000001,
+                    raw_file.hjd + 0.00000001
+                ]) \
+                .filter(instrument__iexact=raw_file.instrument) \
+                .filter(filetype__iexact=raw_file.filetype) \
+                .filter(project__exact=raw_file.project.pk)
+            n_duplicates = len(other_raw_spec_files)
 
         #   If file is already in the database, use this one
-        if len(other_raw_spec_files) > 0:
+        if n_duplicates > 0:
             #   Remove the uploaded raw file
             raw_file.delete()
 
@@ -462,14 +487,18 @@ def add_and_process_science_raw_spec(raw_file_id, create_new_star=True):
             return False, message, True, None, None
         else:
             #   Add raw specfile to existing spec file
-            spec_files = SpecFile.objects \
-                .filter(project__exact=raw_file.project) \
-                .filter(ra__range=[ra - 1 / 3600., ra + 1 / 3600.]) \
-                .filter(dec__range=[dec - 1 / 3600., dec + 1 / 3600.]) \
-                .filter(instrument__iexact=raw_file.instrument) \
-                .filter(hjd__range=(raw_file.hjd - 0.001, raw_file.hjd + 0.001))
-
-            if len(spec_files) > 0:
+            with timing.stage('specfile_match'):
+                spec_files = sky_index.cone_search(
+                    SpecFile.objects.filter(project__exact=raw_file.project),
+                    ra,
+                    dec,
+                    1 / 3600.,
+                ) \
+                    .filter(instrument__iexact=raw_file.instrument) \
+                    .filter(hjd__range=(raw_file.hjd - 0.001, raw_file.hjd + 0.001))
+                n_spec_files = len(spec_files)
+
+            if n_spec_files > 0:
                 #   TODO: Instead of getting the first spec file add an error message and
                 #         redirect the user to the detailed raw spectrum upload method.
                 spec_file = spec_files[0]
@@ -483,19 +512,10 @@ def add_and_process_science_raw_spec(raw_file_id, create_new_star=True):
                             f"file: {raw_file_name} (Target: {object_name})")
 
             #   Add the raw spectrum to existing or new star
-            star = Star.objects.filter(project__exact=raw_file.project) \
-                .filter(ra__range=(ra - 0.1, ra + 0.1)) \
-                .filter(dec__range=(dec - 0.1, dec + 0.1))
-
-            if len(star) > 0:
-                #     If there is one or more stars returned, select the
-                #     closest star
-                star = star.annotate(
-                    distance=ExpressionWrapper(
-                        ((F('ra') - ra) ** 2 + (F('dec') - dec) ** 2) ** (1. / 2.),
-                        output_field=DecimalField()
-                    )
-                ).order_by('distance')[0]
+            with timing.stage('star_match'):
+                star = star_association.nearest(raw_file.project, ra, dec)
+
+            if star is not None:
                 #   TODO: Instead of getting the closes star add an error message and
                 #         redirect the user to the detailed raw spectrum upload method.
                 star.rawspecfile_set.add(raw_file)
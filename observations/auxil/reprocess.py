@@ -0,0 +1,124 @@
+"""
+Reprocessing of existing spectra, specfiles and light curves, fx. after an
+instrument reader or header mapping was fixed. Used by the `reprocess`
+management command.
+
+The objects are processed in batches. Every batch is processed in its own
+transaction, which is committed at the end of the batch, or rolled back in
+dry-run mode after the changes were recorded.
+"""
+
+import django
+from django.db import transaction, connections
+from django.db.models import Q
+
+from observations.models import Spectrum, SpecFile, LightCurve
+from stars.association import star_association
+from . import read_spectrum, read_lightcurve
+from .observatory_resolver import observatory_resolver
+
+#   Model and derive function for every kind of object that can be
+#   reprocessed, in the order in which they need to be processed
+KINDS = {
+    'specfiles': (SpecFile, read_spectrum.derive_specfile_info),
+    'spectra': (Spectrum, read_spectrum.derive_spectrum_info),
+    'lightcurves': (LightCurve, read_lightcurve.derive_lightcurve_info),
+}
+
+
+def select_objects(kind, project, instruments=None, hjd_start=None,
+                   hjd_end=None, exclude=None):
+    """
+        Returns the ordered pks of the objects of the given kind that match
+        the filters
+
+        Parameters
+        ----------
+        kind                : `string`
+            'specfiles', 'spectra' or 'lightcurves'
+
+        project             : `stars.models.Project`
+
+        instruments         : `list` of `string`, optional
+            Instrument names (case-insensitive)
+
+        hjd_start, hjd_end  : `float`, optional
+            Range of the observation time (JD)
+
+        exclude             : `set`, optional
+            pks to skip, fx. those processed before an interruption
+    """
+    model = KINDS[kind][0]
+
+    objects = model.objects.filter(project__exact=project)
+    if instruments:
+        query = Q()
+        for instrument in instruments:
+            query |= Q(instrument__iexact=instrument)
+        objects = objects.filter(query)
+    if hjd_start is not None:
+        objects = objects.filter(hjd__gte=hjd_start)
+    if hjd_end is not None:
+        objects = objects.filter(hjd__lte=hjd_end)
+
+    pks = objects.order_by('pk').values_list('pk', flat=True)
+    if exclude:
+        return [pk for pk in pks if pk not in exclude]
+    return list(pks)
+
+
+def _snapshot(obj):
+    return {f.attname: getattr(obj, f.attname) for f in obj._meta.concrete_fields}
+
+
+def _diff(before, after):
+    return {
+        field: (value, after[field])
+        for field, value in before.items()
+        if after.get(field) != value
+    }
+
+
+def reprocess_batch(kind, pks, dry_run=False):
+    """
+        Rerun the derive function for all objects in the batch
+
+        Returns
+        -------
+        results             : `list` of `tuple`
+            (pk, changes, error) for every object, where changes is a
+            dictionary field -> (old value, new value)
+    """
+    model, derive = KINDS[kind]
+    results = []
+
+    with transaction.atomic():
+        for obj in model.objects.filter(pk__in=pks).order_by('pk'):
+            before = _snapshot(obj)
+            try:
+                #   A failing object should not break the batch
+                with transaction.atomic():
+                    derive(obj.pk)
+                obj.refresh_from_db()
+                results.append((obj.pk, _diff(before, _snapshot(obj)), None))
+            except Exception as e:
+                results.append((obj.pk, {}, str(e)))
+
+        if dry_run:
+            transaction.set_rollback(True)
+
+    if dry_run:
+        #   Observatories and stars created during the batch were rolled back
+        observatory_resolver.invalidate()
+        star_association.invalidate()
+
+    return results
+
+
+def init_worker():
+    """
+        Initializer of the worker processes: the database connections of the
+        parent can not be shared
+    """
+    django.setup()
+    connections.close_all()
@@ -1,6 +1,7 @@
 import re
 
-from spectra.models import Spectrum
+from AOTS import search_index
+from observations.models import Spectrum
 
 
 def search_spectra(q):
@@ -22,7 +23,7 @@ def search_spectra(q):
         hjd1, hjd2 = float(hjds[0]), float(hjds[1])
         return Spectrum.objects.filter(hjd__lte=hjd2).filter(hjd__gte=hjd1)
 
-    # match instrument or telescope
+    # match object name, instrument or telescope in the search index
     else:
-        return Spectrum.objects.filter(instrument__icontains=q.strip()) | Spectrum.objects.filter(
-            telescope__icontains=q.strip())
+        documents = search_index.matching(q.strip(), kinds=['spectrum'])
+        return Spectrum.objects.filter(pk__in=documents.values('object_id'))
@@ -0,0 +1,225 @@
+"""
+Per-stage timing of the ingest pipelines.
+
+A pipeline function (fx. `process_specfile`) is decorated with
+`timed_pipeline`. Within it, and in all functions it calls, the time spent in
+a stage is measured with the `stage` context manager. Stages are inclusive,
+fx. 'history' (the simple_history writes) is also part of the stage in which
+the model was saved. Stages outside a timed pipeline are not measured.
+
+When the pipeline finishes, the timings are emitted as a log record on the
+'aots.ingest' logger and stored as `IngestTiming` entries, from which
+`get_statistics` derives the p50/p95 per stage and instrument over a sliding
+window (INGEST_TIMING_WINDOW in the settings).
+"""
+
+import contextvars
+import functools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.dispatch import receiver
+from django.utils import timezone
+from simple_history.signals import (
+    pre_create_historical_record,
+    post_create_historical_record,
+)
+
+logger = logging.getLogger('aots.ingest')
+
+#   Timer of the pipeline that is currently running
+_current_timer = contextvars.ContextVar('ingest_timer', default=None)
+
+#   Time of the last removal of timings outside the window
+_last_prune = 0.
+
+
+def get_window():
+    """
+        Length of the sliding window in seconds
+    """
+    return getattr(settings, 'INGEST_TIMING_WINDOW', 86400)
+
+
+class IngestTimer:
+    """
+        Collects the durations of the stages of one pipeline run
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.instrument = 'UK'
+        self.stages = OrderedDict()
+        self.start = time.perf_counter()
+        self._history_start = None
+
+    def add(self, stage, duration):
+        self.stages[stage] = self.stages.get(stage, 0.) + duration
+
+    def finish(self, success=True):
+        self.add('total', time.perf_counter() - self.start)
+
+        logger.info(
+            "%s [%s] %s: %s",
+            self.pipeline,
+            self.instrument,
+            'success' if success else 'failed',
+            ', '.join('{}={:.3f}s'.format(k, v) for k, v in self.stages.items()),
+            extra={'ingest_timing': {
+                'pipeline': self.pipeline,
+                'instrument': self.instrument,
+                'success': success,
+                'stages': dict(self.stages),
+            }},
+        )
+
+        try:
+            record(self)
+        except Exception as e:
+            #   Bookkeeping must never break the ingest
+            logger.warning("Could not store ingest timings: %s", e)
+
+
+def timed_pipeline(pipeline):
+    """
+        Decorator that times a pipeline function. Calls from within another
+        timed pipeline are counted as a stage of the outer pipeline.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_timer.get() is not None:
+                with stage(pipeline):
+                    return func(*args, **kwargs)
+
+            timer = IngestTimer(pipeline)
+            token = _current_timer.set(timer)
+            success = False
+            try:
+                result = func(*args, **kwargs)
+                if isinstance(result, tuple) and len(result) > 0:
+                    success = bool(result[0])
+                return result
+            finally:
+                _current_timer.reset(token)
+                timer.finish(success=success)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def stage(name):
+    """
+        Measure the time spent in the block as stage `name` of the running
+        pipeline
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def set_instrument(instrument):
+    """
+        Set the instrument of the file processed by the running pipeline
+    """
+    timer = _current_timer.get()
+    if timer is not None and instrument:
+        timer.instrument = str(instrument)[:200]
+
+
+@receiver(pre_create_historical_record)
+def _start_history_timer(sender, **kwargs):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer._history_start = time.perf_counter()
+
+
+@receiver(post_create_historical_record)
+def _stop_history_timer(sender, **kwargs):
+    timer = _current_timer.get()
+    if timer is not None and timer._history_start is not None:
+        timer.add('history', time.perf_counter() - timer._history_start)
+        timer._history_start = None
+
+
+def record(timer):
+    """
+        Store the timings of a pipeline run and remove timings that are
+        outside the window (at most once per minute)
+    """
+    global _last_prune
+
+    #   Imported here, since the models import the file io of this package
+    from observations.models import IngestTiming
+
+    IngestTiming.objects.bulk_create([
+        IngestTiming(
+            pipeline=timer.pipeline,
+            stage=stage_name,
+            instrument=timer.instrument,
+            duration=duration,
+        )
+        for stage_name, duration in timer.stages.items()
+    ])
+
+    if time.monotonic() - _last_prune > 60.:
+        _last_prune = time.monotonic()
+        IngestTiming.objects.filter(
+            added_on__lt=timezone.now() - timedelta(seconds=get_window())
+        ).delete()
+
+
+def get_statistics(window=None, pipeline=None):
+    """
+        Median and 95th percentile of the duration of each stage per pipeline
+        and instrument over the last `window` seconds
+
+        Returns
+        -------
+        statistics          : `list` of `dict`
+            Entries with pipeline, stage, instrument, count, p50 and p95 (s)
+    """
+    from observations.models import IngestTiming
+
+    if window is None:
+        window = get_window()
+
+    timings = IngestTiming.objects.filter(
+        added_on__gte=timezone.now() - timedelta(seconds=window)
+    )
+    if pipeline is not None:
+        timings = timings.filter(pipeline__exact=pipeline)
+
+    groups = OrderedDict()
+    for row in timings.order_by('pipeline', 'instrument', 'stage') \
+            .values_list('pipeline', 'stage', 'instrument', 'duration'):
+        groups.setdefault(row[:3], []).append(row[3])
+
+    statistics = []
+    for (pipeline_name, stage_name, instrument), durations in groups.items():
+        p50, p95 = np.percentile(durations, [50, 95])
+        statistics.append({
+            'pipeline': pipeline_name,
+            'stage': stage_name,
+            'instrument': instrument,
+            'count': len(durations),
+            'p50': float(p50),
+            'p95': float(p95),
+        })
+
+    return statistics
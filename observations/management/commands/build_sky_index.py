@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from AOTS import sky_index
+from observations.models import Spectrum, SpecFile, RawSpecFile, LightCurve
+from stars.models import Star
+
+#   Models with a HEALPix column
+MODELS = [Star, Spectrum, SpecFile, RawSpecFile, LightCurve]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the HEALPix column of stars, spectra, specfiles, raw files and "
+        "light curves that were created before the sky index existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help="Recalculate the pixels of all objects, not only missing ones",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help="Number of objects updated per query (default: 5000)",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        for model in MODELS:
+            objects = model.objects.all()
+            if not options['all']:
+                objects = objects.filter(healpix__isnull=True)
+
+            pks = list(objects.order_by('pk').values_list('pk', flat=True))
+            for i in range(0, len(pks), batch_size):
+                batch = list(
+                    model.objects.filter(pk__in=pks[i:i + batch_size])
+                    .only('pk', 'ra', 'dec', 'healpix')
+                )
+                pixels = sky_index.ang2pix_many(
+                    [obj.ra for obj in batch],
+                    [obj.dec for obj in batch],
+                )
+                for obj, pixel in zip(batch, pixels):
+                    obj.healpix = pixel
+
+                #   bulk_update does not trigger save or the history
+                model.objects.bulk_update(batch, ['healpix'])
+
+            self.stdout.write("{}: {} objects indexed".format(
+                model._meta.verbose_name_plural,
+                len(pks),
+            ))
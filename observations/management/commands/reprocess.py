@@ -0,0 +1,195 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from astropy.time import Time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from observations.auxil import reprocess
+from stars.models import Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Rerun derive_specfile_info/derive_spectrum_info and "
+        "derive_lightcurve_info for the spectra and light curves of a project, "
+        "fx. after an instrument reader or header mapping was fixed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'project',
+            help="Slug, name or pk of the project",
+        )
+        parser.add_argument(
+            '--kind',
+            nargs='+',
+            choices=list(reprocess.KINDS.keys()),
+            default=list(reprocess.KINDS.keys()),
+            help="Kind of objects to reprocess (default: all)",
+        )
+        parser.add_argument(
+            '--instrument',
+            nargs='+',
+            default=None,
+            help="Only reprocess observations of these instruments",
+        )
+        parser.add_argument(
+            '--start',
+            default=None,
+            help="Only reprocess observations after this date (ISO or JD)",
+        )
+        parser.add_argument(
+            '--end',
+            default=None,
+            help="Only reprocess observations before this date (ISO or JD)",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help="Number of objects committed together (default: 50)",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes, 1 processes in this process",
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Report the fields that would change without saving them",
+        )
+        parser.add_argument(
+            '--state-file',
+            default='reprocess_state.json',
+            help="File in which the processed objects are recorded",
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help="Skip the objects recorded in the state file",
+        )
+
+    def handle(self, *args, **options):
+        project = self.get_project(options['project'])
+        hjd_start = self.get_jd(options['start'])
+        hjd_end = self.get_jd(options['end'])
+        dry_run = options['dry_run']
+
+        state = {}
+        if options['resume'] and os.path.isfile(options['state_file']):
+            with open(options['state_file']) as f:
+                state = json.load(f)
+        self.state_file = None if dry_run else options['state_file']
+
+        #   Kinds are processed one after the other, since spectra need to be
+        #   derived after their specfiles
+        for kind in reprocess.KINDS.keys():
+            if kind not in options['kind']:
+                continue
+
+            done = set(state.get(kind, []))
+            pks = reprocess.select_objects(
+                kind,
+                project,
+                instruments=options['instrument'],
+                hjd_start=hjd_start,
+                hjd_end=hjd_end,
+                exclude=done,
+            )
+            self.stdout.write(
+                "{}: {} to reprocess ({} done before)".format(kind, len(pks), len(done))
+            )
+
+            batches = [
+                pks[i:i + options['batch_size']]
+                for i in range(0, len(pks), options['batch_size'])
+            ]
+
+            n_changed, n_failed = 0, 0
+            for results in self.run_batches(kind, batches, options['workers'], dry_run):
+                for pk, changes, error in results:
+                    if error is not None:
+                        n_failed += 1
+                        self.stderr.write("{} {}: {}".format(kind, pk, error))
+                        continue
+                    done.add(pk)
+                    if changes:
+                        n_changed += 1
+                        if dry_run:
+                            self.report_changes(kind, pk, changes)
+
+                state[kind] = sorted(done)
+                self.write_state(state)
+
+            self.stdout.write(self.style.SUCCESS(
+                "{}: {} {}, {} failed".format(
+                    kind,
+                    n_changed,
+                    'would change' if dry_run else 'changed',
+                    n_failed,
+                )
+            ))
+
+    @staticmethod
+    def run_batches(kind, batches, workers, dry_run):
+        """
+            Yields the results of the batches as they are completed
+        """
+        if workers is None or workers <= 1 or len(batches) <= 1:
+            for batch in batches:
+                yield reprocess.reprocess_batch(kind, batch, dry_run=dry_run)
+            return
+
+        #   The workers open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=reprocess.init_worker,
+        ) as executor:
+            futures = [
+                executor.submit(reprocess.reprocess_batch, kind, batch, dry_run)
+                for batch in batches
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def report_changes(self, kind, pk, changes):
+        self.stdout.write("{} {}:".format(kind, pk))
+        for field, (old, new) in changes.items():
+            self.stdout.write("    {}: {!r} -> {!r}".format(field, old, new))
+
+    def write_state(self, state):
+        if self.state_file is None:
+            return
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def get_project(value):
+        project = Project.objects.filter(slug__exact=value).first()
+        if project is None:
+            project = Project.objects.filter(name__exact=value).first()
+        if project is None and value.isdigit():
+            project = Project.objects.filter(pk=int(value)).first()
+        if project is None:
+            raise CommandError("Project '{}' does not exist".format(value))
+        return project
+
+    @staticmethod
+    def get_jd(value):
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return Time(value, format='isot' if 'T' in value else 'iso').jd
+        except ValueError:
+            raise CommandError("Invalid date: {}".format(value))
@@ -2,3 +2,5 @@ from .lightcurves import LightCurve
 from .observatory import Observatory
 from .photometry import Photometry
 from .spectroscopy import Spectrum, SpecFile, UserInfo, RawSpecFile
+from .timing import IngestTiming
+from .uploads import UploadSession
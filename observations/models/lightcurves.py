@@ -8,7 +8,9 @@ from django.db.models.signals import post_delete
 from django.dispatch import receiver
 from simple_history.models import HistoricalRecords
 
+from AOTS import sky_index
 from observations.auxil import fileio
+from stars import counters
 from stars.models import Star, Project
 from .observatory import Observatory
 
@@ -33,6 +35,7 @@ class LightCurve(models.Model):
     objectname = models.CharField(max_length=50, default='')
     ra = models.FloatField(default=-1)
     dec = models.FloatField(default=-1)
+    healpix = models.BigIntegerField(null=True, blank=True, db_index=True)
     alt = models.FloatField(default=-1)  # average altitude angle of observation
     az = models.FloatField(default=-1)  # average azimut angle of observation
     airmass = models.FloatField(default=-1)  # average airmass
@@ -94,6 +97,13 @@ class LightCurve(models.Model):
         return "{}@{} - {}".format(self.instrument, self.telescope, self.hjd)
 
 
+# Keep the HEALPix pixel of the coordinates up to date (see AOTS.sky_index)
+sky_index.register(LightCurve)
+
+# -- keep the number of light curves of the star up to date
+counters.register(LightCurve, 'n_lightcurves')
+
+
 # Handler to assure the deletion of a specfile removes the actual file, and if necessary the 
 # lightcurve that belongs to this file
 @receiver(post_delete, sender=LightCurve)
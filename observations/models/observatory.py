@@ -9,6 +9,7 @@ from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from simple_history.models import HistoricalRecords
 
+from AOTS import versions
 from stars.models import Project
 
 
@@ -113,3 +114,7 @@ def set_short_name(sender, **kwargs):
 
         # print ('shortname: ', short_name)
         observatory.short_name = short_name
+
+
+# -- bump the API version of the observatories of the project on changes
+versions.register(Observatory)
@@ -2,6 +2,8 @@ from django.conf import settings
 from django.db import models
 from simple_history.models import HistoricalRecords
 
+from AOTS import versions
+from stars import counters
 from stars.models import Star
 
 band_wavelengths = {'GALEX.FUV': 1535,
@@ -102,3 +104,10 @@ class Photometry(models.Model):
             self.wavelength = band_wavelengths[self.band]
 
         super(Photometry, self).save(*args, **kwargs)
+
+
+# -- keep the number of photometry points of the star up to date
+counters.register(Photometry, 'n_photometry')
+
+# -- bump the API version of the photometry of the project on changes
+versions.register(Photometry, project=lambda photometry: photometry.star.project_id)
@@ -8,7 +8,9 @@ from django.db.models.signals import pre_delete, post_delete
 from django.dispatch import receiver
 from simple_history.models import HistoricalRecords
 
+from AOTS import search_index, sky_index
 from observations.auxil import fileio
+from stars import counters
 from stars.models import Star, Project
 from .observatory import Observatory
 
@@ -33,6 +35,7 @@ class Spectrum(models.Model):
     objectname = models.CharField(max_length=50, default='')
     ra = models.FloatField(default=-1)
     dec = models.FloatField(default=-1)
+    healpix = models.BigIntegerField(null=True, blank=True, db_index=True)
     alt = models.FloatField(default=-1)  # average altitude angle of observation
     az = models.FloatField(default=-1)  # average azimut angle of observation
     airmass = models.FloatField(default=-1)  # average airmass
@@ -211,6 +214,7 @@ class SpecFile(models.Model):
     #   dec is necessary for multi object spectrographs
     ra = models.FloatField(default=-1)
     dec = models.FloatField(default=-1)
+    healpix = models.BigIntegerField(null=True, blank=True, db_index=True)
     hjd = models.FloatField(default=-1)
     exptime = models.FloatField(default=-1)
     resolution = models.FloatField(default=-1)
@@ -289,6 +293,11 @@ class RawSpecFile(models.Model):
     instrument = models.CharField(max_length=200, default='')
     filetype = models.CharField(max_length=200, default='')
 
+    #   Pointing, used to match science frames with spectra and stars
+    ra = models.FloatField(default=-1.)
+    dec = models.FloatField(default=-1.)
+    healpix = models.BigIntegerField(null=True, blank=True, db_index=True)
+
     #   Exposure time
     exptime = models.FloatField(default=-1.)  # s
 
@@ -327,6 +336,36 @@ class RawSpecFile(models.Model):
             self.obs_date,
         )
 
+###
+#   HEALPix pixels of the coordinates (see AOTS.sky_index)
+#
+sky_index.register(Spectrum)
+sky_index.register(SpecFile)
+sky_index.register(RawSpecFile)
+
+
+###
+#   Search documents (see AOTS.search_index)
+#
+def spectrum_search_document(spectrum):
+    return {
+        'project': spectrum.project,
+        'star': spectrum.star,
+        'title': spectrum.objectname or str(spectrum.pk),
+        'terms': [spectrum.instrument, spectrum.telescope],
+    }
+
+
+search_index.register(Spectrum, 'spectrum', spectrum_search_document)
+
+
+###
+#   Number of spectra and raw science files of the stars (see stars.counters)
+#
+counters.register(Spectrum, 'n_spectra', recount_on_move=['n_raw_science'])
+counters.register_raw_files(RawSpecFile, SpecFile)
+
+
 ###
 #   Deletion handlers
 #
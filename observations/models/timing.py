@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+
+from django.db import models
+
+
+###
+#   IngestTiming
+#
+class IngestTiming(models.Model):
+    """
+        Duration of one stage of an ingest pipeline (fx. process_specfile)
+        for one processed file. Used to derive the timing statistics per
+        stage and instrument, see `observations.auxil.timing`.
+    """
+
+    pipeline = models.CharField(max_length=50, default='')
+    stage = models.CharField(max_length=50, default='')
+    instrument = models.CharField(max_length=200, default='UK')
+
+    #   Duration in seconds
+    duration = models.FloatField(default=0.)
+
+    added_on = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    #   Representation of self
+    def __str__(self):
+        return "{}.{} ({}): {:.3f}s".format(
+            self.pipeline,
+            self.stage,
+            self.instrument,
+            self.duration,
+        )
@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+from stars.models import Project
+from .spectroscopy import SpecFile, RawSpecFile
+
+
+###
+#   UploadSession
+#
+class UploadSession(models.Model):
+    """
+        Model to represent a resumable, chunked upload of a single spectrum
+        or raw file via the API.
+
+        The chunks are written directly to `name`, a partial file next to the
+        final storage location of the file. When the upload is finalized the
+        partial file is renamed, the SpecFile/RawSpecFile is created and the
+        file is queued for processing.
+    """
+
+    SPECTRUM = 'spectrum'
+    RAW = 'raw'
+    FILE_TYPES = (
+        (SPECTRUM, 'Spectrum'),
+        (RAW, 'Raw file'),
+    )
+
+    OPEN = 'open'
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (OPEN, 'Open'),
+        (QUEUED, 'Queued'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    #   Public identifier of the upload, used in the API urls
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+
+    #   An upload belongs to a project and a user
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=False, )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=False,
+    )
+
+    filetype = models.CharField(max_length=10, choices=FILE_TYPES, default=SPECTRUM)
+
+    #   Original file name and storage name (relative to MEDIA_ROOT) of the
+    #   final file
+    filename = models.CharField(max_length=255, default='')
+    name = models.CharField(max_length=500, default='')
+
+    #   Announced size and number of contiguous bytes received (bytes)
+    size = models.BigIntegerField(default=0)
+    received = models.BigIntegerField(default=0)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=OPEN)
+    message = models.TextField(default='', blank=True)
+
+    #   Created file
+    specfile = models.ForeignKey(
+        SpecFile,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    rawfile = models.ForeignKey(
+        RawSpecFile,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+
+    added_on = models.DateTimeField(auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    #   Representation of self
+    def __str__(self):
+        return "{} ({}, {})".format(
+            self.filename,
+            self.filetype,
+            self.status,
+        )
@@ -3,13 +3,14 @@ collection of all necessary bokeh plotting functions for spectra
 """
 import astropy.units as u
 import numpy as np
-from astropy.coordinates import SkyCoord, AltAz, get_body
+from astropy.coordinates import SkyCoord, AltAz
 from astropy.time import Time
 from bokeh import models as mpl
 from bokeh import plotting as bpl
 from bokeh.models import TabPanel, Tabs
 from specutils import Spectrum1D
 
+from observations.auxil import ephemeris
 from observations.auxil import tools as spectools
 from stars.models import Star
 from .models import Spectrum, LightCurve
@@ -87,9 +88,16 @@ def plot_visibility(observation):
 
         time = Time(observation.hjd, format='jd')
 
-        sunset, sunrise = observation.observatory.get_sunset_sunrise(time)
+        sunset, sunrise = ephemeris.get_sunset_sunrise(
+            observation.observatory,
+            observation.hjd,
+        )
 
         times = np.linspace(sunset.jd, sunrise.jd, 100)
+
+        #   Moon track from the cached ephemerides
+        moon_alt = ephemeris.get_sun_moon(observation.observatory, times)['moon_alt']
+
         times = Time(times, format='jd')
 
         star = SkyCoord(ra=observation.ra * u.deg, dec=observation.dec * u.deg, )
@@ -98,13 +106,10 @@ def plot_visibility(observation):
 
         star_altaz = star.transform_to(frame_star)
 
-        moon = get_body('moon', times)
-        moon_altaz = moon.transform_to(frame_star)
-
         times = times.to_datetime()
 
         fig.line(times, star_altaz.alt, color='blue', line_width=2)
-        fig.line(times, moon_altaz.alt, color='orange', line_dash='dashed', line_width=2)
+        fig.line(times, moon_alt, color='orange', line_dash='dashed', line_width=2)
 
         obsstart = (time - observation.exptime / 2 * u.second).to_datetime()
         obsend = (time + observation.exptime / 2 * u.second).to_datetime()
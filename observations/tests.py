@@ -1 +1,634 @@
-# Create your tests here.
+import base64
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+import numpy as np
+from astroplan.moon import moon_illumination
+from astropy.coordinates import AltAz, get_body
+from astropy.time import Time
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from observations.auxil import ephemeris, timing
+from observations.auxil.instrument_headers import get_observatory
+from observations.auxil.observatory_resolver import observatory_resolver
+from observations.models import Observatory, SpecFile, Spectrum, UploadSession
+from stars.models import Project, Star
+from users.models import User
+
+LOCMEM_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EPHEMERIS_CACHE_BUCKET=600)
+class EphemerisCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        p = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.observatory = Observatory.objects.create(
+            name='La Silla',
+            project=p,
+            latitude=-29.2567,
+            longitude=-70.7346,
+            altitude=2400,
+        )
+        self.jd = 2459000.7321
+
+    def test_interpolated_ephemeris_matches_direct_calculation(self):
+        """
+        Values interpolated within a time bucket need to be close to the
+        direct astropy calculation
+        """
+        eph = ephemeris.get_sun_moon(self.observatory, self.jd)
+
+        time = Time(self.jd, format='jd')
+        location = self.observatory.get_EarthLocation()
+        moon = get_body('moon', time, location=location)
+        moon_altaz = moon.transform_to(AltAz(obstime=time, location=location))
+
+        self.assertAlmostEqual(eph['moon_alt'], moon_altaz.alt.degree, delta=0.05,
+                               msg="Interpolated moon altitude is wrong")
+        self.assertAlmostEqual(eph['moon_illumination'], moon_illumination(time), delta=0.001,
+                               msg="Interpolated moon illumination is wrong")
+        self.assertAlmostEqual(ephemeris.moon_separation(moon.ra.degree, moon.dec.degree, eph),
+                               0., delta=0.05, msg="Moon separation to itself is not zero")
+
+    def test_ephemeris_nodes_are_reused(self):
+        """
+        Observations in the same time bucket should not trigger a new calculation
+        """
+        ephemeris.get_sun_moon(self.observatory, self.jd)
+
+        with mock.patch.object(ephemeris, '_compute_nodes') as compute:
+            ephemeris.get_sun_moon(self.observatory, self.jd + 60. / 86400.)
+            compute.assert_not_called()
+
+    def test_vectorized_ephemeris(self):
+        """
+        Arrays of times return arrays consistent with the scalar results
+        """
+        jds = np.linspace(self.jd, self.jd + 0.2, 25)
+        track = ephemeris.get_sun_moon(self.observatory, jds)
+
+        self.assertEqual(len(track['moon_alt']), 25,
+                         "Ephemeris track has wrong length")
+        self.assertAlmostEqual(track['sun_alt'][10],
+                               ephemeris.get_sun_moon(self.observatory, jds[10])['sun_alt'],
+                               msg="Scalar and vectorized ephemeris differ")
+
+    def test_barycentric_correction_memoized(self):
+        """
+        The barycentric correction is only calculated once per target, observatory and time
+        """
+        vb = ephemeris.get_barycentric_correction(279.2347, 38.7837, self.observatory, self.jd)
+
+        with mock.patch('observations.auxil.ephemeris.SkyCoord') as sky:
+            vb2 = ephemeris.get_barycentric_correction(279.2347, 38.7837, self.observatory, self.jd)
+            sky.assert_not_called()
+
+        self.assertEqual(vb, vb2, "Memoized barycentric correction differs")
+        self.assertTrue(-30 < vb < 30, "Barycentric correction out of range: {}".format(vb))
+
+
+class ObservatoryResolution(TestCase):
+
+    def setUp(self):
+        observatory_resolver.invalidate()
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.observatory = Observatory.objects.create(
+            name='La Silla',
+            project=self.project,
+            telescopes='Euler, Danish',
+            latitude=-29.2567,
+            longitude=-70.7346,
+            altitude=2400,
+        )
+
+    def test_resolve_by_telescope_and_location(self):
+        """
+        Observatories are found on telescope name and on location
+        """
+        self.assertEqual(get_observatory({'TELESCOP': 'EULER'}, self.project),
+                         self.observatory, "Observatory not found on telescope name")
+
+        header = {'TELESCOP': 'Unknown', 'GEOLAT': -29.2, 'GEOLON': -70.7, 'GEOALT': 2400}
+        self.assertEqual(get_observatory(header, self.project), self.observatory,
+                         "Observatory not found on location")
+
+    def test_warm_resolver_does_not_query(self):
+        """
+        Once the observatories of a project are loaded, no queries are needed
+        """
+        get_observatory({'TELESCOP': 'Euler'}, self.project)
+
+        with self.assertNumQueries(0):
+            get_observatory({'TELESCOP': 'Danish'}, self.project)
+            get_observatory({'GEOLAT': -29.25, 'GEOLON': -70.73}, self.project)
+
+    def test_new_observatory_invalidates_index(self):
+        """
+        Creating or changing an observatory drops the cached index
+        """
+        header = {'TELESCOP': 'Mercator', 'GEOLAT': 28.76, 'GEOLON': -17.88, 'GEOALT': 2333}
+        obs = get_observatory(header, self.project)
+
+        self.assertNotEqual(obs, self.observatory, "No new observatory was created")
+        self.assertEqual(get_observatory(header, self.project), obs,
+                         "New observatory is not resolved")
+        self.assertEqual(Observatory.objects.count(), 2)
+
+        self.observatory.telescopes = 'Euler, Danish, REM'
+        self.observatory.save()
+        self.assertEqual(get_observatory({'TELESCOP': 'REM'}, self.project),
+                         self.observatory, "Changed observatory is not resolved")
+
+
+class ChunkedUpload(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.user = User.objects.create(
+            username='uploader',
+            api_key='public',
+            api_secret=make_password('secret'),
+        )
+        self.headers = {
+            'HTTP_PUBLICAPIKEY': 'public',
+            'HTTP_SECRETAPIKEY': 'secret',
+            'HTTP_PROJECTID': str(self.project.pk),
+        }
+        self.content = os.urandom(3000)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def put_chunk(self, upload_id, start, end):
+        return self.client.put(
+            reverse('observations-api:api-upload-chunk', args=[upload_id]),
+            data=self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes {}-{}/{}'.format(start, end, len(self.content)),
+            **self.headers,
+        )
+
+    def test_resumable_upload(self):
+        """
+        Chunks are written to the final location and the file is queued on finalize
+        """
+        response = self.client.post(
+            reverse('observations-api:api-upload'),
+            data={'filename': 'spectrum.fits', 'size': len(self.content)},
+            **self.headers,
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        upload_id = response.data['upload_id']
+
+        self.assertEqual(self.put_chunk(upload_id, 0, 1023).status_code, 200)
+
+        #   Gaps are refused, the client can resume from the returned offset
+        response = self.put_chunk(upload_id, 2048, 2999)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received'], 1024)
+
+        self.assertEqual(self.put_chunk(upload_id, 1024, 2999).status_code, 200)
+
+        finalize_url = reverse('observations-api:api-upload-finalize', args=[upload_id])
+        response = self.client.post(finalize_url, data={'sha256': '0' * 64}, **self.headers)
+        self.assertEqual(response.status_code, 400, "Wrong checksum was accepted")
+
+        with mock.patch('observations.auxil.chunked_upload.queue_processing') as queue, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(
+                finalize_url,
+                data={'sha256': hashlib.sha256(self.content).hexdigest()},
+                **self.headers,
+            )
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(len(callbacks), 1)
+        queue.assert_called_once()
+
+        session = UploadSession.objects.get(upload_id=upload_id)
+        self.assertEqual(session.status, UploadSession.QUEUED)
+
+        specfile = SpecFile.objects.get(pk=session.specfile_id)
+        with open(specfile.specfile.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content, "Uploaded file is corrupted")
+        self.assertFalse(os.path.exists(specfile.specfile.path + '.part'))
+
+    def test_upload_session_requires_owner(self):
+        """
+        Upload sessions can only be accessed by the user that created them
+        """
+        response = self.client.post(
+            reverse('observations-api:api-upload'),
+            data={'filename': 'raw.fits', 'size': 10, 'filetype': 'raw'},
+            **self.headers,
+        )
+        other = User.objects.create(
+            username='other',
+            api_key='public2',
+            api_secret=make_password('secret2'),
+        )
+        response = self.client.get(
+            reverse('observations-api:api-upload-chunk', args=[response.data['upload_id']]),
+            HTTP_PUBLICAPIKEY=other.api_key,
+            HTTP_SECRETAPIKEY='secret2',
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class IngestTimingStatistics(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+
+        @timing.timed_pipeline('test_pipeline')
+        def pipeline(instrument):
+            timing.set_instrument(instrument)
+            with timing.stage('read_file'):
+                pass
+            with timing.stage('star_match'):
+                Star.objects.create(name='HD 1', ra=1., dec=1., project=self.project)
+            return True, 'done'
+
+        self.pipeline = pipeline
+
+    def test_stage_timings_are_logged_and_aggregated(self):
+        """
+        Every run emits a log record and the stages are aggregated per instrument
+        """
+        with self.assertLogs('aots.ingest', level='INFO') as logs:
+            for _ in range(3):
+                self.pipeline('HERMES')
+            self.pipeline('UVES')
+
+        self.assertEqual(len(logs.records), 4)
+        stages = logs.records[0].ingest_timing['stages']
+        for stage in ['read_file', 'star_match', 'history', 'total']:
+            self.assertIn(stage, stages, "Stage {} not timed".format(stage))
+
+        statistics = timing.get_statistics(pipeline='test_pipeline')
+        hermes = [s for s in statistics
+                  if s['instrument'] == 'HERMES' and s['stage'] == 'total'][0]
+        self.assertEqual(hermes['count'], 3)
+        self.assertTrue(hermes['p50'] <= hermes['p95'])
+
+        #   Stages outside a pipeline are not recorded
+        with timing.stage('read_file'):
+            pass
+        self.assertEqual(len(timing.get_statistics(pipeline='test_pipeline')),
+                         len(statistics))
+
+    def test_timing_endpoint_requires_admin(self):
+        self.pipeline('HERMES')
+        url = reverse('observations-api:ingest_timings')
+
+        user = User.objects.create(username='user')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(url, {'pipeline': 'test_pipeline'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({s['stage'] for s in response.json()},
+                         {'read_file', 'star_match', 'history', 'total'})
+
+
+class Reprocess(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.specfile = SpecFile(project=self.project, instrument='HERMES')
+        self.specfile.specfile.save(
+            'spectrum.txt',
+            ContentFile(b'4000.0 1.0\n4001.0 1.1\n4002.0 0.9\n'),
+        )
+        self.state_file = os.path.join(self.media_root, 'state.json')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def reprocess(self, *args, **kwargs):
+        out = StringIO()
+        call_command(
+            'reprocess',
+            self.project.slug,
+            *args,
+            kind=['specfiles'],
+            workers=1,
+            state_file=self.state_file,
+            stdout=out,
+            stderr=StringIO(),
+            **kwargs,
+        )
+        return out.getvalue()
+
+    def test_dry_run_reports_changes(self):
+        """
+        A dry run reports the changed fields but does not save them
+        """
+        output = self.reprocess(dry_run=True)
+
+        self.assertIn("hjd: -1.0 -> 2400000", output)
+        self.assertIn("1 would change", output)
+        self.specfile.refresh_from_db()
+        self.assertEqual(self.specfile.hjd, -1)
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_reprocess_and_resume(self):
+        """
+        Reprocessed objects are saved and skipped when resuming
+        """
+        self.reprocess(instrument=['hermes'])
+        self.specfile.refresh_from_db()
+        self.assertEqual(self.specfile.hjd, 2400000)
+
+        output = self.reprocess(resume=True)
+        self.assertIn("specfiles: 0 to reprocess (1 done before)", output)
+
+        #   Instrument and date filters
+        output = self.reprocess(instrument=['UVES'])
+        self.assertIn("specfiles: 0 to reprocess", output)
+        output = self.reprocess(start='1900-01-01')
+        self.assertIn("specfiles: 0 to reprocess", output)
+
+
+class ConeSearch(TestCase):
+
+    def setUp(self):
+        self.public = Project.objects.create(name='Public', is_public=True)
+        self.private = Project.objects.create(name='Private', is_public=False)
+
+        Star.objects.create(name='near', project=self.public, ra=279.2347, dec=38.7837)
+        Star.objects.create(name='further', project=self.public, ra=279.2347, dec=38.7857)
+        Star.objects.create(name='outside', project=self.public, ra=279.2347, dec=38.8837)
+        Star.objects.create(name='hidden', project=self.private, ra=279.2347, dec=38.7837)
+        Spectrum.objects.create(project=self.public, objectname='near', ra=279.2348, dec=38.7837)
+
+    def test_cone_search(self):
+        """
+        Objects are sorted by angular distance and private projects are hidden
+        """
+        response = self.client.get(reverse('cone-search'), {
+            'ra': '18:36:56.33',
+            'dec': '+38:47:01.3',
+            'radius': 60,
+        })
+        self.assertEqual(response.status_code, 200)
+
+        stars = response.json()['stars']
+        self.assertEqual([s['name'] for s in stars], ['near', 'further'])
+        self.assertTrue(stars[0]['distance'] < stars[1]['distance'] < 60.)
+        self.assertAlmostEqual(stars[1]['distance'], 7.2, delta=0.1)
+
+        self.assertEqual(len(response.json()['spectra']), 1)
+        self.assertEqual(response.json()['lightcurves'], [])
+
+    def test_cone_search_requires_coordinates(self):
+        response = self.client.get(reverse('cone-search'), {'ra': 279.2347})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cone_search_invalid_radius_and_limit(self):
+        for params in [{'limit': 0}, {'limit': -1}, {'radius': 0}, {'radius': -5},
+                       {'radius': 'nan'}, {'radius': 'inf'}]:
+            response = self.client.get(
+                reverse('cone-search'), dict(ra=279.2347, dec=38.7837, **params),
+            )
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_cone_search_coordinates_out_of_range(self):
+        for ra, dec in [(10, 95), (10, -90.5), (400, 10), (-1, 10), ('nan', 10)]:
+            response = self.client.get(reverse('cone-search'), {'ra': ra, 'dec': dec})
+            self.assertEqual(response.status_code, 400, (ra, dec))
+
+
+class SerializerQueries(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(name='Public', is_public=True)
+        self.user = User.objects.create(username='uploader', password=make_password('x'))
+        self.star = Star.objects.create(name='BD+34 1543', project=self.project, ra=10., dec=10.)
+
+    def add_observations(self, n):
+        from observations.models import RawSpecFile
+
+        for i in range(n):
+            spectrum = Spectrum.objects.create(star=self.star, project=self.project, hjd=i)
+            specfile = SpecFile(spectrum=spectrum, project=self.project, hjd=i)
+            specfile._history_user = self.user
+            specfile.save()
+
+            raw = RawSpecFile(project=self.project, hjd=i, filetype='Science')
+            raw._history_user = self.user
+            raw.save()
+            raw.specfile.add(specfile)
+            raw.star.add(self.star)
+
+    def get_list(self, name):
+        return self.client.get(
+            reverse('observations-api:{}-list'.format(name)),
+            {'format': 'datatables', 'length': 1000, 'start': 0, 'draw': 1},
+        )
+
+    def test_constant_number_of_queries(self):
+        #   Count and page, plus the prefetched relations
+        expected = {'spectrum': 3, 'specfile': 2, 'rawspecfile': 4}
+
+        self.add_observations(3)
+        for name, n in expected.items():
+            with self.assertNumQueries(n):
+                self.assertEqual(len(self.get_list(name).json()['data']), 3)
+
+        self.add_observations(6)
+        for name, n in expected.items():
+            with self.assertNumQueries(n):
+                self.assertEqual(len(self.get_list(name).json()['data']), 9)
+
+    def test_sparse_fields(self):
+        self.add_observations(3)
+        url = reverse('observations-api:spectrum-list')
+
+        #   Count and page, the specfiles are not prefetched
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'fields': 'pk,hjd'})
+        results = response.json()['results']
+        self.assertEqual([set(r) for r in results], [{'pk', 'hjd'}] * 3)
+
+        response = self.client.get(url, {'expand': 'star'})
+        result = response.json()['results'][0]
+        self.assertEqual(result['star']['name'], 'BD+34 1543')
+        self.assertNotIn('specfiles', result)
+        self.assertNotIn('observatory', result)
+        self.assertIn('href', result)
+
+        #   DataTables requests compute the fields of their columns
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {
+                'format': 'datatables', 'length': 10, 'start': 0, 'draw': 1,
+                'columns[0][data]': 'hjd', 'columns[1][data]': 'instrument',
+            })
+        self.assertEqual(set(response.json()['data'][0]), {'hjd', 'instrument'})
+
+        raw = self.get_list('rawspecfile').json()['data'][0]
+        self.assertEqual(raw['added_by'], 'uploader')
+        self.assertEqual(list(raw['systems']), ['BD+34 1543'])
+        self.assertTrue(raw['added_on'])
+
+
+class SpectrumData(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.public = Project.objects.create(name='Public', is_public=True)
+        self.private = Project.objects.create(name='Private', is_public=False)
+
+        self.spectrum = Spectrum.objects.create(project=self.public)
+        specfile = SpecFile(spectrum=self.spectrum, project=self.public)
+        specfile.specfile.save('spectrum.txt', ContentFile(''.join(
+            '{:.1f} {:.1f}\n'.format(6550. + i, 1. + i / 10.) for i in range(20)
+        ).encode()))
+        self.url = reverse('observations-api:spectrum_data', args=[self.spectrum.pk])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_npy_window(self):
+        response = self.client.get(self.url, {'wmin': 6555, 'wmax': 6559.5})
+        self.assertEqual(response.status_code, 200)
+
+        data = np.load(BytesIO(response.content), allow_pickle=False)
+        np.testing.assert_allclose(data['wave'], [6555., 6556., 6557., 6558., 6559.])
+        np.testing.assert_allclose(data['flux'], [1.5, 1.6, 1.7, 1.8, 1.9])
+
+        response = self.client.get(self.url, {'rebin': 2, 'wmax': 6553.5})
+        data = np.load(BytesIO(response.content), allow_pickle=False)
+        np.testing.assert_allclose(data['wave'], [6550.5, 6552.5])
+
+    def test_binary_format_and_ranges(self):
+        response = self.client.get(self.url, {'format': 'bin', 'dtype': 'float32'})
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        content = response.content
+
+        length = struct.unpack('<I', content[:4])[0]
+        header = json.loads(content[4:4 + length])
+        self.assertEqual(header['columns'], ['wave', 'flux'])
+        self.assertEqual(header['length'], 20)
+
+        #   The flux column only
+        start = 4 + length + 20 * 4
+        response = self.client.get(
+            self.url, {'format': 'bin', 'dtype': 'float32'},
+            HTTP_RANGE='bytes={}-'.format(start),
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes {}-{}/{}'.format(
+            start, len(content) - 1, len(content)))
+        np.testing.assert_allclose(
+            np.frombuffer(response.content, dtype='<f4'), 1. + np.arange(20) / 10., rtol=1e-6,
+        )
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100000-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_permissions_and_options(self):
+        self.spectrum.project = self.private
+        self.spectrum.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        #   API view: Basic auth and GET only
+        user = User.objects.create_user(username='reader', password='secret')
+        self.private.readonly_users.add(user)
+        credentials = 'Basic ' + base64.b64encode(b'reader:secret').decode()
+        response = self.client.get(self.url, {'format': 'bin'}, HTTP_AUTHORIZATION=credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post(self.url, HTTP_AUTHORIZATION=credentials).status_code, 405)
+
+        self.spectrum.project = self.public
+        self.spectrum.save()
+        self.assertEqual(self.client.get(self.url, {'format': 'fits'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'wmin': 'halpha'}).status_code, 400)
+
+
+class BulkDownload(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.project = Project.objects.create(name='TestCase')
+        User.objects.create(username='downloader', api_key='public',
+                            api_secret=make_password('secret'))
+        star = Star.objects.create(name='BD+34 1543', project=self.project, ra=10., dec=10.)
+
+        self.contents = []
+        for i in range(2):
+            spectrum = Spectrum.objects.create(star=star, project=self.project)
+            specfile = SpecFile(spectrum=spectrum, project=self.project)
+            self.contents.append(os.urandom(5000))
+            specfile.specfile.save('spectrum.fits', ContentFile(self.contents[-1]))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_streamed_zip(self):
+        response = self.client.get(
+            reverse('observations-api:api-spec-download'),
+            HTTP_PUBLICAPIKEY='public',
+            HTTP_SECRETAPIKEY='secret',
+            HTTP_PROJECTID=str(self.project.pk),
+            HTTP_STARIDLIST='BD+34 1543',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['spec_BD+34 1543_0.fits', 'spec_BD+34 1543_1.fits'])
+        self.assertEqual([archive.read(n) for n in archive.namelist()], self.contents)
+        self.assertIsNone(archive.testzip())
@@ -1,9 +1,9 @@
 from astropy.coordinates import Angle
-from astroquery.simbad import Simbad
-from django.db.models import Count
 from django_filters import rest_framework as filters
 
+from AOTS import sky_index
 from AOTS.custom_permissions import get_allowed_objects_to_view_for_user
+from stars.identifiers import resolve_name
 from stars.models import Star, Tag
 
 
@@ -11,6 +11,14 @@ from stars.models import Star, Tag
 # STARS
 # ===============================================================
 
+#   Columns of the system table that are sorted on a different field
+ORDER_FIELDS = {
+    'nphot': 'n_photometry',
+    'nspec': 'n_spectra',
+    'nlc': 'n_lightcurves',
+}
+
+
 class StarFilter(filters.FilterSet):
     """
     Filter definitions for table with stars
@@ -74,36 +82,31 @@ class StarFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(queryset=Tag.objects.all())
 
     #   Filter for # of photometry measurements, spectra, light curves
+    #   on the counters of the stars (see stars.counters)
     nphot_min = filters.NumberFilter(
-        field_name="photometry",
-        method='filter_obs_gt',
+        field_name="n_photometry",
         lookup_expr='gte',
     )
     nphot_max = filters.NumberFilter(
-        field_name="photometry",
-        method='filter_obs_lt',
+        field_name="n_photometry",
         lookup_expr='lte',
     )
 
     nspec_min = filters.NumberFilter(
-        field_name="spectrum",
-        method='filter_obs_gt',
+        field_name="n_spectra",
         lookup_expr='gte',
     )
     nspec_max = filters.NumberFilter(
-        field_name="spectrum",
-        method='filter_obs_lt',
+        field_name="n_spectra",
         lookup_expr='lte',
     )
 
     nlc_min = filters.NumberFilter(
-        field_name="lightcurve",
-        method='filter_obs_gt',
+        field_name="n_lightcurves",
         lookup_expr='gte',
     )
     nlc_max = filters.NumberFilter(
-        field_name="lightcurve",
-        method='filter_obs_lt',
+        field_name="n_lightcurves",
         lookup_expr='lte',
     )
 
@@ -121,14 +124,7 @@ class StarFilter(filters.FilterSet):
 
     #   Method definitions for the filter definitions above
     def filter_name(self, queryset, name, value):
-        try:
-            data = Simbad.query_object(value)
-            ra = Angle(data['RA'][0], unit='hour').degree
-            dec = Angle(data['DEC'][0], unit='degree').degree
-            return queryset.filter(ra__range=[ra - 15. / 3600., ra + 15. / 3600.]). \
-                filter(dec__range=[dec - 5. / 3600., dec + 5. / 3600.])
-        except Exception:
-            return queryset.filter(name__icontains=value)
+        return resolve_name(queryset, value)
 
     def filter_coordinates(self, queryset, name, value):
         ra, dec = value.split('--')
@@ -140,8 +136,8 @@ class StarFilter(filters.FilterSet):
 
         dec = Angle(dec, unit='degree').degree
 
-        return queryset.filter(ra__range=[ra - 15. / 3600., ra + 15. / 3600.]).filter(
-            dec__range=[dec - 5. / 3600., dec + 5. / 3600.])
+        #   Stars within 15 arcsec
+        return sky_index.cone_search(queryset, ra, dec, 15. / 3600.)
 
     def filter_ra(self, queryset, name, value):
         ra_min, ra_max = value.split('--')
@@ -197,17 +193,6 @@ class StarFilter(filters.FilterSet):
     # def filter_identifier(self, queryset, name, value):
     # return queryset.filter(identifier__name__icontains=value)
 
-    #   General method for the observations filter
-    #   - distinct=True is required to allow filter chains,
-    #     false results will be returned otherwise
-    def filter_obs_gt(self, queryset, name, value):
-        return queryset.annotate(num_obs=Count(name, distinct=True)). \
-            filter(num_obs__gte=value)
-
-    def filter_obs_lt(self, queryset, name, value):
-        return queryset.annotate(num_obs=Count(name, distinct=True)). \
-            filter(num_obs__lte=value)
-
     class Meta:
         model = Star
         fields = ['project']
@@ -223,6 +208,7 @@ class StarFilter(filters.FilterSet):
         if not getter('order[0][column]') is None:
             order_column = int(getter('order[0][column]'))
             order_name = getter('columns[%i][data]' % order_column)
+            order_name = ORDER_FIELDS.get(order_name, order_name)
             if getter('order[0][dir]') == 'desc': order_name = '-' + order_name
 
             return parent.order_by(order_name)
@@ -1,7 +1,10 @@
 import numpy as np
+from django.db.models import OuterRef, Prefetch, Subquery
 from django.urls import reverse
 from rest_framework.serializers import ModelSerializer, SerializerMethodField, PrimaryKeyRelatedField
 
+from AOTS.sparse_fields import SparseFieldsMixin, wanted
+
 from stars.models import Project, Star, Tag, Identifier
 
 
@@ -9,7 +12,7 @@ from stars.models import Project, Star, Tag, Identifier
 # PROJECTS
 # ===============================================================
 
-class ProjectListSerializer(ModelSerializer):
+class ProjectListSerializer(SparseFieldsMixin, ModelSerializer):
     class Meta:
         model = Project
         fields = [
@@ -21,7 +24,7 @@ class ProjectListSerializer(ModelSerializer):
         read_only_fields = ('pk',)
 
 
-class ProjectSerializer(ModelSerializer):
+class ProjectSerializer(SparseFieldsMixin, ModelSerializer):
     class Meta:
         model = Project
         fields = [
@@ -52,7 +55,7 @@ class TagListSerializer(ModelSerializer):
         read_only_fields = ('pk',)
 
 
-class TagSerializer(ModelSerializer):
+class TagSerializer(SparseFieldsMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = [
@@ -79,7 +82,7 @@ class SimpleTagSerializer(ModelSerializer):
 # STARS
 # ===============================================================
 
-class StarListSerializer(ModelSerializer):
+class StarListSerializer(SparseFieldsMixin, ModelSerializer):
     tags = SerializerMethodField()
     datasets = SerializerMethodField()
     vmag = SerializerMethodField()
@@ -124,36 +127,65 @@ class StarListSerializer(ModelSerializer):
         read_only_fields = ('pk',)
 
         datatables_always_serialize = ('href', 'pk')
+        expandable_fields = ('tags', 'datasets')
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        """
+            Load everything the serializer needs for the (requested) fields
+            with the stars, so that a page of stars takes a fixed number of
+            queries
+        """
+        #   Imported here, the analysis and observations models import the
+        #   star models
+        from analysis.models import DataSet
+        from observations.models import Photometry
+
+        if wanted(fields, 'href'):
+            queryset = queryset.select_related('project')
+        if wanted(fields, 'tags', 'tag_ids'):
+            queryset = queryset.prefetch_related('tags')
+        if wanted(fields, 'datasets'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'dataset_set',
+                queryset=DataSet.objects.select_related('method', 'project'),
+            ))
+        if wanted(fields, 'vmag'):
+            gmag = Photometry.objects.filter(
+                star=OuterRef('pk'),
+                band__icontains='GAIA2.G',
+            ).values('measurement')[:1]
+            queryset = queryset.annotate(gaia_gmag=Subquery(gmag))
+        return queryset
 
     def get_tags(self, obj):
-        tags = TagSerializer(obj.tags, many=True).data
+        tags = TagSerializer(obj.tags.all(), many=True).data
         return tags
 
     def get_datasets(self, obj):
-        try:
-            datasets = obj.dataset_set.all()
-            return [{'name': d.name, 'color': d.method.color,
-                     'href': reverse('analysis:dataset_detail', kwargs={'project': d.project.slug, 'dataset_id': d.pk})}
-                    for d in datasets]
-        except Exception as e:
-            print(e)
-            return []
+        return [{'name': d.name, 'color': d.method.color if d.method else '',
+                 'href': reverse('analysis:dataset_detail', kwargs={'project': d.project.slug, 'dataset_id': d.pk})}
+                for d in obj.dataset_set.all()]
 
     def get_vmag(self, obj):
-        mag = obj.photometry_set.filter(band__icontains='GAIA2.G')
-        return 0 if len(mag) == 0 else np.round(mag[0].measurement, 2)
+        if hasattr(obj, 'gaia_gmag'):
+            mag = obj.gaia_gmag
+        else:
+            mag = obj.photometry_set.filter(band__icontains='GAIA2.G') \
+                .values_list('measurement', flat=True).first()
+        return 0 if mag is None else np.round(mag, 2)
 
     def get_href(self, obj):
         return reverse('systems:star_detail', kwargs={'project': obj.project.slug, 'star_id': obj.pk})
 
     def get_nphot(self, obj):
-        return len(obj.photometry_set.all())
+        return obj.n_photometry
 
     def get_nspec(self, obj):
-        return len(obj.spectrum_set.all())
+        return obj.n_spectra
 
     def get_nlc(self, obj):
-        return len(obj.lightcurve_set.all())
+        return obj.n_lightcurves
 
     def get_classification_type_display(self, obj):
         return obj.get_classification_type_display()
@@ -162,7 +194,7 @@ class StarListSerializer(ModelSerializer):
         return obj.get_observing_status_display()
 
 
-class StarSerializer(ModelSerializer):
+class StarSerializer(SparseFieldsMixin, ModelSerializer):
     tags = SerializerMethodField()
     tag_ids = PrimaryKeyRelatedField(
         many=True,
@@ -198,6 +230,7 @@ class StarSerializer(ModelSerializer):
         ]
         read_only_fields = ('pk', 'tags', 'vmag',
                             'classification_type_display', 'observing_status_display')
+        expandable_fields = ('tags',)
 
     def get_tags(self, obj):
         # this has to be used instead of a through field, as otherwise
@@ -246,7 +279,7 @@ class SimpleStarSerializer(ModelSerializer):
 # IDENTIFIERS
 # ===============================================================
 
-class IdentifierListSerializer(ModelSerializer):
+class IdentifierListSerializer(SparseFieldsMixin, ModelSerializer):
     class Meta:
         model = Identifier
         fields = [
@@ -6,6 +6,8 @@ from .views import (
     TagViewSet,
     IdentifierViewSet,
     getStarSpecfiles,
+    crossmatchStars,
+    searchIndex,
 )
 
 ###from django.urls import include, re_path
@@ -42,4 +44,6 @@ urlpatterns = [
         getStarSpecfiles,
         name='stars_specfiles',
     ),
+    path('crossmatch/', crossmatchStars, name='crossmatch'),
+    path('search/', searchIndex, name='search'),
 ]
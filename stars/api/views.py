@@ -1,9 +1,14 @@
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
+from AOTS import search_index
 from AOTS.custom_permissions import get_allowed_objects_to_view_for_user
+from AOTS.sparse_fields import EagerLoadingMixin
+from AOTS.versions import ConditionalGetMixin
+from stars import crossmatch
 from stars.models import Project, Star, Identifier, Tag
 from .filter import (
     StarFilter,
@@ -23,7 +28,7 @@ from .serializers import (
 # PROJECTS
 # ===============================================================
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     list:
     Returns a list of all projects in the database
@@ -31,9 +36,18 @@ class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
 
+    version_models = ('stars.project',)
+
+    def get_version_projects(self, request):
+        #   All projects are listed
+        return list(Project.objects.values_list('pk', flat=True))
+
     def list(self, request):
+        return self.conditional_response(self.list_projects, request)
+
+    def list_projects(self, request):
         queryset = Project.objects.all()
-        serializer = ProjectListSerializer(queryset, many=True)
+        serializer = ProjectListSerializer(queryset, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
 
@@ -41,7 +55,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
 # STARS
 # ===============================================================
 
-class StarViewSet(viewsets.ModelViewSet):
+class StarViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     list:
     Returns a list of all stars/objects in the database
@@ -53,6 +67,13 @@ class StarViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = StarFilter
 
+    #   Only the star details, the list changes too often
+    conditional_actions = ('retrieve',)
+    version_models = ('stars.star', 'stars.tag', 'observations.photometry')
+
+    def get_version_projects(self, request):
+        return list(Star.objects.filter(pk=self.kwargs.get('pk')).values_list('project_id', flat=True))
+
     def get_serializer_class(self):
         if self.action == 'list':
             return StarListSerializer
@@ -89,14 +110,58 @@ def getStarSpecfiles(request, star_pk):
     return Response(return_dict)
 
 
+@api_view(['POST'])
+def crossmatchStars(request):
+    """
+        Match an uploaded CSV or VOTable (`file`) with id, ra and dec columns
+        against the stars of `project` (slug). Returns a CSV with the best
+        match, its separation (arcsec) and the number of stars within
+        `radius` (arcsec, default 2) for every row. Requires login.
+    """
+    try:
+        project = Project.objects.get(slug__exact=request.data['project'])
+    except (KeyError, Project.DoesNotExist):
+        return Response(
+            status=status.HTTP_400_BAD_REQUEST,
+            data="A valid project is required",
+        )
+
+    if not request.user.can_read(project):
+        return Response(status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        upload = request.FILES['file']
+        radius = float(request.data.get('radius', crossmatch.DEFAULT_RADIUS))
+        ids, ra, dec = crossmatch.read_coordinate_table(
+            upload.read(),
+            filename=upload.name,
+        )
+    except KeyError:
+        return Response(
+            status=status.HTTP_400_BAD_REQUEST,
+            data="A file with id, ra and dec columns is required",
+        )
+    except Exception as e:
+        return Response(status=status.HTTP_400_BAD_REQUEST, data=str(e))
+
+    response = StreamingHttpResponse(
+        crossmatch.crossmatch_csv(project, ids, ra, dec, radius=radius),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = 'attachment; filename="crossmatch.csv"'
+    return response
+
+
 # ===============================================================
 # TAGS
 # ===============================================================
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
+    version_models = ('stars.tag',)
+
     filter_backends = (DjangoFilterBackend,)
     filterset_class = TagFilter
 
@@ -118,9 +183,56 @@ class IdentifierViewSet(viewsets.ModelViewSet):
         star = request.query_params.get('star', None)
         if not star is None:
             queryset = queryset.filter(star=star)
-        serializer = IdentifierListSerializer(queryset, many=True)
+        serializer = IdentifierListSerializer(queryset, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
     def get_queryset(self):
         qs = Identifier.objects.all()
         return get_allowed_objects_to_view_for_user(qs, self.request.user)
+
+
+@api_view(['GET'])
+def searchIndex(request):
+    """
+        Search stars, identifiers, tags and spectra for `q`. The results are
+        ranked by exact, prefix and substring matches of the name. Optionally
+        restricted to the `kind`s of documents, a `project` (slug), and a
+        number of results (`limit`, default 50).
+    """
+    q = request.query_params.get('q', '').strip()
+    if not q:
+        return Response([])
+
+    project = None
+    if 'project' in request.query_params:
+        project = Project.objects.filter(
+            slug__exact=request.query_params['project']
+        ).first()
+        if project is None:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data="Unknown project",
+            )
+
+    try:
+        limit = min(int(request.query_params.get('limit', 50)), 500)
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST, data="Invalid limit")
+
+    documents = search_index.search(
+        q,
+        user=request.user,
+        kinds=request.query_params.getlist('kind') or None,
+        project=project,
+        limit=limit,
+    )
+    return Response([
+        {
+            'kind': document.kind,
+            'id': document.object_id,
+            'title': document.title,
+            'star': document.star_id,
+            'project': document.project.slug,
+        }
+        for document in documents
+    ])
@@ -0,0 +1,212 @@
+"""
+In-process index of the star positions of a project, used to associate
+uploaded spectra, raw files, light curves and analysis files with the
+closest star without a database query per file.
+"""
+
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from AOTS import sky_index
+from .models import Star
+
+
+def get_match_radius():
+    """
+        Default radius (degree) within which a file is associated with a star
+    """
+    return getattr(settings, 'STAR_MATCH_RADIUS', 0.1)
+
+
+class ProjectStars:
+    """
+        Star positions of one project: a spherical KD-tree built on load,
+        plus the stars added, moved or removed afterwards. The tree is
+        rebuilt once the number of changes exceeds `rebuild_threshold`.
+    """
+
+    def __init__(self, stars, rebuild_threshold):
+        self.rebuild_threshold = rebuild_threshold
+        self.created = time.monotonic()
+        self.build(stars)
+
+    def build(self, stars):
+        self.stars = stars
+        self.pks = np.array([s[0] for s in stars], dtype=int)
+        self.tree = sky_index.SphericalTree(
+            [s[1] for s in stars],
+            [s[2] for s in stars],
+        )
+        self.in_tree = set(self.pks.tolist())
+        self.removed = set()
+        self.changed = {}
+
+    def contains(self, pk):
+        return pk in self.changed or (pk in self.in_tree and pk not in self.removed)
+
+    def update(self, pk, ra, dec):
+        if pk in self.in_tree:
+            self.removed.add(pk)
+        self.changed[pk] = (ra, dec)
+        self.maybe_rebuild()
+
+    def remove(self, pk):
+        if pk in self.in_tree:
+            self.removed.add(pk)
+        self.changed.pop(pk, None)
+        self.maybe_rebuild()
+
+    def maybe_rebuild(self):
+        if len(self.removed) + len(self.changed) <= self.rebuild_threshold:
+            return
+
+        stars = [s for s in self.stars if s[0] not in self.removed]
+        stars += [(pk, ra, dec) for pk, (ra, dec) in self.changed.items()]
+        self.build(stars)
+
+    def candidates(self, ra, dec, radius):
+        """
+            (separation, pk) of all stars within radius (degree), closest first
+        """
+        index, separation = self.tree.within(ra, dec, radius)
+        result = [
+            (float(sep), int(pk))
+            for pk, sep in zip(self.pks[index], separation)
+            if int(pk) not in self.removed
+        ]
+
+        if self.changed:
+            pks = list(self.changed.keys())
+            changed = sky_index.SphericalTree(
+                [self.changed[pk][0] for pk in pks],
+                [self.changed[pk][1] for pk in pks],
+            )
+            index, separation = changed.within(ra, dec, radius)
+            result += [(float(sep), pks[i]) for i, sep in zip(index, separation)]
+
+        return sorted(result)
+
+
+class StarAssociation:
+    """
+        Keeps the star positions of every project in memory and returns the
+        closest star to a position with its true (great-circle) separation.
+
+        The index of a project is updated when one of its stars is saved or
+        deleted (see the signal handlers below). Since other processes do not
+        receive these signals, an index is in addition rebuilt after
+        `max_age` seconds, and positions without a star in the index are
+        checked in the database (stars added by other processes).
+    """
+
+    def __init__(self, max_age=300, rebuild_threshold=100):
+        self.max_age = max_age
+        self.rebuild_threshold = rebuild_threshold
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, project_pk=None):
+        """
+            Drop the index of one project or, if no project is given, of all
+            projects
+        """
+        with self._lock:
+            if project_pk is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(project_pk, None)
+
+    def _get_index(self, project_pk):
+        with self._lock:
+            index = self._indices.get(project_pk)
+            if index is not None and time.monotonic() - index.created < self.max_age:
+                return index
+
+        stars = list(
+            Star.objects.filter(project__exact=project_pk)
+            .values_list('pk', 'ra', 'dec')
+        )
+        index = ProjectStars(stars, self.rebuild_threshold)
+
+        with self._lock:
+            self._indices[project_pk] = index
+
+        return index
+
+    def nearest(self, project, ra, dec, radius=None):
+        """
+            Returns the closest star of the project within radius (degree,
+            default STAR_MATCH_RADIUS) of ra, dec (degree), None if there is
+            no such star. The separation (degree) is set as the `distance`
+            attribute of the star.
+        """
+        project_pk = getattr(project, 'pk', project)
+        if radius is None:
+            radius = get_match_radius()
+
+        for attempt in range(2):
+            index = self._get_index(project_pk)
+            with self._lock:
+                candidates = index.candidates(ra, dec, radius)
+            if not candidates:
+                break
+
+            separation, pk = candidates[0]
+            star = Star.objects.filter(pk=pk, project__exact=project_pk).first()
+            if star is not None and \
+                    abs(sky_index.separation(ra, dec, star.ra, star.dec) - separation) < 1e-9:
+                star.distance = separation
+                return star
+
+            #   The star was changed in another process or in a rolled back
+            #   transaction, reload the stars of the project
+            self.invalidate(project_pk)
+
+        #   The star can have been added by another process since the index
+        #   was loaded, which would otherwise be duplicated by the callers
+        star = sky_index.cone_search(
+            Star.objects.filter(project__exact=project_pk), ra, dec, radius,
+        ).order_by('distance').first()
+        if star is not None:
+            self.invalidate(project_pk)
+        return star
+
+    def star_saved(self, star):
+        with self._lock:
+            for project_pk, index in self._indices.items():
+                if project_pk == star.project_id:
+                    index.update(star.pk, star.ra, star.dec)
+                elif index.contains(star.pk):
+                    #   The star was moved to another project
+                    index.remove(star.pk)
+
+    def star_deleted(self, star):
+        with self._lock:
+            index = self._indices.get(star.project_id)
+            if index is not None:
+                index.remove(star.pk)
+
+
+#   Association service shared by all ingest paths of this process
+star_association = StarAssociation()
+
+
+@receiver(post_save, sender=Star)
+def update_star_association(sender, **kwargs):
+    """
+        Add or move the star in the cached index of its project
+    """
+    star_association.star_saved(kwargs['instance'])
+
+
+@receiver(post_delete, sender=Star)
+def remove_from_star_association(sender, **kwargs):
+    """
+        Remove the star from the cached index of its project
+    """
+    star_association.star_deleted(kwargs['instance'])
@@ -1,17 +1,35 @@
-import astropy.units as u
+import functools
+import logging
+import operator
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import numpy as np
-from astropy.coordinates import SkyCoord
 from astropy.coordinates.angles import Angle
-from astroquery.simbad import Simbad
-from astroquery.vizier import Vizier
+from django.conf import settings
 from django.contrib import messages
+from django.db import close_old_connections, transaction
+from django.db.models import Q
 from django.http import HttpResponseRedirect
 from django.shortcuts import reverse, get_object_or_404
+from simple_history.utils import bulk_create_with_history
 
 from analysis import models as analModels
-from analysis.models import DataSource
+from analysis.models import (
+    AverageDataSource,
+    DataSource,
+    Parameter,
+    combine_parameter_name,
+)
+from analysis.models.parameters import average_parameter_bookkeeping
+from AOTS import sky_index, versions
+from observations.models import Photometry
+from observations.models.photometry import band_wavelengths
+from . import catalog_providers, counters
 from .models import Star
 
+logger = logging.getLogger(__name__)
+
 #   'simbad_id':    ID of the catalog
 #   'columns':      filter definition used by the catalog
 #   'err_columns':  filter errors used by the catalog
@@ -253,17 +271,426 @@ def invalid_form(request, redirect, project_slug, star_id=None):
         )
 
 
-def populate_system(star, star_pk):
+#   Gaia DR3 columns with the parallax and proper motions, and the name, unit
+#   and error column of the corresponding parameter
+gaia_parameters = [
+    ('Plx', 'e_Plx', 'parallax', ''),
+    ('pmRA', 'e_pmRA', 'pmra', 'mas'),
+    ('pmDE', 'e_pmDE', 'pmdec', 'mas'),
+]
+
+
+def catalog_value(table, column):
     """
-        Analyse provided 'star' dictionary and create a Star object
+        Value of the column in the first row of a catalog table, None if it
+        is missing, masked or not a number
+    """
+    if len(table) == 0 or column not in table.colnames:
+        return None
+    value = table[column][0]
+    if np.ma.is_masked(value):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(value) else value
+
+
+def catalog_columns(name):
+    """
+        Columns queried from a catalog. The Gaia DR3 astrometry is queried
+        together with the GAIA3 photometry.
+    """
+    content = catalogs[name]
+    columns = content['columns'] + content['err_columns']
+    if name == 'GAIA3':
+        columns += [column for p in gaia_parameters for column in p[:2]]
+    return columns
+
+
+def query_catalogs(ra, dec, names=None, provider=None, timeout=None):
+    """
+        Query the catalogs concurrently for the object at ra, dec (degree)
+
+        Parameters
+        ----------
+        names               : `list` of `string`, optional
+            Catalogs to query, default all
+
+        timeout             : `float`, optional
+            Time (s) after which catalogs that did not answer are given up,
+            default CATALOG_QUERY_TIMEOUT. None waits for all catalogs.
+
+        Returns
+        -------
+        tables              : `dict`
+            Table of every catalog that answered within the timeout
+
+        missing             : `list` of `string`
+            Catalogs that failed or did not answer in time
     """
-    if 'get_simbad' in star:
-        if star['get_simbad']:
-            check_vizier = True
+    if provider is None:
+        provider = catalog_providers.get_provider()
+    if names is None:
+        names = list(catalogs.keys())
+
+    executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, 'CATALOG_QUERY_WORKERS', 8),
+    )
+    futures = {
+        executor.submit(
+            provider.query_region,
+            catalogs[name]['simbad_id'],
+            ra,
+            dec,
+            1.,
+            catalog_columns(name),
+        ): name
+        for name in names
+    }
+    done, _ = wait(futures.keys(), timeout=timeout)
+    #   Do not wait for the catalogs that are too slow
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    tables, missing = {}, []
+    for future, name in futures.items():
+        if future in done and future.exception() is None:
+            tables[name] = future.result()
         else:
-            check_vizier = False
-    else:
-        check_vizier = False
+            missing.append(name)
+    return tables, missing
+
+
+def photometry_from_table(name, table):
+    """
+        Photometry of a catalog table, as returned by `query_catalogs`
+
+        Returns
+        -------
+        photometry          : `list` of `dict`
+            band, measurement and error (0 if unknown) of every valid magnitude
+    """
+    content = catalogs[name]
+    photometry = []
+    for i, band in enumerate(content['columns']):
+        mag = catalog_value(table, catalog_providers.sanitize_column(band))
+        if mag is None:
+            continue
+        err = catalog_value(
+            table,
+            catalog_providers.sanitize_column(content['err_columns'][i]),
+        )
+        photometry.append({
+            'band': content['passbands'][i],
+            'measurement': mag,
+            'error': 0. if err is None else err,
+        })
+    return photometry
+
+
+def gaia_parameters_from_table(table):
+    """
+        Gaia DR3 parallax and proper motions of the GAIA3 catalog table
+
+        Returns
+        -------
+        parameters          : `list` of `dict`
+            name, value, error and unit of every parameter with a value and
+            an error
+    """
+    parameters = []
+    for column, err_column, name, unit in gaia_parameters:
+        value = catalog_value(table, column)
+        error = catalog_value(table, err_column)
+        if value is not None and error is not None:
+            parameters.append(
+                {'name': name, 'value': value, 'error': error, 'unit': unit}
+            )
+    return parameters
+
+
+def add_catalog_data(sobj, tables, replace=False):
+    """
+        Add the photometry and Gaia DR3 parameters of the catalog tables to
+        the star. Existing photometry of a band is only replaced if `replace`
+        is set.
+    """
+    for name, table in tables.items():
+        for photometry in photometry_from_table(name, table):
+            existing = sobj.photometry_set.filter(band=photometry['band'])
+            if existing.exists():
+                if not replace:
+                    continue
+                existing.delete()
+            sobj.photometry_set.create(unit='mag', **photometry)
+
+    if 'GAIA3' in tables:
+        parameters = gaia_parameters_from_table(tables['GAIA3'])
+        if parameters:
+            dsgaia = get_gaia_source(sobj.project)
+            for parameter in parameters:
+                sobj.parameter_set.update_or_create(
+                    data_source=dsgaia,
+                    name=parameter['name'],
+                    component=0,
+                    defaults={
+                        'value': parameter['value'],
+                        'error': parameter['error'],
+                        'unit': parameter['unit'],
+                    },
+                )
+
+
+def add_catalog_data_batch(star_pks, provider=None):
+    """
+        Add the photometry and Gaia DR3 data of many new systems at once:
+        every catalog is cross-matched with all positions in one request,
+        and the results are written with bulk inserts.
+
+        Returns
+        -------
+        n_photometry, n_parameters : `int`
+            Number of added photometry points and parameters
+    """
+    stars = list(
+        Star.objects.filter(pk__in=star_pks)
+        .select_related('project')
+        .order_by('pk')
+    )
+    if not stars:
+        return 0, 0
+
+    tables = crossmatch_catalogs(
+        [s.ra for s in stars],
+        [s.dec for s in stars],
+        provider=provider,
+    )
+    return write_catalog_data(stars, tables)
+
+
+def crossmatch_catalogs(ra, dec, names=None, provider=None):
+    """
+        Cross-match the positions (degree) with the catalogs, one request
+        per catalog
+
+        Returns
+        -------
+        tables              : `dict`
+            Table of every catalog, see `CatalogProvider.crossmatch`
+    """
+    if provider is None:
+        provider = catalog_providers.get_provider()
+    if names is None:
+        names = list(catalogs.keys())
+
+    return {
+        name: provider.crossmatch(
+            catalogs[name]['simbad_id'],
+            ra,
+            dec,
+            1.,
+            catalog_columns(name),
+        )
+        for name in names
+    }
+
+
+def write_catalog_data(stars, tables, replace=False):
+    """
+        Write the photometry and Gaia DR3 parameters of cross-matched catalog
+        tables with bulk inserts. stars are the Star objects (or None) in the
+        order of the cross-matched positions. If `replace` is set, the existing
+        photometry in the written bands and the existing Gaia DR3 parameters
+        with the written names are replaced, per star.
+
+        Returns
+        -------
+        n_photometry, n_parameters : `int`
+            Number of written photometry points and parameters
+    """
+    photometry, parameters = [], []
+    for name, table in tables.items():
+        for i, index in enumerate(table['_input']):
+            sobj = stars[int(index)]
+            if sobj is None:
+                #   Removed in the meantime
+                continue
+            row = table[i:i + 1]
+            for phot in photometry_from_table(name, row):
+                photometry.append(Photometry(
+                    star=sobj,
+                    unit='mag',
+                    wavelength=band_wavelengths.get(phot['band'], 0),
+                    **phot,
+                ))
+            if name == 'GAIA3':
+                for parameter in gaia_parameters_from_table(row):
+                    parameters.append((sobj, parameter))
+
+    if replace:
+        #   Only the values that are written again are replaced, stars
+        #   without a match keep their photometry and parameters
+        replaced_bands, replaced_names = {}, {}
+        for phot in photometry:
+            replaced_bands.setdefault(phot.star_id, set()).add(phot.band)
+        for sobj, parameter in parameters:
+            replaced_names.setdefault(sobj.pk, set()).add(parameter['name'])
+
+        star_ids = list(replaced_bands)
+        for i in range(0, len(star_ids), 500):
+            Photometry.objects.filter(functools.reduce(operator.or_, [
+                Q(star_id=star_id, band__in=replaced_bands[star_id])
+                for star_id in star_ids[i:i + 500]
+            ])).delete()
+        star_ids = list(replaced_names)
+        for i in range(0, len(star_ids), 500):
+            Parameter.objects.filter(
+                functools.reduce(operator.or_, [
+                    Q(star_id=star_id, name__in=replaced_names[star_id])
+                    for star_id in star_ids[i:i + 500]
+                ]),
+                data_source__name__exact='Gaia DR3',
+            ).delete()
+
+    bulk_create_with_history(photometry, Photometry, batch_size=1000)
+    #   The bulk insert bypasses the save signals of the counters
+    counters.recount({p.star_id for p in photometry}, ['n_photometry'])
+    versions.bump_on_commit('observations.photometry', {s.project_id for s in stars if s is not None})
+
+    #   Parameters, bypassing the save signals: the cname and the average
+    #   parameters are set here
+    sources = {}
+    new_parameters = []
+    for sobj, parameter in parameters:
+        if sobj.project_id not in sources:
+            sources[sobj.project_id] = get_gaia_source(sobj.project)
+        new_parameters.append(Parameter(
+            star=sobj,
+            data_source=sources[sobj.project_id],
+            component=0,
+            cname=combine_parameter_name(parameter['name'], 0),
+            name=parameter['name'],
+            value=parameter['value'],
+            error_l=parameter['error'],
+            error_u=parameter['error'],
+            unit=parameter['unit'],
+        ))
+
+    existing = set(
+        Parameter.objects.filter(
+            star__in=[p.star for p in new_parameters],
+            average__exact=False,
+        ).values_list('star_id', 'name', 'component')
+    )
+    Parameter.objects.bulk_create(new_parameters, batch_size=1000)
+
+    averages, average_sources = [], {}
+    for param in new_parameters:
+        if (param.star_id, param.name, param.component) in existing:
+            #   Average over several parameters, rare for new systems
+            average_parameter_bookkeeping(sender=Parameter, instance=param)
+            continue
+        if param.star.project_id not in average_sources:
+            average_sources[param.star.project_id] = get_average_source(param.star.project)
+        value, error = param.value, param.error
+        if error == 0:
+            error = value / 10. if value != 0 else 1.
+        averages.append(Parameter(
+            star=param.star,
+            data_source=average_sources[param.star.project_id],
+            component=param.component,
+            cname=param.cname,
+            name=param.name,
+            value=value,
+            error_l=abs(error),
+            error_u=abs(error),
+            unit=param.unit,
+            average=True,
+            valid=True,
+        ))
+    Parameter.objects.bulk_create(averages, batch_size=1000)
+
+    return len(photometry), len(new_parameters)
+
+
+def get_average_source(project):
+    """
+        Data source of the average parameters of the project, created if needed
+    """
+    source, _ = AverageDataSource.objects.get_or_create(
+        project=project,
+        defaults={'name': 'AVG'},
+    )
+    return source
+
+
+def backfill_catalogs(star_pk, names, replace=False):
+    """
+        Add the data of the catalogs that did not answer in time to the star,
+        in a background thread
+    """
+    thread = threading.Thread(
+        target=_backfill_in_thread,
+        args=(star_pk, names, replace),
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _backfill_in_thread(star_pk, names, replace):
+    try:
+        sobj = Star.objects.filter(pk=star_pk).first()
+        if sobj is None:
+            return
+        tables, missing = query_catalogs(sobj.ra, sobj.dec, names=names, timeout=None)
+        add_catalog_data(sobj, tables, replace=replace)
+        if missing:
+            logger.warning(
+                "Catalogs %s could not be queried for system %s",
+                ', '.join(missing),
+                sobj,
+            )
+    except Exception as e:
+        logger.warning("Backfill of system %s failed: %s", star_pk, e)
+    finally:
+        close_old_connections()
+
+
+def get_gaia_source(project):
+    """
+        Gaia DR3 data source of the project, created if needed
+    """
+    dsgaia, _ = DataSource.objects.get_or_create(
+        name='Gaia DR3',
+        project=project,
+        defaults={
+            'note': '3nd Gaia data release',
+            'reference': 'https://doi.org/10.1051/0004-6361/202243940',
+        },
+    )
+    return dsgaia
+
+
+def requests_catalog_data(star):
+    """
+        True if the photometry and Gaia DR3 data of the 'star' dictionary are
+        to be taken from Simbad and Vizier instead of from the dictionary
+    """
+    return bool(star.get('get_simbad'))
+
+
+def populate_system(star, star_pk, catalog_data=True):
+    """
+        Analyse provided 'star' dictionary and create a Star object
+
+        If `catalog_data` is False, the photometry and Gaia DR3 data are not
+        queried, they are then added for many systems at once with
+        `add_catalog_data_batch` (only for the systems for which
+        `requests_catalog_data` is True).
+    """
+    check_vizier = requests_catalog_data(star)
 
     #   Load system/star model
     sobj = Star.objects.get(pk=star_pk)
@@ -272,10 +699,10 @@ def populate_system(star, star_pk):
     project = sobj.project
 
     #   Coordinates
+    provider = catalog_providers.get_provider()
+
     if check_vizier:
-        customSimbad = Simbad()
-        customSimbad.add_votable_fields('sptype')
-        simbad_tbl = customSimbad.query_object(star["main_id"])
+        simbad_tbl = provider.query_object(star["main_id"])
         if simbad_tbl is None:
             return False, "System ({}) not known by Simbad".format(
                 star["main_id"]
@@ -291,9 +718,12 @@ def populate_system(star, star_pk):
     sobj.dec = dec
 
     #   Check for duplicates
-    duplicates = Star.objects.filter(name=star["main_id"]) \
-        .filter(ra__range=[ra - 1 / 3600., ra + 1 / 3600.]) \
-        .filter(dec__range=[dec - 1 / 3600., dec + 1 / 3600.]) \
+    duplicates = sky_index.cone_search(
+        Star.objects.filter(name=star["main_id"]),
+        ra,
+        dec,
+        1 / 3600.,
+    ) \
         .filter(project__exact=project.pk)
 
     if len(duplicates) != 0:
@@ -336,155 +766,66 @@ def populate_system(star, star_pk):
         for tag in star["tags"]:
             sobj.tags.add(tag)
 
-        # -- Add photometry
+    # -- Add photometry
+    #   Photometry from Vizier is added below, together with the Gaia
+    #   DR3 data. Both sources are added whether or not tags are given.
+    if not check_vizier:
         #   Loop over catalogs
         for name, content in catalogs.items():
-            #   Check if photometry shall be loaded from Vizier
-            if check_vizier:
-                #   Define catalog and columns
-                v = Vizier(
-                    catalog=content['simbad_id'],
-                    columns=content['columns'] + content['err_columns'],
-                )
-                #   Get data, assume a radius of 1"
-                photo = v.query_region(
-                    SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg), frame='icrs'),
-                    radius=1 * u.arcsec,
-                )
-                #   Check if catalog contains data for this object
-                if len(photo) != 0:
-                    #   Loop over photometry bands
-                    for i, band in enumerate(content['columns']):
-                        #   Sanitize band/filter names
-                        band = band.replace("'", '_')
-                        #   Get magnitudes
-                        mag = photo[0][band][0]
-                        #      Sanitize error names
-                        err_band = content['err_columns'][i].replace("'", '_')
-                        #   Get errors
-                        err = photo[0][err_band][0]
-                        #   Set error to zero, if it is undefined
-                        if str(err) == '--' or np.isnan(err):
-                            err = 0.
-                        #   Check if magnitude value is valid
-                        if mag != '--' and ~np.isnan(mag):
-                            #   Set magnitude value and error
+            for i, phot in enumerate(content['photnames']):
+                #   Check if photometry was provided
+                if phot in star:
+                    err_name = content['errs'][i]
+                    #   Check if error was provided
+                    if err_name in star:
+                        #   Check if photometry and error is not empty
+                        if (star[phot] is not None and star[phot] != "" and
+                                star[err_name] is not None and star[err_name] != ""):
                             sobj.photometry_set.create(
                                 band=content['passbands'][i],
-                                measurement=mag,
-                                error=err,
+                                measurement=star[phot],
+                                error=star[err_name],
+                                unit='mag',
+                            )
+                        #   If error is empty set it to zero
+                        elif star[phot] != None and star[phot] != "":
+                            sobj.photometry_set.create(
+                                band=content['passbands'][i],
+                                measurement=star[phot],
+                                error=0.,
+                                unit='mag',
+                            )
+                    else:
+                        #   If error is not provided set it to zero
+                        if star[phot] != None and star[phot] != "":
+                            sobj.photometry_set.create(
+                                band=content['passbands'][i],
+                                measurement=star[phot],
+                                error=0.,
                                 unit='mag',
                             )
-
-            else:
-                for i, phot in enumerate(content['photnames']):
-                    #   Check if photometry was provided
-                    if phot in star:
-                        err_name = content['errs'][i]
-                        #   Check if error was provided
-                        if err_name in star:
-                            #   Check if photometry and error is not empty
-                            if (star[phot] is not None and star[phot] != "" and
-                                    star[err_name] is not None and star[err_name] != ""):
-                                sobj.photometry_set.create(
-                                    band=content['passbands'][i],
-                                    measurement=star[phot],
-                                    error=star[err_name],
-                                    unit='mag',
-                                )
-                            #   If error is empty set it to zero
-                            elif star[phot] != None and star[phot] != "":
-                                sobj.photometry_set.create(
-                                    band=content['passbands'][i],
-                                    measurement=star[phot],
-                                    error=0.,
-                                    unit='mag',
-                                )
-                        else:
-                            #   If error is not provided set it to zero
-                            if star[phot] != None and star[phot] != "":
-                                sobj.photometry_set.create(
-                                    band=content['passbands'][i],
-                                    measurement=star[phot],
-                                    error=0.,
-                                    unit='mag',
-                                )
 
     if check_vizier:
-        #   Download GAIA DR3 data
-        gaia_data = Vizier(
-            catalog='I/355/gaiadr3',
-            columns=['Plx', 'e_Plx', 'pmRA', 'e_pmRA', 'pmDE', 'e_pmDE'],
-        ).query_region(star["main_id"], radius=1 * u.arcsec)
-
-        #   Check if GAIA data is available for the source
-        if len(gaia_data) != 0:
-            #   Set data source
-            try:
-                dsgaia = DataSource.objects.get(
-                    name__exact='Gaia DR3',
-                    project=project,
-                )
-            except DataSource.DoesNotExist:
-                dsgaia = DataSource.objects.create(
-                    name='Gaia DR3',
-                    note='3nd Gaia data release',
-                    reference='https://doi.org/10.1051/0004-6361/202243940',
-                    project=project,
-                )
-
-            #   Set parallax
-            if (str(gaia_data[0]['Plx']) != '--' and
-                    str(gaia_data[0]['e_Plx']) != '--'):
-                sobj.parameter_set.create(
-                    data_source=dsgaia,
-                    name='parallax',
-                    component=0,
-                    value=gaia_data[0]['Plx'],
-                    error=gaia_data[0]['e_Plx'],
-                    unit='',
-                )
-
-            #   RA proper motion
-            if (str(gaia_data[0]['pmRA']) != '--' and
-                    str(gaia_data[0]['e_pmRA']) != '--'):
-                sobj.parameter_set.create(
-                    data_source=dsgaia,
-                    name='pmra',
-                    component=0,
-                    value=gaia_data[0]['pmRA'],
-                    error=gaia_data[0]['e_pmRA'],
-                    unit='mas',
-                )
-
-            #   DEC proper motion
-            if (str(gaia_data[0]['pmDE']) != '--' and
-                    str(gaia_data[0]['e_pmDE']) != '--'):
-                sobj.parameter_set.create(
-                    data_source=dsgaia,
-                    name='pmdec',
-                    component=0,
-                    value=gaia_data[0]['pmDE'],
-                    error=gaia_data[0]['e_pmDE'],
-                    unit='mas',
+        #   Download photometry and GAIA DR3 data. Catalogs that do not answer
+        #   in time are added in the background once the star is saved.
+        if catalog_data:
+            tables, missing = query_catalogs(
+                ra,
+                dec,
+                provider=provider,
+                timeout=getattr(settings, 'CATALOG_QUERY_TIMEOUT', 10.),
+            )
+            add_catalog_data(sobj, tables)
+            if missing:
+                transaction.on_commit(
+                    functools.partial(backfill_catalogs, sobj.pk, missing)
                 )
     else:
         if (star['parallax'] != None or
                 star['pmra_x'] != None or
                 star['pmdec_x'] != None):
 
-            try:
-                dsgaia = DataSource.objects.get(
-                    name__exact='Gaia DR3',
-                    project=project,
-                )
-            except DataSource.DoesNotExist:
-                dsgaia = DataSource.objects.create(
-                    name='Gaia DR3',
-                    note='3nd Gaia data release',
-                    reference='https://doi.org/10.1051/0004-6361/202243940',
-                    project=project,
-                )
+            dsgaia = get_gaia_source(project)
 
             #   Set parallax
             if star['parallax'] != None:
@@ -547,45 +888,19 @@ def update_photometry(cleaned_data, project, star_id, from_vizier):
                     unit='mag',
                 )
     else:
-        #   Loop over catalogs
-        for name, content in catalogs.items():
-            #   Define catalog and columns
-            v = Vizier(
-                catalog=content['simbad_id'],
-                columns=content['columns'] + content['err_columns'],
+        tables, missing = query_catalogs(
+            star.ra,
+            star.dec,
+            timeout=getattr(settings, 'CATALOG_QUERY_TIMEOUT', 10.),
+        )
+        add_catalog_data(star, tables, replace=True)
+        if missing:
+            transaction.on_commit(
+                functools.partial(backfill_catalogs, star.pk, missing, replace=True)
             )
-            #   Get data, assume a radius of 1"
-            photo = v.query_region(
-                SkyCoord(ra=star.ra, dec=star.dec, unit=(u.deg, u.deg), frame='icrs'),
-                radius=1 * u.arcsec,
+            return True, "No answer from {}, their photometry is added later".format(
+                ', '.join(missing)
             )
-            #   Check if catalog contains data for this object
-            if len(photo) != 0:
-                #   Loop over photometry bands
-                for i, band in enumerate(content['columns']):
-                    #   Sanitize band/filter names
-                    band = band.replace("'", '_')
-                    phset = star.photometry_set.filter(band=content['passbands'][i])
-                    #   Get magnitudes
-                    mag = photo[0][band][0]
-                    #      Sanitize error names
-                    err_band = content['err_columns'][i].replace("'", '_')
-                    #   Get errors
-                    err = photo[0][err_band][0]
-                    #   Set error to zero, if it is undefined
-                    if str(err) == '--' or np.isnan(err):
-                        err = 0.
-                    #   Check if magnitude value is valid
-                    if mag != '--' and ~np.isnan(mag):
-                        if len(phset) != 0:
-                            phset[0].delete()
-                        #   Set magnitude value and error
-                        star.photometry_set.create(
-                            band=content['passbands'][i],
-                            measurement=mag,
-                            error=err,
-                            unit='mag',
-                        )
     return True, ""
 
 
@@ -0,0 +1,297 @@
+"""
+Providers of catalog data (Vizier photometry, Gaia astrometry and Simbad
+identifications) used to populate systems.
+
+`get_provider` returns the provider configured in the settings:
+
+    - If CATALOG_LOCAL_DIR is set, lookups are answered from local catalog
+      extracts (FITS, Parquet, ...) in that directory, without network
+      access. The file of a catalog is named after its Vizier ID with '/'
+      replaced by '_', fx. 'I_355_gaiadr3.fits'. Simbad identifications
+      are looked up in 'simbad.<ext>' with MAIN_ID, RA, DEC and SP_TYPE
+      columns, and optionally the '|' separated identifiers in IDS.
+    - Otherwise Vizier and Simbad are queried, and the responses are stored
+      in the Django cache for CATALOG_CACHE_TIMEOUT seconds.
+
+All providers return astropy tables with the Vizier column names, in which
+"'" is replaced by '_'. Lists of positions are matched with `crossmatch`, which
+the remote provider sends as one upload to the CDS XMatch service.
+"""
+
+import hashlib
+import os
+import threading
+from abc import ABC, abstractmethod
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import SkyCoord
+from astropy.table import Table, vstack
+from astroquery.simbad import Simbad
+from astroquery.vizier import Vizier
+from django.conf import settings
+from django.core.cache import cache
+
+from AOTS import sky_index
+
+#   Names of the coordinate columns (degree) in local catalog extracts
+RA_COLUMNS = ['RA_ICRS', 'RAJ2000', '_RAJ2000', 'ra', 'RA']
+DEC_COLUMNS = ['DE_ICRS', 'DEJ2000', '_DEJ2000', 'dec', 'DEC']
+
+#   Sentinel for values that are not in the cache
+_MISSING = object()
+
+
+def sanitize_column(column):
+    return column.replace("'", '_')
+
+
+def normalize_name(name):
+    return ' '.join(str(name).split()).lower()
+
+
+class CatalogProvider(ABC):
+    """
+        Interface of the catalog providers. Providers implement
+        `query_region` and `query_object`, `crossmatch` queries the positions
+        one by one unless it is overridden.
+    """
+
+    @abstractmethod
+    def query_region(self, catalog, ra, dec, radius, columns):
+        """
+            Rows of the catalog (Vizier ID) within radius (arcsec) of ra, dec
+            (degree), closest first. Returns an empty table if there are
+            none.
+        """
+
+    @abstractmethod
+    def query_object(self, name):
+        """
+            Simbad identification (MAIN_ID, RA, DEC and SP_TYPE) of the
+            object, None if the object is unknown
+        """
+
+    def crossmatch(self, catalog, ra, dec, radius, columns):
+        """
+            Closest row of the catalog within radius (arcsec) for each of the
+            positions (degree)
+
+            Returns
+            -------
+            table               : `astropy.table.Table`
+                The requested columns and the index of the position in the
+                '_input' column, for the positions with a match
+        """
+        rows = []
+        for i, (r, d) in enumerate(zip(ra, dec)):
+            table = self.query_region(catalog, r, d, radius, columns)
+            if len(table) > 0:
+                table = Table(table[:1], masked=True)
+                table['_input'] = [i]
+                rows.append(table)
+        if not rows:
+            return Table(names=['_input'], dtype=[int])
+        return vstack(rows)
+
+
+class AstroqueryProvider(CatalogProvider):
+    """
+        Queries Vizier and Simbad
+    """
+
+    def query_region(self, catalog, ra, dec, radius, columns):
+        result = Vizier(catalog=catalog, columns=list(columns)).query_region(
+            SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg), frame='icrs'),
+            radius=radius * u.arcsec,
+        )
+        if len(result) == 0:
+            return Table()
+        return result[0]
+
+    def crossmatch(self, catalog, ra, dec, radius, columns):
+        #   Imported here, since astroquery.xmatch warns about the optional
+        #   regions package on import
+        from astroquery.xmatch import XMatch
+
+        #   One upload of all positions to the CDS XMatch service
+        positions = Table({
+            '_input': np.arange(len(ra)),
+            'ra': np.asarray(ra, dtype=float),
+            'dec': np.asarray(dec, dtype=float),
+        })
+        result = XMatch.query(
+            cat1=positions,
+            cat2='vizier:{}'.format(catalog),
+            max_distance=radius * u.arcsec,
+            colRA1='ra',
+            colDec1='dec',
+        )
+        for column in result.colnames:
+            result.rename_column(column, sanitize_column(column))
+
+        #   Keep the closest match of every position
+        result.sort(['_input', 'angDist'])
+        first = np.ones(len(result), dtype=bool)
+        first[1:] = result['_input'][1:] != result['_input'][:-1]
+        columns = [sanitize_column(c) for c in columns]
+        return result[first][['_input'] + [c for c in columns if c in result.colnames]]
+
+    def query_object(self, name):
+        custom_simbad = Simbad()
+        custom_simbad.add_votable_fields('sptype')
+        return custom_simbad.query_object(name)
+
+
+class LocalProvider(CatalogProvider):
+    """
+        Answers lookups from local catalog extracts in `directory`
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._catalogs = {}
+        self._lock = threading.Lock()
+
+    def _find_file(self, name):
+        if not os.path.isdir(self.directory):
+            return None
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.split('.')[0] == name:
+                return os.path.join(self.directory, filename)
+        return None
+
+    def _load(self, name):
+        with self._lock:
+            if name in self._catalogs:
+                return self._catalogs[name]
+
+        path = self._find_file(name)
+        if path is None:
+            entry = None
+        else:
+            table = Table.read(path)
+            table.convert_bytestring_to_unicode()
+            ra = next((c for c in RA_COLUMNS if c in table.colnames), None)
+            dec = next((c for c in DEC_COLUMNS if c in table.colnames), None)
+            tree = None
+            if ra is not None and dec is not None and \
+                    table[ra].dtype.kind in 'fiu' and table[dec].dtype.kind in 'fiu':
+                tree = sky_index.SphericalTree(
+                    np.asarray(table[ra], dtype=float),
+                    np.asarray(table[dec], dtype=float),
+                )
+            entry = (table, tree)
+
+        with self._lock:
+            self._catalogs[name] = entry
+        return entry
+
+    def query_region(self, catalog, ra, dec, radius, columns):
+        entry = self._load(catalog.replace('/', '_'))
+        if entry is None or entry[1] is None:
+            return Table()
+
+        table, tree = entry
+        index, separation = tree.within(ra, dec, radius / 3600.)
+        index = index[np.argsort(separation)]
+
+        columns = [sanitize_column(c) for c in columns]
+        return table[[c for c in columns if c in table.colnames]][index]
+
+    def crossmatch(self, catalog, ra, dec, radius, columns):
+        entry = self._load(catalog.replace('/', '_'))
+        if entry is None or entry[1] is None:
+            return Table(names=['_input'], dtype=[int])
+
+        table, tree = entry
+        index, _ = tree.nearest(ra, dec, radius / 3600.)
+        found = np.flatnonzero(index >= 0)
+
+        columns = [sanitize_column(c) for c in columns]
+        result = table[[c for c in columns if c in table.colnames]][index[found]]
+        result['_input'] = found
+        return result
+
+    def query_object(self, name):
+        entry = self._load('simbad')
+        if entry is None:
+            return None
+
+        table = entry[0]
+        name = normalize_name(name)
+        for i, row in enumerate(table):
+            identifiers = [row['MAIN_ID']]
+            if 'IDS' in table.colnames:
+                identifiers += str(row['IDS']).split('|')
+            if name in [normalize_name(identifier) for identifier in identifiers]:
+                return table[i:i + 1]
+        return None
+
+
+class CachedProvider(CatalogProvider):
+    """
+        Stores the responses of another provider in the Django cache. Entries
+        are evicted after `timeout` seconds.
+    """
+
+    def __init__(self, provider, timeout):
+        self.provider = provider
+        self.timeout = timeout
+
+    @staticmethod
+    def _key(*parts):
+        digest = hashlib.sha256(repr(parts).encode()).hexdigest()
+        return 'catalog:{}'.format(digest)
+
+    def _get(self, key, query):
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = query()
+            cache.set(key, value, timeout=self.timeout)
+        return value
+
+    def query_region(self, catalog, ra, dec, radius, columns):
+        #   Positions are rounded to ~4 mas, so that the same star always
+        #   gives the same key
+        key = self._key(
+            'region',
+            catalog,
+            round(float(ra), 6),
+            round(float(dec), 6),
+            round(float(radius), 3),
+            tuple(columns),
+        )
+        return self._get(
+            key,
+            lambda: self.provider.query_region(catalog, ra, dec, radius, columns),
+        )
+
+    def query_object(self, name):
+        key = self._key('object', normalize_name(name))
+        return self._get(key, lambda: self.provider.query_object(name))
+
+    def crossmatch(self, catalog, ra, dec, radius, columns):
+        #   Cross-matches are not cached, since the position lists hardly
+        #   ever repeat
+        return self.provider.crossmatch(catalog, ra, dec, radius, columns)
+
+
+#   Providers by configuration, so that local extracts are only loaded once
+_providers = {}
+
+
+def get_provider():
+    """
+        Catalog provider configured in the settings
+    """
+    local_dir = getattr(settings, 'CATALOG_LOCAL_DIR', '')
+    timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 30 * 86400)
+
+    key = (local_dir, timeout)
+    if key not in _providers:
+        if local_dir:
+            _providers[key] = LocalProvider(local_dir)
+        else:
+            _providers[key] = CachedProvider(AstroqueryProvider(), timeout)
+    return _providers[key]
@@ -0,0 +1,193 @@
+"""
+Observation counters of the systems.
+
+The numbers of photometry points, spectra, light curves, datasets and raw
+science files of a star are stored on the star itself (n_photometry, ...),
+so that the system table can filter and sort on them without grouped joins.
+
+Models with a foreign key to the star are registered with `register` and
+increment or decrement the counter of their star on save and delete. Raw
+science files are linked through many-to-many relations (directly, and
+through the spectrum files), their counter is recounted when these links
+change. Bulk inserts and updates bypass the signals, after those call
+`recount` for the affected stars, or run the `repair_star_counters` command.
+"""
+
+from django.apps import apps
+from django.db.models import (
+    Count,
+    F,
+    Func,
+    IntegerField,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+)
+
+from .models import Star
+
+#   Counter -> (app label, model name) of the counted objects
+COUNTED_MODELS = {
+    'n_photometry': ('observations', 'Photometry'),
+    'n_spectra': ('observations', 'Spectrum'),
+    'n_lightcurves': ('observations', 'LightCurve'),
+    'n_datasets': ('analysis', 'DataSet'),
+}
+
+COUNTERS = list(COUNTED_MODELS) + ['n_raw_science']
+
+#   File type of the raw science frames
+SCIENCE = 'Science'
+
+
+def increment(star_id, counter, delta):
+    if star_id is None:
+        return
+    Star.objects.filter(pk=star_id).update(**{counter: F(counter) + delta})
+
+
+def register(model, counter, field='star', recount_on_move=()):
+    """
+        Maintain the counter of the star in `field` of the model on save and
+        delete. The counters in `recount_on_move` are recounted for both
+        stars when an object is moved to another star.
+    """
+    attname = model._meta.get_field(field).attname
+
+    def remember_star(sender, instance, **kwargs):
+        #   Taken from __dict__, so that a deferred field is not loaded
+        instance._counted_star_id = instance.__dict__.get(attname)
+
+    def update_on_save(sender, instance, created=False, **kwargs):
+        star_id = getattr(instance, attname)
+        if created:
+            increment(star_id, counter, 1)
+        elif star_id != getattr(instance, '_counted_star_id', star_id):
+            #   Moved to another star
+            increment(instance._counted_star_id, counter, -1)
+            increment(star_id, counter, 1)
+            if recount_on_move:
+                recount([instance._counted_star_id, star_id], recount_on_move)
+        instance._counted_star_id = star_id
+
+    def update_on_delete(sender, instance, **kwargs):
+        increment(getattr(instance, attname), counter, -1)
+
+    uid = 'counter_{}_{}'.format(model._meta.label_lower, counter)
+    post_init.connect(remember_star, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(update_on_save, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(update_on_delete, sender=model, weak=False, dispatch_uid=uid)
+
+
+def count_expression(counter):
+    """
+        Correlated subquery with the actual value of the counter of the star
+    """
+    if counter == 'n_raw_science':
+        RawSpecFile = apps.get_model('observations', 'RawSpecFile')
+        objects = RawSpecFile.objects.filter(filetype__exact=SCIENCE).filter(
+            Q(star=OuterRef('pk')) | Q(specfile__spectrum__star=OuterRef('pk'))
+        )
+        #   Count distinct files, a file can be linked to the star in both
+        #   ways. COUNT as a plain function, so that there is no GROUP BY.
+        counts = objects.order_by().annotate(n=Func(
+            F('pk'),
+            function='COUNT',
+            template='%(function)s(DISTINCT %(expressions)s)',
+        )).values('n')
+    else:
+        model = apps.get_model(*COUNTED_MODELS[counter])
+        counts = model.objects.filter(star=OuterRef('pk')).order_by() \
+            .values('star').annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recount(stars, counters=None):
+    """
+        Recompute counters (default: all) of a queryset or list of stars
+        (objects or pks) in one update. Returns the number of updated stars.
+    """
+    if not isinstance(stars, QuerySet):
+        stars = Star.objects.filter(pk__in=[getattr(s, 'pk', s) for s in stars])
+    return stars.update(**{
+        counter: count_expression(counter) for counter in (counters or COUNTERS)
+    })
+
+
+def raw_file_stars(raw_pks):
+    """
+        Pks of the stars linked to the raw files, directly or through their
+        spectrum files
+    """
+    return set(Star.objects.filter(
+        Q(rawspecfile__pk__in=raw_pks) |
+        Q(spectrum__specfile__rawspecfile__pk__in=raw_pks)
+    ).values_list('pk', flat=True))
+
+
+def raw_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        m2m_changed handler of the star and spectrum file links of the raw
+        files. The stars linked before and after the change are recounted.
+    """
+    if reverse:
+        raw_pks = pk_set if pk_set else \
+            list(instance.rawspecfile_set.values_list('pk', flat=True))
+    else:
+        raw_pks = [instance.pk]
+
+    stars = raw_file_stars(raw_pks)
+    if action.startswith('pre_'):
+        instance._counted_raw_stars = stars
+        return
+    stars |= getattr(instance, '_counted_raw_stars', set())
+    recount(stars, ['n_raw_science'])
+
+
+def raw_file_pre_delete(sender, instance, **kwargs):
+    instance._counted_raw_stars = raw_file_stars([instance.pk])
+
+
+def raw_file_post_delete(sender, instance, **kwargs):
+    recount(getattr(instance, '_counted_raw_stars', set()), ['n_raw_science'])
+
+
+def raw_file_post_save(sender, instance, created=False, **kwargs):
+    #   The file type can change, new files are not linked yet
+    if not created:
+        recount(raw_file_stars([instance.pk]), ['n_raw_science'])
+
+
+def specfile_pre_delete(sender, instance, **kwargs):
+    #   The links of the raw files are removed without m2m signals
+    instance._counted_raw_stars = raw_file_stars(
+        instance.rawspecfile_set.values_list('pk', flat=True)
+    )
+
+
+def register_raw_files(raw_model, specfile_model):
+    """
+        Maintain the raw science counter of the stars on changes of the raw
+        files and their links
+    """
+    for through in [raw_model.star.through, raw_model.specfile.through]:
+        m2m_changed.connect(
+            raw_links_changed,
+            sender=through,
+            dispatch_uid='counter_raw_links_{}'.format(through._meta.label_lower),
+        )
+    pre_delete.connect(raw_file_pre_delete, sender=raw_model, dispatch_uid='counter_raw_pre_delete')
+    post_delete.connect(raw_file_post_delete, sender=raw_model, dispatch_uid='counter_raw_post_delete')
+    post_save.connect(raw_file_post_save, sender=raw_model, dispatch_uid='counter_raw_post_save')
+    pre_delete.connect(specfile_pre_delete, sender=specfile_model, dispatch_uid='counter_specfile_pre_delete')
+    #   The same recount as for deleted raw files
+    post_delete.connect(raw_file_post_delete, sender=specfile_model, dispatch_uid='counter_specfile_post_delete')
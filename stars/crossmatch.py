@@ -0,0 +1,131 @@
+"""
+Bulk positional cross-match of coordinate lists (CSV or VOTable with id, ra
+and dec columns) against the stars of a project.
+"""
+
+import csv
+import io
+
+import numpy as np
+from astropy.coordinates import Angle
+from astropy.table import Table
+
+from AOTS import sky_index
+from AOTS.export import Echo
+from .models import Star
+
+#   Default match radius (arcsec)
+DEFAULT_RADIUS = 2.
+
+CSV_COLUMNS = [
+    'id',
+    'ra',
+    'dec',
+    'star_pk',
+    'star_name',
+    'separation',
+    'multiplicity',
+]
+
+
+def read_coordinate_table(data, filename=''):
+    """
+        Read a CSV or VOTable with id, ra and dec columns (case-insensitive).
+        ra and dec can be given in degree or sexagesimal (ra in hours).
+
+        Parameters
+        ----------
+        data                : `bytes` or `string`
+            Content of the file
+
+        filename            : `string`, optional
+            Name of the file, used to recognize VOTables
+
+        Returns
+        -------
+        ids, ra, dec        : `numpy.ndarray`
+    """
+    if isinstance(data, str):
+        data = data.encode()
+
+    if (filename.lower().endswith(('.xml', '.vot', '.votable')) or
+            data.lstrip().startswith(b'<')):
+        table = Table.read(io.BytesIO(data), format='votable')
+    else:
+        table = Table.read(data.decode(), format='ascii.csv')
+
+    columns = {name.lower(): name for name in table.colnames}
+    for required in ['ra', 'dec']:
+        if required not in columns:
+            raise ValueError("Column '{}' is missing".format(required))
+
+    if 'id' in columns:
+        ids = np.array([str(i) for i in table[columns['id']]])
+    else:
+        ids = np.arange(len(table)).astype(str)
+
+    ra = table[columns['ra']]
+    dec = table[columns['dec']]
+    if ra.dtype.kind in 'US':
+        ra = Angle(
+            [str(r) for r in ra],
+            unit='hour' if any(c in str(ra[0]) for c in ': hms') else 'degree',
+        ).degree
+        dec = Angle([str(d) for d in dec], unit='degree').degree
+
+    return ids, np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+
+
+def crossmatch(project, ra, dec, radius=DEFAULT_RADIUS):
+    """
+        Match positions (degree) against the stars of the project in one pass
+
+        Returns
+        -------
+        matches             : `list` of `tuple`
+            (star pk, star name, separation in arcsec, multiplicity) for every
+            position. pk, name and separation are None if there is no star
+            within radius (arcsec), multiplicity is the number of stars
+            within the radius.
+    """
+    stars = list(
+        Star.objects.filter(project__exact=project)
+        .order_by('pk')
+        .values_list('pk', 'name', 'ra', 'dec')
+    )
+    tree = sky_index.SphericalTree(
+        [s[2] for s in stars],
+        [s[3] for s in stars],
+    )
+
+    index, separation = tree.nearest(ra, dec, radius / 3600.)
+    multiplicity = tree.count(ra, dec, radius / 3600.)
+
+    matches = []
+    for i, sep, n in zip(index, separation, multiplicity):
+        if i < 0:
+            matches.append((None, None, None, int(n)))
+        else:
+            matches.append((stars[i][0], stars[i][1], float(sep) * 3600., int(n)))
+    return matches
+
+
+def crossmatch_csv(project, ids, ra, dec, radius=DEFAULT_RADIUS):
+    """
+        Generator of the CSV lines with the best match, separation (arcsec)
+        and multiplicity per input row
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+
+    matches = crossmatch(project, ra, dec, radius=radius)
+    for i, r, d, (pk, name, separation, multiplicity) in zip(ids, ra, dec, matches):
+        yield writer.writerow([
+            i,
+            r,
+            d,
+            '' if pk is None else pk,
+            '' if name is None else name,
+            '' if separation is None else '{:.4f}'.format(separation),
+            multiplicity,
+        ])
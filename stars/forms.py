@@ -5,6 +5,8 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.db.models import Q
 
+from AOTS import search_index
+
 from .auxil import get_params
 from .models import Star, Tag
 
@@ -191,10 +193,13 @@ class SearchStarForm(forms.Form):
         if val == '':
             return Star.objects.order_by('ra')
 
-        #   Search on name, class and tag name
-        all_stars = Star.objects.filter(Q(name__icontains=val) |
-                                        Q(classification__icontains=val) |
-                                        Q(tag__name__icontains=val))
+        #   Search on name, class, identifiers and tag name in the search
+        #   index (see AOTS.search_index)
+        documents = search_index.matching(val, kinds=['star', 'identifier', 'tag'])
+        all_stars = Star.objects.filter(
+            Q(pk__in=documents.exclude(star=None).values('star')) |
+            Q(tags__in=documents.filter(kind='tag').values('object_id'))
+        )
 
         return all_stars.order_by('ra').distinct()
 
@@ -0,0 +1,94 @@
+"""
+Resolution of object names to systems, used by the name search of the star
+table. Names are first looked up in the identifiers of the systems, and only
+if there is no local match resolved by Simbad (through the cached catalog
+provider). Successful Simbad resolutions are stored as identifiers, so that
+the next search for the same name is answered locally.
+"""
+
+import logging
+
+from django.db.models import Q
+
+from AOTS import sky_index
+from . import catalog_providers
+from .models import Identifier, normalize_identifier
+
+logger = logging.getLogger(__name__)
+
+#   Radius (degree) within which a Simbad position is matched with systems
+SIMBAD_MATCH_RADIUS = 15. / 3600.
+
+
+def local_matches(queryset, value):
+    """
+        Systems of the queryset with an identifier equal to the name, or, if
+        there are none, with an identifier starting with the name or a name
+        containing it
+    """
+    normalized = normalize_identifier(value)
+    if not normalized:
+        return queryset.none()
+
+    exact = queryset.filter(
+        pk__in=Identifier.objects.filter(
+            Q(normalized_name__exact=normalized) | Q(name__iexact=value.strip())
+        ).values('star')
+    )
+    if exact.exists():
+        return exact
+
+    return queryset.filter(
+        Q(name__icontains=value) |
+        Q(pk__in=Identifier.objects.filter(
+            normalized_name__startswith=normalized,
+        ).values('star'))
+    )
+
+
+def remote_matches(queryset, value):
+    """
+        Systems of the queryset at the Simbad position of the name, None if
+        Simbad does not know the name. The name and the Simbad main
+        identifier are added as identifiers of the matched systems.
+    """
+    try:
+        data = catalog_providers.get_provider().query_object(value)
+        if data is None or len(data) == 0:
+            return None
+        ra, dec = sky_index.parse_coordinates(data['RA'][0], data['DEC'][0])
+    except Exception as e:
+        logger.warning("Simbad could not resolve '%s': %s", value, e)
+        return None
+
+    stars = sky_index.cone_search(queryset, ra, dec, SIMBAD_MATCH_RADIUS)
+
+    names = {value.strip(), str(data['MAIN_ID'][0]).strip()}
+    for star in stars:
+        known = set(
+            normalize_identifier(n)
+            for n in star.identifier_set.values_list('name', flat=True)
+        )
+        for name in names:
+            if normalize_identifier(name) not in known:
+                star.identifier_set.create(
+                    name=name,
+                    href="https://simbad.u-strasbg.fr/simbad/sim-id?Ident="
+                         + name.replace(" ", "").replace('+', "%2B"),
+                )
+                known.add(normalize_identifier(name))
+
+    return stars
+
+
+def resolve_name(queryset, value):
+    """
+        Systems of the queryset that match the name, see the module
+        documentation
+    """
+    stars = local_matches(queryset, value)
+    if stars.exists():
+        return stars
+
+    remote = remote_matches(queryset, value)
+    return stars if remote is None else remote
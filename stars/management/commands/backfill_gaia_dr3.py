@@ -0,0 +1,158 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from analysis.models import Parameter
+from stars import auxil
+from stars.models import Project, Star
+
+
+class Command(BaseCommand):
+    help = (
+        "Add Gaia DR3 photometry, parallax and proper motions to the systems "
+        "that do not have a Gaia DR3 parallax yet. The positions are "
+        "cross-matched with Gaia DR3 in batches by a pool of workers, and "
+        "the progress is recorded so that an interrupted run can be resumed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            nargs='+',
+            default=None,
+            help="Slugs or names of the projects (default: all projects)",
+        )
+        parser.add_argument(
+            '--all-stars',
+            action='store_true',
+            help="Also update the systems that already have Gaia DR3 data",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of systems cross-matched together (default: 500)",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help="Number of batches queried at the same time (default: 4)",
+        )
+        parser.add_argument(
+            '--state-file',
+            default='backfill_gaia_dr3_state.json',
+            help="File in which the processed systems are recorded",
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help="Skip the systems recorded in the state file",
+        )
+
+    def handle(self, *args, **options):
+        stars = Star.objects.all()
+        if options['project'] is not None:
+            stars = stars.filter(project__in=self.get_projects(options['project']))
+
+        if not options['all_stars']:
+            #   Anti-join on the Gaia DR3 parallaxes
+            stars = stars.exclude(Exists(Parameter.objects.filter(
+                star=OuterRef('pk'),
+                name__exact='parallax',
+                data_source__name__exact='Gaia DR3',
+            )))
+
+        self.state_file = options['state_file']
+        done = set()
+        if options['resume'] and os.path.isfile(self.state_file):
+            with open(self.state_file) as f:
+                done = set(json.load(f).get('done', []))
+
+        positions = [
+            row for row in stars.order_by('pk').values_list('pk', 'ra', 'dec')
+            if row[0] not in done
+        ]
+        self.stdout.write(
+            "{} systems to update ({} done before)".format(len(positions), len(done))
+        )
+
+        batches = [
+            positions[i:i + options['batch_size']]
+            for i in range(0, len(positions), options['batch_size'])
+        ]
+
+        n_photometry, n_parameters, n_failed = 0, 0, 0
+        for batch, tables, error in self.run_batches(batches, options['workers']):
+            if error is not None:
+                n_failed += len(batch)
+                self.stderr.write("Batch starting at system {} failed: {}".format(
+                    batch[0][0], error,
+                ))
+                continue
+
+            #   Writes are done here, so that the workers do not need their
+            #   own database connections
+            with transaction.atomic():
+                batch_stars = Star.objects.select_related('project') \
+                    .in_bulk([row[0] for row in batch])
+                photometry, parameters = auxil.write_catalog_data(
+                    [batch_stars.get(row[0]) for row in batch],
+                    tables,
+                    replace=True,
+                )
+            n_photometry += photometry
+            n_parameters += parameters
+
+            done.update(row[0] for row in batch)
+            self.write_state(done)
+
+        self.stdout.write(self.style.SUCCESS(
+            "{} photometry points and {} parameters added, {} systems failed".format(
+                n_photometry, n_parameters, n_failed,
+            )
+        ))
+
+    @staticmethod
+    def run_batches(batches, workers):
+        """
+            Yields (batch, tables, error) as the cross-matches are completed
+        """
+
+        def crossmatch(batch):
+            return auxil.crossmatch_catalogs(
+                [row[1] for row in batch],
+                [row[2] for row in batch],
+                names=['GAIA3'],
+            )
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(crossmatch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                if future.exception() is not None:
+                    yield batch, None, future.exception()
+                else:
+                    yield batch, future.result(), None
+
+    def write_state(self, done):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'done': sorted(done)}, f)
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def get_projects(values):
+        projects = []
+        for value in values:
+            project = Project.objects.filter(slug__exact=value).first()
+            if project is None:
+                project = Project.objects.filter(name__exact=value).first()
+            if project is None:
+                raise CommandError("Project '{}' does not exist".format(value))
+            projects.append(project)
+        return projects
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from stars.models import Identifier, normalize_identifier
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the normalized names of the identifiers that were created "
+        "before the identifier index existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help="Recalculate all normalized names, not only missing ones",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help="Number of identifiers updated per query (default: 5000)",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        identifiers = Identifier.objects.all()
+        if not options['all']:
+            identifiers = identifiers.filter(normalized_name__exact='')
+
+        pks = list(identifiers.order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(pks), batch_size):
+            batch = list(
+                Identifier.objects.filter(pk__in=pks[i:i + batch_size])
+                .only('pk', 'name', 'normalized_name')
+            )
+            for identifier in batch:
+                identifier.normalized_name = normalize_identifier(identifier.name)
+
+            #   bulk_update does not trigger save or the history
+            Identifier.objects.bulk_update(batch, ['normalized_name'])
+
+        self.stdout.write("{} identifiers indexed".format(len(pks)))
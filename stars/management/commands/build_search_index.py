@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from AOTS import search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the search documents of all stars, identifiers, tags and "
+        "spectra, and the substring index on their text."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help="Number of documents created per query (default: 2000)",
+        )
+
+    def handle(self, *args, **options):
+        search_index.create_index()
+
+        with transaction.atomic():
+            counts = search_index.rebuild(batch_size=options['batch_size'])
+
+        for kind, count in counts.items():
+            self.stdout.write("{} {} documents indexed".format(count, kind))
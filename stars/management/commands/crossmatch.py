@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stars import crossmatch
+from stars.models import Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Match a CSV or VOTable with id, ra and dec columns against the stars "
+        "of a project and write the best match, separation (arcsec) and "
+        "multiplicity of every row as CSV."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'project',
+            help="Slug of the project",
+        )
+        parser.add_argument(
+            'input',
+            help="CSV or VOTable with id, ra and dec columns",
+        )
+        parser.add_argument(
+            '--radius',
+            type=float,
+            default=crossmatch.DEFAULT_RADIUS,
+            help="Match radius in arcsec (default: {})".format(crossmatch.DEFAULT_RADIUS),
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help="Output CSV file (default: stdout)",
+        )
+
+    def handle(self, *args, **options):
+        project = Project.objects.filter(slug__exact=options['project']).first()
+        if project is None:
+            raise CommandError("Project '{}' does not exist".format(options['project']))
+
+        try:
+            with open(options['input'], 'rb') as f:
+                ids, ra, dec = crossmatch.read_coordinate_table(
+                    f.read(),
+                    filename=options['input'],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        lines = crossmatch.crossmatch_csv(
+            project, ids, ra, dec, radius=options['radius'],
+        )
+
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+        else:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(lines)
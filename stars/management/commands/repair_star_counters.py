@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stars import counters
+from stars.models import Star
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the numbers of photometry points, spectra, light curves, "
+        "datasets and raw science files stored on the systems."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--counter',
+            nargs='+',
+            default=None,
+            help="Counters to recompute (default: all of {})".format(
+                ', '.join(counters.COUNTERS)
+            ),
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help="Number of systems updated per query (default: 5000)",
+        )
+
+    def handle(self, *args, **options):
+        names = options['counter'] or counters.COUNTERS
+        unknown = set(names) - set(counters.COUNTERS)
+        if unknown:
+            raise CommandError("Unknown counters: {}".format(', '.join(sorted(unknown))))
+
+        batch_size = options['batch_size']
+        pks = list(Star.objects.order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(pks), batch_size):
+            #   One UPDATE with correlated counts per batch
+            counters.recount(Star.objects.filter(pk__in=pks[i:i + batch_size]), names)
+
+        self.stdout.write("Counters of {} systems recomputed".format(len(pks)))
@@ -1,2 +1,3 @@
 from .project import Project
-from .star import Tag, Star, Identifier
+from .star import Tag, Star, Identifier, normalize_identifier
+from .search import SearchDocument
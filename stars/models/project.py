@@ -5,6 +5,8 @@ from django.dispatch import receiver
 from django.utils.text import slugify
 from simple_history.models import HistoricalRecords
 
+from AOTS import versions
+
 
 class Project(models.Model):
     """
@@ -63,3 +65,7 @@ def set_project_slug(sender, **kwargs):
         unique_slug = ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(20))
 
     project.slug = unique_slug
+
+
+# -- bump the API version of the project on changes
+versions.register(Project, project=lambda project: project.pk)
@@ -0,0 +1,46 @@
+from django.db import models
+
+from .project import Project
+from .star import Star
+
+
+class SearchDocument(models.Model):
+    """
+    Normalized, searchable text of a star, identifier, tag or spectrum,
+    maintained by AOTS.search_index
+    """
+
+    STAR = 'star'
+    IDENTIFIER = 'identifier'
+    TAG = 'tag'
+    SPECTRUM = 'spectrum'
+    KIND_CHOICES = (
+        (STAR, 'System'),
+        (IDENTIFIER, 'Identifier'),
+        (TAG, 'Tag'),
+        (SPECTRUM, 'Spectrum'),
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+
+    # -- pk of the star, identifier, tag or spectrum
+    object_id = models.IntegerField()
+
+    # -- the system the document leads to, if any
+    star = models.ForeignKey(Star, on_delete=models.CASCADE, blank=True, null=True)
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+
+    # -- displayed name (fx. the star or tag name), and its normalized form
+    #   used to rank exact and prefix matches first
+    title = models.CharField(max_length=200)
+    key = models.CharField(max_length=200)
+
+    # -- all normalized search terms of the object
+    text = models.TextField()
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    # -- representation of self
+    def __str__(self):
+        return "{} {}: {}".format(self.kind, self.object_id, self.title)
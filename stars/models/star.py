@@ -6,6 +6,7 @@ from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from simple_history.models import HistoricalRecords
 
+from AOTS import search_index, sky_index, versions
 from .project import Project
 
 
@@ -47,6 +48,9 @@ class Star(models.Model):
     ra = models.FloatField()
     dec = models.FloatField()
 
+    # -- HEALPix pixel of the coordinates (see AOTS.sky_index)
+    healpix = models.BigIntegerField(null=True, blank=True, db_index=True)
+
     # -- spectral classification
     classification = models.CharField(max_length=50, blank=True)
 
@@ -81,6 +85,14 @@ class Star(models.Model):
     # -- tags
     tags = models.ManyToManyField(Tag, related_name='stars', blank=True)
 
+    # -- number of observations and datasets, kept up to date by
+    #   stars.counters
+    n_photometry = models.IntegerField(default=0, db_index=True)
+    n_spectra = models.IntegerField(default=0, db_index=True)
+    n_lightcurves = models.IntegerField(default=0, db_index=True)
+    n_datasets = models.IntegerField(default=0, db_index=True)
+    n_raw_science = models.IntegerField(default=0, db_index=True)
+
     # -- bookkeeping
     history = HistoricalRecords(cascade_delete_history=True)
 
@@ -123,23 +135,23 @@ class Star(models.Model):
 
     # Generate .csv snippet of all parameters for specific source
     def parameter_csv(self):
-        from analysis.models import COMPONENT_CHOICES, DataSource
-
-        all_csv_dict = {}
+        from analysis.models import COMPONENT_CHOICES
 
-        for source in DataSource.objects.all():
-            params_from_source = self.parameter_set.filter(data_source__name__iexact=source.name)
+        choices_dict = dict(COMPONENT_CHOICES)
 
-            csv_dict = {}
-            for p in params_from_source:
-                choices_dict = {}
-                for key, val in COMPONENT_CHOICES:
-                    choices_dict[key] = val
-                comp = choices_dict[p.component]
-                csv_dict[f"{comp}_{p.name}"] = str(p.value)
-                csv_dict[f"{comp}_{p.name}_err"] = str(p.error)
+        #   All parameters in one query, grouped by the name of their source
+        csv_dicts = {}
+        for p in self.parameter_set.select_related('data_source'):
+            if p.data_source is None:
+                continue
+            csv_dict = csv_dicts.setdefault(p.data_source.name.replace(" ", "_"), {})
+            comp = choices_dict[p.component]
+            csv_dict[f"{comp}_{p.name}"] = str(p.value)
+            csv_dict[f"{comp}_{p.name}_err"] = str(p.error)
 
-            all_csv_dict[source.name.replace(" ", "_")] = ",".join([*(csv_dict.keys())]) + "\n" + ",".join([*(csv_dict.values())])
+        all_csv_dict = {}
+        for source, csv_dict in csv_dicts.items():
+            all_csv_dict[source] = ",".join([*(csv_dict.keys())]) + "\n" + ",".join([*(csv_dict.values())])
         return all_csv_dict
 
     # -- hms and dms representation for ra and dec
@@ -162,6 +174,23 @@ class Star(models.Model):
         return "{}: {:.2f} {:.2f}".format(self.name, self.ra, self.dec)
 
 
+#   Simbad prefixes that are ignored when comparing identifiers
+IDENTIFIER_PREFIXES = ('name ', 'v* ', '** ', '* ')
+
+
+def normalize_identifier(name):
+    """
+    Fold an identifier for look ups: case, whitespace and Simbad prefixes
+    such as 'NAME' or 'V*' are ignored, fx. 'V* V1093 Her' -> 'v1093her'
+    """
+    name = ' '.join(str(name).split()).lower()
+    for prefix in IDENTIFIER_PREFIXES:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    return name.replace(' ', '')[:200]
+
+
 class Identifier(models.Model):
     """
     An alternative name for a star
@@ -175,6 +204,9 @@ class Identifier(models.Model):
 
     name = models.CharField(max_length=200)
 
+    # -- folded name used for look ups (see normalize_identifier)
+    normalized_name = models.CharField(max_length=200, blank=True, db_index=True)
+
     href = models.CharField(max_length=400, blank=True)
 
     # -- bookkeeping
@@ -207,8 +239,55 @@ def identifier_bookkeeping(sender, **kwargs):
 @receiver(pre_save, sender=Identifier)
 def identifier_add_project(sender, **kwargs):
     """
-    Add the project of the star this belongs to to the identifier
+    Add the project of the star this belongs to and the normalized name to
+    the identifier
     """
 
     identifier = kwargs['instance']
     identifier.project = identifier.star.project
+    identifier.normalized_name = normalize_identifier(identifier.name)
+
+
+# -- keep the HEALPix pixel up to date
+sky_index.register(Star)
+
+
+# -- keep the search documents up to date (see AOTS.search_index)
+def star_search_document(star):
+    return {
+        'project': star.project,
+        'star': star,
+        'title': star.name,
+        'terms': [star.classification],
+    }
+
+
+def identifier_search_document(identifier):
+    #   The identifier with the name of the star is found through the star
+    if search_index.normalize(identifier.name) == search_index.normalize(identifier.star.name):
+        return None
+    return {
+        'project': identifier.project,
+        'star': identifier.star,
+        'title': identifier.name,
+        'terms': [identifier.normalized_name],
+    }
+
+
+def tag_search_document(tag):
+    return {
+        'project': tag.project,
+        'star': None,
+        'title': tag.name,
+        'terms': [tag.description],
+    }
+
+
+search_index.register(Star, 'star', star_search_document)
+search_index.register(Identifier, 'identifier', identifier_search_document)
+search_index.register(Tag, 'tag', tag_search_document)
+
+# -- bump the API versions of the stars and tags of a project on changes
+versions.register(Star)
+versions.register(Tag)
+versions.register_m2m(Star, Star.tags.through)
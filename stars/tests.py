@@ -1,8 +1,43 @@
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
 from http import HTTPStatus
+from io import StringIO
 
-from django.test import TestCase
+import numpy as np
+from astropy.table import Table
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-from stars.models import Star, Project
+from analysis.models import Parameter
+from AOTS import search_index, sky_index
+from stars import auxil, catalog_providers, counters, crossmatch
+from stars.association import star_association
+from stars.auxil import (
+    add_catalog_data,
+    add_catalog_data_batch,
+    catalogs,
+    populate_system,
+    query_catalogs,
+)
+from stars.identifiers import resolve_name
+from stars.forms import SearchStarForm
+from stars.models import (
+    Identifier,
+    Project,
+    SearchDocument,
+    Star,
+    Tag,
+    normalize_identifier,
+)
 
 
 class IdentifierBookkeeping(TestCase):
@@ -44,8 +79,1000 @@ class IdentifierBookkeeping(TestCase):
                          "New star name not added to identifiers on star name change")
 
 
+class SkyIndex(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+
+    def create(self, name, ra, dec):
+        return Star.objects.create(name=name, project=self.project, ra=ra, dec=dec)
+
+    def cone(self, ra, dec, radius):
+        return set(sky_index.cone_search(
+            Star.objects.all(), ra, dec, radius,
+        ).values_list('name', flat=True))
+
+    def test_pixel_maintained_on_save(self):
+        star = self.create('Vega', 279.23473479, 38.78368896)
+        self.assertEqual(star.healpix, sky_index.ang2pix(279.23473479, 38.78368896))
+
+        star.ra = 10.
+        star.save()
+        star.refresh_from_db()
+        self.assertEqual(star.healpix, sky_index.ang2pix(10., 38.78368896),
+                         "Pixel not updated when the coordinates change")
+
+    def test_cone_search_across_ra_wrap_and_pole(self):
+        """
+        Matches are correct at RA = 0/360 and near the poles, where boxes fail
+        """
+        self.create('wrap_east', 359.9995, 10.)
+        self.create('wrap_west', 0.0005, 10.)
+        self.create('pole_1', 10., 89.9999)
+        self.create('pole_2', 190., 89.9999)
+        self.create('far', 0.01, 10.)
+
+        self.assertEqual(self.cone(0., 10., 2. / 3600.), {'wrap_east', 'wrap_west'})
+        self.assertEqual(self.cone(100., 89.9999, 1. / 3600.), {'pole_1', 'pole_2'})
+
+        #   cos(dec) is taken into account: 0.01 degree in RA at dec=80 is
+        #   only 6 arcsec on the sky
+        self.create('high_dec', 0.01, 80.)
+        self.assertEqual(self.cone(0., 80., 7. / 3600.), {'high_dec'})
+
+        star = sky_index.cone_search(Star.objects.all(), 0., 10., 0.1) \
+            .order_by('distance')[0]
+        self.assertAlmostEqual(star.distance, 0.0005 * 0.98481, places=6)
+
+    def test_cone_covers_random_offsets(self):
+        """
+        Every position within the radius is in the pixel ranges of the cone
+        """
+        from astropy.coordinates import SkyCoord
+        import astropy.units as u
+
+        #   Offsets in the outer half of the cone, where pixels are missed
+        #   without the padding
+        rng = np.random.default_rng(42)
+        for radius in [1. / 3600., 15. / 3600., 0.1]:
+            for _ in range(200):
+                ra = rng.uniform(0., 360.)
+                dec = np.degrees(np.arcsin(rng.uniform(-1., 1.)))
+                ranges = sky_index.cone_ranges(ra, dec, radius)
+
+                offsets = SkyCoord(ra * u.deg, dec * u.deg).directional_offset_by(
+                    rng.uniform(0., 2. * np.pi, 100) * u.rad,
+                    radius * rng.uniform(0.5, 0.999, 100) * u.deg,
+                )
+                pixels = sky_index.ang2pix_many(offsets.ra.deg, offsets.dec.deg)
+                missed = [p for p in pixels if not any(a <= p <= b for a, b in ranges)]
+                self.assertEqual(missed, [], "Missed at radius {}\"".format(radius * 3600.))
+
+        #   And through the database
+        center = SkyCoord(279.2347 * u.deg, 38.7837 * u.deg)
+        offsets = center.directional_offset_by(
+            rng.uniform(0., 2. * np.pi, 100) * u.rad, rng.uniform(0., 0.999, 100) * u.arcsec,
+        )
+        for i, position in enumerate(offsets):
+            self.create('offset_{}'.format(i), position.ra.deg, position.dec.deg)
+        self.assertEqual(len(self.cone(279.2347, 38.7837, 1. / 3600.)), 100)
+
+    def test_build_sky_index(self):
+        star = self.create('Vega', 279.23473479, 38.78368896)
+        Star.objects.filter(pk=star.pk).update(healpix=None)
+        self.assertEqual(self.cone(279.23473479, 38.78368896, 1. / 3600.), set())
+
+        call_command('build_sky_index', stdout=StringIO())
+        self.assertEqual(self.cone(279.23473479, 38.78368896, 1. / 3600.), {'Vega'})
+
+
+class Crossmatch(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        for name, ra, dec in [
+            ('Vega', 279.23473479, 38.78368896),
+            ('wrap_east', 359.9998, 10.),
+            ('wrap_west', 0.0003, 10.),
+        ]:
+            Star.objects.create(name=name, project=self.project, ra=ra, dec=dec)
+
+        self.table = (
+            "ID,RA,Dec\n"
+            "a,18:36:56.34,+38:47:01.3\n"
+            "b,0.0,10.0\n"
+            "c,120.0,-45.0\n"
+        )
+
+    def test_spherical_tree(self):
+        tree = sky_index.SphericalTree([359.9999, 90.], [0., 89.9999])
+        index, separation = tree.nearest([0.0001, 270.], [0., 89.9999], 1. / 3600.)
+        self.assertEqual(list(index), [0, 1])
+        self.assertAlmostEqual(separation[0] * 3600., 0.72, places=3)
+        self.assertAlmostEqual(separation[1] * 3600., 0.72, places=3)
+
+        index, separation = tree.nearest([10.], [10.], 1. / 3600.)
+        self.assertEqual(index[0], -1)
+        self.assertTrue(separation[0] != separation[0])
+
+    def test_crossmatch_endpoint(self):
+        self.client.force_login(get_user_model().objects.create(username='user'))
+        response = self.client.post(
+            reverse('systems-api:crossmatch'),
+            {
+                'project': self.project.slug,
+                'radius': 2.,
+                'file': SimpleUploadedFile('coordinates.csv', self.table.encode()),
+            },
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(rows[1].startswith('a,') and ',Vega,' in rows[1])
+        self.assertTrue(',wrap_east,' in rows[2] and rows[2].endswith(',2'),
+                        "Closest star and multiplicity not returned across RA = 0")
+        self.assertTrue(rows[3].endswith(',,,,0'))
+
+    def test_crossmatch_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(self.table)
+
+        out = StringIO()
+        call_command('crossmatch', self.project.slug, f.name, stdout=out)
+        os.remove(f.name)
+
+        rows = out.getvalue().splitlines()
+        self.assertEqual(rows[0], ','.join(crossmatch.CSV_COLUMNS))
+        self.assertTrue(',Vega,' in rows[1])
+
+
+
+class StarAssociation(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        star_association.invalidate()
+
+    def create(self, name, ra, dec):
+        return Star.objects.create(name=name, project=self.project, ra=ra, dec=dec)
+
+    def nearest(self, ra, dec, radius=None):
+        star = star_association.nearest(self.project, ra, dec, radius)
+        return None if star is None else star.name
+
+    def test_true_separation_across_ra_wrap_and_high_dec(self):
+        self.create('wrap', 359.99, 0.)
+        self.create('other', 0.03, 0.)
+        self.create('high_dec', 250., 89.95)
+        self.create('low_dec', 300., 89.81)
+
+        #   The euclidean distance in (ra, dec) would pick 'other' and
+        #   'low_dec'
+        self.assertEqual(self.nearest(0.005, 0.), 'wrap')
+        self.assertEqual(self.nearest(300., 89.9), 'high_dec')
+
+        star = star_association.nearest(self.project, 0.005, 0.)
+        self.assertAlmostEqual(star.distance, 0.015, places=9)
+
+        self.assertIsNone(self.nearest(0.005, 0., radius=0.001))
+
+    def test_index_updated_on_save_and_delete(self):
+        vega = self.create('Vega', 279.23473479, 38.78368896)
+        self.assertEqual(self.nearest(279.23, 38.78), 'Vega')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.nearest(279.23, 38.78), 'Vega')
+
+        new = self.create('new', 279.2301, 38.7801)
+        self.assertEqual(self.nearest(279.23, 38.78), 'new')
+
+        new.ra = 10.
+        new.save()
+        self.assertEqual(self.nearest(279.23, 38.78), 'Vega')
+        self.assertEqual(self.nearest(10., 38.78), 'new')
+
+        vega.delete()
+        self.assertIsNone(self.nearest(279.23, 38.78))
+
+    def test_stale_index_is_reloaded(self):
+        vega = self.create('Vega', 279.23473479, 38.78368896)
+        self.assertEqual(self.nearest(279.23, 38.78), 'Vega')
+
+        #   Changes that bypass the signals, fx. from another process
+        Star.objects.filter(pk=vega.pk).update(ra=10.)
+        self.assertIsNone(self.nearest(279.23, 38.78))
+        self.assertEqual(self.nearest(10., 38.78), 'Vega')
+
+    def test_star_added_by_another_process(self):
+        self.create('Vega', 279.23473479, 38.78368896)
+        self.assertIsNone(self.nearest(10., 10.))
+
+        #   Inserted without the signals of this process, with the pixel
+        #   that the saving process sets
+        Star.objects.bulk_create([Star(
+            name='new', project=self.project, ra=10.01, dec=10.,
+            healpix=sky_index.ang2pix(10.01, 10.),
+        )])
+        star = star_association.nearest(self.project, 10., 10.)
+        self.assertEqual(star.name, 'new')
+        self.assertAlmostEqual(star.distance, sky_index.separation(10., 10., 10.01, 10.), places=6)
+
+        #   And the index is reloaded with it
+        with self.assertNumQueries(2):
+            self.assertEqual(self.nearest(10., 10.), 'new')
+
+
+
+class CatalogProviders(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.directory = tempfile.mkdtemp()
+
+        Table({
+            'MAIN_ID': ['* alf Lyr'],
+            'IDS': ['* alf Lyr|NAME Vega|HD 172167'],
+            'RA': ['18 36 56.3364'],
+            'DEC': ['+38 47 01.280'],
+            'SP_TYPE': ['A0Va'],
+        }).write(os.path.join(self.directory, 'simbad.fits'))
+        Table({
+            'RA_ICRS': [279.2347, 279.2360],
+            'DE_ICRS': [38.7836, 38.7836],
+            'Gmag': [0.09, 12.],
+            'e_Gmag': [0.003, 0.01],
+            'Plx': [130.2, 1.],
+            'e_Plx': [0.2, 0.1],
+        }).write(os.path.join(self.directory, 'I_355_gaiadr3.fits'))
+        Table({
+            'RAJ2000': [279.2347],
+            'DEJ2000': [38.7836],
+            'g_mag': [0.1],
+            'e_g_mag': [np.nan],
+        }).write(os.path.join(self.directory, 'II_336_apass9.fits'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_populate_system_from_local_extracts(self):
+        star = Star.objects.create(name='Vega', project=self.project, ra=0., dec=0.)
+
+        with override_settings(CATALOG_LOCAL_DIR=self.directory):
+            success, message = populate_system(
+                {'main_id': 'HD 172167', 'get_simbad': True, 'tags': []},
+                star.pk,
+            )
+        self.assertTrue(success, message)
+
+        star.refresh_from_db()
+        self.assertAlmostEqual(star.ra, 279.2347, places=4)
+        self.assertEqual(star.classification, 'A0Va')
+        self.assertTrue(star.identifier_set.filter(name='* alf Lyr').exists())
+
+        photometry = {p.band: (p.measurement, p.error) for p in star.photometry_set.all()}
+        self.assertEqual(photometry, {
+            'GAIA3.G': (0.09, 0.003),
+            'APASS.G': (0.1, 0.),
+        })
+        self.assertEqual(
+            list(star.parameter_set.filter(data_source__name='Gaia DR3')
+                 .values_list('name', 'value')),
+            [('parallax', 130.2)],
+        )
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    def test_cached_provider(self):
+        local = catalog_providers.LocalProvider(self.directory)
+        calls = []
+
+        class CountingProvider(catalog_providers.CatalogProvider):
+            def query_region(self, *args):
+                calls.append(args)
+                return local.query_region(*args)
+
+            def query_object(self, name):
+                return local.query_object(name)
+
+        provider = catalog_providers.CachedProvider(CountingProvider(), timeout=60)
+        for i in range(3):
+            table = provider.query_region('I/355/gaiadr3', 279.2347, 38.7836, 1., ['Gmag'])
+            self.assertEqual(list(table['Gmag']), [0.09])
+        self.assertEqual(len(calls), 1)
+
+        provider.query_region('I/355/gaiadr3', 279.2347, 38.7836, 10., ['Gmag'])
+        self.assertEqual(len(calls), 2, "Radius not part of the cache key")
+
+
+    def test_incomplete_provider(self):
+        class RegionOnlyProvider(catalog_providers.CatalogProvider):
+            def query_region(self, *args):
+                return Table()
+
+        with self.assertRaises(TypeError):
+            RegionOnlyProvider()
+        with self.assertRaises(TypeError):
+            catalog_providers.CatalogProvider()
+
+    def test_concurrent_queries_with_timeout(self):
+        local = catalog_providers.LocalProvider(self.directory)
+        release = threading.Event()
+        calls = []
+
+        class SlowProvider(catalog_providers.CatalogProvider):
+            def query_region(self, catalog, *args):
+                calls.append(catalog)
+                if catalog == 'II/246/out':
+                    release.wait(5.)
+                if catalog == 'II/328/allwise':
+                    raise ConnectionError()
+                return local.query_region(catalog, *args)
+
+            def query_object(self, name):
+                return local.query_object(name)
+
+        tables, missing = query_catalogs(
+            279.2347, 38.7836, provider=SlowProvider(), timeout=0.5,
+        )
+        release.set()
+
+        self.assertEqual(sorted(missing), ['2MASS', 'WISE'])
+        self.assertEqual(len(tables), len(catalogs) - 2)
+        self.assertEqual(calls.count('I/355/gaiadr3'), 1,
+                         "Gaia astrometry not queried together with the photometry")
+        self.assertEqual(list(tables['GAIA3']['Plx']), [130.2])
+
+        star = Star.objects.create(name='Vega', project=self.project, ra=279.2347, dec=38.7836)
+        add_catalog_data(star, tables)
+        self.assertEqual(star.photometry_set.count(), 2)
+        parallax = star.parameter_set.filter(name='parallax', data_source__name='Gaia DR3')
+        self.assertEqual(parallax.count(), 1)
+
+        #   Backfilling again does not duplicate data (run in this thread, so
+        #   that it sees the test transaction)
+        with override_settings(CATALOG_LOCAL_DIR=self.directory):
+            auxil._backfill_in_thread(star.pk, ['GAIA3', '2MASS'], False)
+        self.assertEqual(star.photometry_set.count(), 2)
+        self.assertEqual(parallax.count(), 1)
+
+
+    def test_batch_catalog_data(self):
+        local = catalog_providers.LocalProvider(self.directory)
+        calls = []
+
+        class CountingProvider(catalog_providers.CatalogProvider):
+            def query_region(self, *args):
+                return local.query_region(*args)
+
+            def query_object(self, name):
+                return local.query_object(name)
+
+            def crossmatch(self, catalog, *args):
+                calls.append(catalog)
+                return local.crossmatch(catalog, *args)
+
+        stars = [
+            Star.objects.create(name=name, project=self.project, ra=ra, dec=38.7836)
+            for name, ra in [('far', 10.), ('Vega', 279.2347), ('other', 279.2360)]
+        ]
+
+        n_photometry, n_parameters = add_catalog_data_batch(
+            [s.pk for s in stars], provider=CountingProvider(),
+        )
+        self.assertEqual(sorted(calls), sorted(c['simbad_id'] for c in catalogs.values()))
+        self.assertEqual((n_photometry, n_parameters), (3, 2))
+
+        far, vega, other = stars
+        self.assertEqual(far.photometry_set.count(), 0)
+        self.assertEqual(
+            sorted(vega.photometry_set.values_list('band', 'measurement')),
+            [('APASS.G', 0.1), ('GAIA3.G', 0.09)],
+        )
+        self.assertTrue(vega.photometry_set.get(band='GAIA3.G').wavelength > 0)
+        self.assertEqual(other.photometry_set.get().measurement, 12.)
+
+        average = other.parameter_set.get(name='parallax', average=True)
+        self.assertEqual((average.value, average.error, average.cname), (1., 0.1, 'parallax'))
+
+    def test_csv_upload_catalog_data(self):
+        """
+        Only the uploaded systems with get_simbad get catalog data
+        """
+        user = get_user_model().objects.create(username='admin', is_superuser=True)
+        self.client.force_login(user)
+
+        #   Missing trailing values are read as None
+        upload = SimpleUploadedFile('systems.csv', (
+            'main_id,get_simbad,ra,dec,sp_type,parallax,pmra_x,pmdec_x\n'
+            'HD 172167,1\n'
+            'other,,279.2360,38.7836,B\n'
+        ).encode(), content_type='text/csv')
+        with override_settings(CATALOG_LOCAL_DIR=self.directory):
+            self.client.post(
+                reverse('systems:star_list', kwargs={'project': self.project.slug}),
+                {'system': upload},
+            )
+
+        vega = Star.objects.get(name='HD 172167')
+        self.assertEqual(
+            sorted(vega.photometry_set.values_list('band', flat=True)),
+            ['APASS.G', 'GAIA3.G'],
+        )
+        self.assertTrue(vega.parameter_set.filter(name='parallax').exists())
+
+        #   The position of the plain row has a Gaia DR3 match, which is
+        #   not used
+        other = Star.objects.get(name='other')
+        self.assertEqual(other.photometry_set.count(), 0)
+        self.assertEqual(other.parameter_set.count(), 0)
+
+    def test_csv_upload_catalog_data_failure_is_logged(self):
+        from unittest import mock
+
+        user = get_user_model().objects.create(username='admin', is_superuser=True)
+        self.client.force_login(user)
+
+        upload = SimpleUploadedFile('systems.csv', (
+            'main_id,get_simbad,ra,dec,sp_type,parallax,pmra_x,pmdec_x\n'
+            'HD 172167,1\n'
+        ).encode(), content_type='text/csv')
+        with mock.patch('stars.views.add_catalog_data_batch', side_effect=RuntimeError('down')), \
+                override_settings(CATALOG_LOCAL_DIR=self.directory), \
+                self.assertLogs('stars.views', level='ERROR') as logs:
+            self.client.post(
+                reverse('systems:star_list', kwargs={'project': self.project.slug}),
+                {'system': upload},
+            )
+        self.assertIn('systems.csv', logs.output[0])
+        self.assertTrue(Star.objects.filter(name='HD 172167').exists())
+
+    def test_csv_upload_photometry_without_tags(self):
+        """
+        The photometry of a row is added also if there is no tags column,
+        like the photometry of the catalogs
+        """
+        user = get_user_model().objects.create(username='admin', is_superuser=True)
+        self.client.force_login(user)
+
+        upload = SimpleUploadedFile('systems.csv', (
+            'main_id,get_simbad,ra,dec,sp_type,phot_g_mean_mag,'
+            'phot_g_mean_magerr,Jmag,parallax,pmra_x,pmdec_x\n'
+            'other,,279.2360,38.7836,B,12.5,0.02,11.1\n'
+        ).encode(), content_type='text/csv')
+        self.client.post(
+            reverse('systems:star_list', kwargs={'project': self.project.slug}),
+            {'system': upload},
+        )
+
+        other = Star.objects.get(name='other')
+        self.assertEqual(
+            sorted(other.photometry_set.values_list('band', 'measurement', 'error')),
+            [('2MASS.J', 11.1, 0.), ('GAIA3.G', 12.5, 0.02)],
+        )
+
+
+    def test_backfill_gaia_dr3(self):
+        stars = [
+            Star.objects.create(name=name, project=self.project, ra=ra, dec=38.7836)
+            for name, ra in [('Vega', 279.2347), ('other', 279.2360), ('far', 10.)]
+        ]
+        state_file = os.path.join(self.directory, 'state.json')
+
+        with override_settings(CATALOG_LOCAL_DIR=self.directory):
+            call_command(
+                'backfill_gaia_dr3',
+                '--batch-size', '1',
+                '--workers', '2',
+                '--state-file', state_file,
+                stdout=StringIO(),
+            )
+
+            gaia = Parameter.objects.filter(data_source__name='Gaia DR3', name='parallax')
+            self.assertEqual(
+                sorted(gaia.values_list('star__name', 'value')),
+                [('Vega', 130.2), ('other', 1.)],
+            )
+            self.assertEqual(stars[0].photometry_set.get(band='GAIA3.G').measurement, 0.09)
+            with open(state_file) as f:
+                self.assertEqual(sorted(json.load(f)['done']), sorted(s.pk for s in stars))
+
+            #   No system is selected when resuming, and only the system
+            #   without Gaia DR3 data otherwise
+            out = StringIO()
+            call_command('backfill_gaia_dr3', '--state-file', state_file,
+                         '--resume', '--all-stars', stdout=out)
+            self.assertIn('0 systems to update', out.getvalue())
+
+            out = StringIO()
+            call_command('backfill_gaia_dr3', '--state-file', state_file, stdout=out)
+            self.assertIn('1 systems to update', out.getvalue())
+
+            #   Updating all systems replaces the data of the matched
+            #   systems, the system without a match keeps its values
+            from observations.models import Photometry
+            Photometry.objects.create(star=stars[2], band='GAIA3.G', measurement=15.2, error=0.01, unit='mag')
+            Parameter.objects.create(
+                star=stars[2], data_source=auxil.get_gaia_source(self.project),
+                name='parallax', component=0, value=2.5, error_l=0.1, error_u=0.1,
+            )
+            call_command('backfill_gaia_dr3', '--all-stars',
+                         '--state-file', state_file, stdout=StringIO())
+            self.assertEqual(gaia.count(), 3)
+            self.assertEqual(stars[0].photometry_set.filter(band='GAIA3.G').count(), 1)
+            self.assertEqual(stars[2].photometry_set.get(band='GAIA3.G').measurement, 15.2)
+            self.assertEqual(gaia.get(star=stars[2]).value, 2.5)
+
+
+
+class IdentifierResolution(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.vega = Star.objects.create(
+            name='Vega', project=self.project, ra=279.2347, dec=38.7837,
+        )
+        self.vega.identifier_set.create(name='V* V1093 Her')
+        Star.objects.create(name='Vega B', project=self.project, ra=10., dec=10.)
+
+        self.directory = tempfile.mkdtemp()
+        Table({
+            'MAIN_ID': ['* alf Lyr'],
+            'IDS': ['* alf Lyr|NAME Vega|HD 172167'],
+            'RA': ['18 36 56.3364'],
+            'DEC': ['+38 47 01.280'],
+            'SP_TYPE': ['A0Va'],
+        }).write(os.path.join(self.directory, 'simbad.fits'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def search(self, value):
+        return set(resolve_name(Star.objects.all(), value).values_list('name', flat=True))
+
+    def test_normalize_identifier(self):
+        self.assertEqual(normalize_identifier('V*  V1093 Her'), 'v1093her')
+        self.assertEqual(normalize_identifier('NAME Vega'), 'vega')
+        self.assertEqual(normalize_identifier(' HD 172167'), 'hd172167')
+        self.assertEqual(
+            self.vega.identifier_set.get(name='V* V1093 Her').normalized_name,
+            'v1093her',
+        )
+
+    def test_local_identifiers_without_simbad(self):
+        #   No Simbad extract: remote lookups fail
+        with override_settings(CATALOG_LOCAL_DIR=os.path.join(self.directory, 'none')):
+            self.assertEqual(self.search('v1093 her'), {'Vega'})
+            self.assertEqual(self.search('vega'), {'Vega'})
+            self.assertEqual(self.search('Veg'), {'Vega', 'Vega B'})
+            self.assertEqual(self.search('HD 172167'), set())
+
+    def test_simbad_resolution_is_stored(self):
+        with override_settings(CATALOG_LOCAL_DIR=self.directory):
+            self.assertEqual(self.search('HD  172167'), {'Vega'})
+
+        self.assertTrue(self.vega.identifier_set.filter(name='HD  172167').exists())
+        self.assertTrue(self.vega.identifier_set.filter(name='* alf Lyr').exists())
+
+        #   Answered locally now
+        with override_settings(CATALOG_LOCAL_DIR=os.path.join(self.directory, 'none')):
+            self.assertEqual(self.search('hd172167'), {'Vega'})
+            self.assertEqual(self.search('alf Lyr'), {'Vega'})
+
+    def test_build_identifier_index(self):
+        Identifier.objects.update(normalized_name='')
+        call_command('build_identifier_index', stdout=StringIO())
+        self.assertEqual(
+            Identifier.objects.get(name='V* V1093 Her').normalized_name,
+            'v1093her',
+        )
+
+
+class SearchIndex(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.hidden = Project.objects.create(name='Hidden', is_public=False)
+
+        self.star = Star.objects.create(
+            name='BD+34 1543', project=self.project, ra=10., dec=10.,
+            classification='sdB+F',
+        )
+        self.star.identifier_set.create(name='TYC 2420-1209-1')
+        Star.objects.create(name='BD+34 1543 B', project=self.project, ra=11., dec=10.)
+        Star.objects.create(name='BD+34 1543', project=self.hidden, ra=10., dec=10.)
+        tag = Tag.objects.create(name='long period sdB', project=self.project)
+        self.tagged = Star.objects.create(name='PG 1104+243', project=self.project, ra=12., dec=10.)
+        self.tagged.tags.add(tag)
+
+    def titles(self, q, **kwargs):
+        return [d.title for d in search_index.search(q, **kwargs)]
+
+    def test_documents_follow_the_objects(self):
+        self.assertEqual(
+            SearchDocument.objects.get(kind='star', object_id=self.star.pk).text,
+            'bd+34 1543 | sdb+f',
+        )
+        #   The identifier with the name of the star has no document
+        self.assertEqual(
+            SearchDocument.objects.filter(kind='identifier', star=self.star).count(),
+            1,
+        )
+
+        self.star.name = 'BD+34 1544'
+        self.star.save()
+        self.assertEqual(self.titles('1544'), ['BD+34 1544'])
+
+        self.star.delete()
+        self.assertEqual(self.titles('1544'), [])
+        self.assertEqual(self.titles('2420-1209'), [])
+
+    def test_ranking_and_permissions(self):
+        #   The star in the private project is not found
+        self.assertEqual(
+            self.titles('bd+34 1543', user=AnonymousUser()),
+            ['BD+34 1543', 'BD+34 1543 B'],
+        )
+
+        #   Exact match before prefix and substring matches
+        self.assertEqual(self.titles('bd+34  1543')[-1], 'BD+34 1543 B')
+        self.assertEqual(self.titles('tyc 2420'), ['TYC 2420-1209-1'])
+        self.assertEqual(self.titles('sdb'), ['BD+34 1543', 'long period sdB'])
+        self.assertEqual(self.titles('sdb', kinds=['tag']), ['long period sdB'])
+        #   Short terms are scanned
+        self.assertEqual(self.titles('pg'), ['PG 1104+243'])
+
+    def test_search_form_and_api(self):
+        form = SearchStarForm({'q': 'long period'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(list(form.search()), [self.tagged])
+
+        form = SearchStarForm({'q': 'TYC 2420'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(list(form.search()), [self.star])
+
+        response = self.client.get(
+            reverse('systems-api:search'),
+            {'q': 'BD+34', 'kind': 'star'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(r['title'], r['project']) for r in response.json()],
+            [('BD+34 1543', self.project.slug), ('BD+34 1543 B', self.project.slug)],
+        )
+
+    def test_build_search_index(self):
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.titles('tyc'), [])
+
+        call_command('build_search_index', stdout=StringIO())
+        self.assertEqual(self.titles('tyc'), ['TYC 2420-1209-1'])
+        self.assertEqual(self.titles('period'), ['long period sdB'])
+
+
+class StarListQueries(TestCase):
+
+    def setUp(self):
+        from analysis.models import DataSet, Method
+        from observations.models import Photometry, Spectrum
+
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        tag = Tag.objects.create(name='sdB', project=self.project)
+        method = Method.objects.create(name='SED', slug='sed', project=self.project)
+
+        for i in range(20):
+            star = Star.objects.create(
+                name='Star {}'.format(i), project=self.project, ra=i, dec=0.,
+            )
+            star.tags.add(tag)
+            DataSet.objects.create(
+                name='SED fit', star=star, method=method, project=self.project,
+            )
+            Photometry.objects.create(
+                star=star, band='GAIA2.G', measurement=12.3 + i,
+                error=0.01, unit='mag',
+            )
+            Photometry.objects.create(
+                star=star, band='2MASS.J', measurement=11., error=0.01, unit='mag',
+            )
+            for _ in range(i % 3):
+                Spectrum.objects.create(star=star, project=self.project)
+
+    def get_list(self, length):
+        return self.client.get(
+            '/api/systems/stars/',
+            {'format': 'datatables', 'length': length, 'start': 0, 'draw': 1},
+        )
+
+    def test_fixed_number_of_queries(self):
+        #   Count, page, tags and datasets, independent of the page size
+        with self.assertNumQueries(4):
+            response = self.get_list(5)
+        self.assertEqual(len(response.json()['data']), 5)
+
+        with self.assertNumQueries(4):
+            response = self.get_list(1000)
+        rows = response.json()['data']
+        self.assertEqual(len(rows), 20)
+
+        row = next(r for r in rows if r['name'] == 'Star 2')
+        self.assertEqual(row['nphot'], 2)
+        self.assertEqual(row['nspec'], 2)
+        self.assertEqual(row['nlc'], 0)
+        self.assertEqual(row['vmag'], 14.3)
+        self.assertEqual([t['name'] for t in row['tags']], ['sdB'])
+        self.assertEqual(row['datasets'][0]['name'], 'SED fit')
+
+
+class StarCounters(TestCase):
+
+    def setUp(self):
+        from observations.models import Photometry, RawSpecFile, SpecFile, Spectrum
+
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        self.star = Star.objects.create(name='Star 1', project=self.project, ra=1., dec=1.)
+        self.other = Star.objects.create(name='Star 2', project=self.project, ra=2., dec=2.)
+
+        for band in ['GAIA2.G', '2MASS.J']:
+            Photometry.objects.create(
+                star=self.star, band=band, measurement=12., error=0.01, unit='mag',
+            )
+        self.spectrum = Spectrum.objects.create(star=self.star, project=self.project)
+        self.specfile = SpecFile.objects.create(spectrum=self.spectrum, project=self.project)
+
+        self.raw = RawSpecFile.objects.create(project=self.project, filetype='Science')
+        self.raw.specfile.add(self.specfile)
+        #   Linked in both ways, counted once
+        self.raw.star.add(self.star)
+        flat = RawSpecFile.objects.create(project=self.project, filetype='Flat')
+        flat.star.add(self.star)
+
+    def counts(self, star):
+        star.refresh_from_db()
+        return [getattr(star, counter) for counter in counters.COUNTERS]
+
+    def test_counters_follow_the_observations(self):
+        from observations.models import Spectrum
+
+        self.assertEqual(self.counts(self.star), [2, 1, 0, 0, 1])
+
+        #   Spectrum moved to the other star, the raw file stays linked
+        spectrum = Spectrum.objects.get(pk=self.spectrum.pk)
+        spectrum.star = self.other
+        spectrum.save()
+        self.assertEqual(self.counts(self.star), [2, 0, 0, 0, 1])
+        self.assertEqual(self.counts(self.other), [0, 1, 0, 0, 1])
+
+        self.raw.star.remove(self.star)
+        self.assertEqual(self.counts(self.star)[4], 0)
+
+        self.star.photometry_set.all().delete()
+        self.assertEqual(self.counts(self.star)[0], 0)
+
+        self.raw.delete()
+        self.assertEqual(self.counts(self.other)[4], 0)
+
+    def test_filter_on_counters(self):
+        response = self.client.get(
+            '/api/systems/stars/',
+            {'format': 'json', 'nphot_min': 1, 'nspec_max': 1},
+        )
+        self.assertEqual(
+            [r['name'] for r in response.json()['results']],
+            ['Star 1'],
+        )
+
+    def test_repair_star_counters(self):
+        Star.objects.update(n_photometry=10, n_spectra=10, n_raw_science=10)
+        call_command('repair_star_counters', stdout=StringIO())
+        self.assertEqual(self.counts(self.star), [2, 1, 0, 0, 1])
+        self.assertEqual(self.counts(self.other), [0, 0, 0, 0, 0])
+
+
+class KeysetPagination(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(
+            name='TestCase',
+            description='TestCase_description',
+        )
+        #   Duplicate names, the pk breaks the ties
+        for i, name in enumerate(['b', 'a', 'c', 'a', 'b', 'a', 'd']):
+            Star.objects.create(name=name, project=self.project, ra=i, dec=0.)
+
+    def iterate(self, params):
+        url, params = '/api/systems/stars/', dict(params, cursor='', page_size=3)
+        pages = []
+        while url is not None:
+            response = self.client.get(url, params).json()
+            pages.append(response)
+            url, params = response['next'], {}
+        return pages
+
+    def test_iterate_on_name(self):
+        pages = self.iterate({'count': 'exact'})
+        self.assertEqual([len(p['results']) for p in pages], [3, 3, 1])
+        self.assertEqual(pages[0]['count'], 7)
+
+        rows = [(r['name'], r['pk']) for p in pages for r in p['results']]
+        self.assertEqual(rows, sorted(rows))
+
+    def test_iterate_on_order_column(self):
+        pages = self.iterate({
+            'order[0][column]': 0,
+            'columns[0][data]': 'ra',
+            'order[0][dir]': 'desc',
+        })
+        self.assertNotIn('count', pages[0])
+        self.assertEqual(
+            [r['ra'] for p in pages for r in p['results']],
+            [6., 5., 4., 3., 2., 1., 0.],
+        )
+
+    def test_page_numbers_still_work(self):
+        response = self.client.get('/api/systems/stars/', {'page': 1}).json()
+        self.assertEqual(response['count'], 7)
+        self.assertEqual(len(response['results']), 7)
+
+
+class BulkExport(TestCase):
+
+    def setUp(self):
+        from observations.models import Photometry
+
+        self.project = Project.objects.create(name='Public', is_public=True)
+        self.hidden = Project.objects.create(name='Hidden', is_public=False)
+        for i in range(5):
+            star = Star.objects.create(
+                name='Star <{}>'.format(i), project=self.project, ra=i, dec=0.,
+            )
+            Photometry.objects.create(
+                star=star, band='GAIA2.G', measurement=12., error=0.01, unit='mag',
+            )
+        Star.objects.create(name='Hidden', project=self.hidden, ra=0., dec=0.)
+
+    def export(self, table, **params):
+        response = self.client.get(reverse('export', args=[table]), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        lines = self.export('stars').decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['pk', 'name', 'project_slug'])
+        self.assertEqual(len(lines), 6)
+
+        lines = self.export('photometry', project=self.project.slug).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertIn('GAIA2.G', lines[1])
+
+    def test_votable(self):
+        from astropy.io.votable import parse_single_table
+
+        content = self.export('stars', format='votable')
+        table = parse_single_table(io.BytesIO(content)).to_table()
+        self.assertEqual(sorted(table['name']), ['Star <{}>'.format(i) for i in range(5)])
+        self.assertEqual(table['ra'].dtype.kind, 'f')
+
+    def test_parquet(self):
+        if importlib.util.find_spec('pyarrow') is None:
+            response = self.client.get(reverse('export', args=['stars']), {'format': 'parquet'})
+            self.assertEqual(response.status_code, 400)
+            return
+
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(self.export('stars', format='parquet')))
+        self.assertEqual(table.num_rows, 5)
+
+    def test_unknown_table_and_format(self):
+        self.assertEqual(self.client.get(reverse('export', args=['users'])).status_code, 400)
+        response = self.client.get(reverse('export', args=['stars']), {'format': 'xls'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_basic_auth(self):
+        import base64
+
+        user = get_user_model().objects.create_user(username='reader', password='secret')
+        self.hidden.readonly_users.add(user)
+
+        lines = self.export('stars', project=self.hidden.slug).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+
+        credentials = base64.b64encode(b'reader:secret').decode()
+        response = self.client.get(
+            reverse('export', args=['stars']),
+            {'project': self.hidden.slug, 'format': 'csv'},
+            HTTP_AUTHORIZATION='Basic ' + credentials,
+        )
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Hidden', lines[1])
+
+
 #    Tests for robots.txt
 #       -> adapted from https://adamj.eu/tech/2020/02/10/robots-txt/
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class ConditionalGet(TestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(name='Public', is_public=True)
+        self.star = Star.objects.create(name='BD+34 1543', project=self.project, ra=10., dec=10.)
+        self.tag = Tag.objects.create(name='sdB', project=self.project)
+        self.url = reverse('systems-api:star-detail', args=[self.star.pk])
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        #   Only the project of the star is looked up
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        #   The serialized star is cached
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()['name'], 'BD+34 1543')
+        self.assertEqual(response['ETag'], etag)
+
+        #   Changes give a new ETag
+        with self.captureOnCommitCallbacks(execute=True):
+            self.star.tags.add(self.tag)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['name'] for t in response.json()['tags']], ['sdB'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_depends_on_permissions(self):
+        url = reverse('systems-api:tag-list')
+        etag = self.client.get(url)['ETag']
+
+        user = get_user_model().objects.create(username='reader')
+        self.client.force_login(user)
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.description = 'subdwarf B'
+            self.tag.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['description'], 'subdwarf B')
+
+    def test_missing_objects_are_not_cached(self):
+        url = reverse('systems-api:star-detail', args=[self.star.pk + 100])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertNotIn('ETag', self.client.get(url))
+
+
 class RobotsTxtTests(TestCase):
     def test_get(self):
         response = self.client.get("/robots.txt")
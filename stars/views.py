@@ -1,5 +1,6 @@
 import csv
 import io
+import logging
 
 from bokeh.embed import components
 from bokeh.resources import CDN
@@ -12,7 +13,9 @@ from AOTS.custom_permissions import check_user_can_view_project
 from analysis.models import Method
 from observations.plotting import plot_sed
 from .auxil import (
+    add_catalog_data_batch,
     populate_system,
+    requests_catalog_data,
     invalid_form,
     update_photometry,
     get_params,
@@ -27,6 +30,8 @@ from .forms import (
 )
 from .models import Star, Tag, Project
 
+logger = logging.getLogger(__name__)
+
 
 # from .plotting import plot_photometry
 
@@ -46,7 +51,7 @@ def project_list(request):
         user = request.user
         private_projects = (
             Project.objects.filter(is_public__exact=False)
-            .filter(pk__in=user.get_read_projects().values("pk"))
+            .filter(pk__in=user.get_read_project_ids())
             .order_by("name")
         )
 
@@ -83,6 +88,9 @@ def star_list(request, project=None, **kwargs):
                         )
                         continue
                     systems = csv.DictReader(io.TextIOWrapper(f.file))
+                    #   Systems for which the catalog data is added at once
+                    #   after all systems are created
+                    new_pks = []
                     for star in systems:
                         #   Initialize star model
                         sobj = Star(
@@ -94,7 +102,16 @@ def star_list(request, project=None, **kwargs):
                         sobj.save()
 
                         try:
-                            success, message = populate_system(star, sobj.pk)
+                            success, message = populate_system(
+                                star,
+                                sobj.pk,
+                                catalog_data=False,
+                            )
+                            #   Only the systems that ask for it get
+                            #   the photometry and Gaia DR3 data of the
+                            #   catalogs
+                            if success and requests_catalog_data(star):
+                                new_pks.append(sobj.pk)
                             l = messages.SUCCESS if success else messages.ERROR
                             messages.add_message(request, l, message)
                         except Exception as e:
@@ -109,6 +126,19 @@ def star_list(request, project=None, **kwargs):
                                 ),
                             )
 
+                    try:
+                        add_catalog_data_batch(new_pks)
+                    except Exception:
+                        logger.exception(
+                            "Adding the catalog data of %s failed", f.name,
+                        )
+                        messages.add_message(
+                            request,
+                            messages.ERROR,
+                            "Exception occurred when adding the catalog "
+                            "data of: {}".format(str(f.name)),
+                        )
+
                 return HttpResponseRedirect(
                     reverse(
                         "systems:star_list",
@@ -274,11 +304,7 @@ def star_detail(request, star_id, project=None, **kwargs):
     context["parameterSources"] = pSource
 
     #   Get number of raw data files
-    n_raw = len(star.rawspecfile_set.all().filter(filetype__exact="Science"))
-    for spectrum in star.spectrum_set.all():
-        for spec in spectrum.specfile_set.all():
-            n_raw += len(spec.rawspecfile_set.all().filter(filetype__exact="Science"))
-    context["n_raw"] = n_raw
+    context["n_raw"] = star.n_raw_science
 
     if request.method == "POST" and request.user.is_authenticated:
         # Differentiate between Vizier and Edit form submit buttons
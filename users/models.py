@@ -1,8 +1,21 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import CharField, Value
+from django.db.models.signals import m2m_changed, pre_delete
 
 from stars import models as star_models
 
+#   Project relations that give a user access to a project: role -> field of
+#   the project
+PROJECT_ROLES = {
+    'readonly': 'readonly_users',
+    'readwriteown': 'readwriteown_users',
+    'readwrite': 'readwrite_users',
+    'managed': 'project_managers',
+}
+
 
 def get_sentinel_user():
     """
@@ -27,12 +40,57 @@ class User(AbstractUser):
 
     note = models.TextField(default='')
 
+    def project_permission_cache_key(self):
+        #   The join date is included, since pks can be reused after a user
+        #   is deleted
+        return 'project_permissions:{}:{}'.format(self.pk, self.date_joined.timestamp())
+
+    def get_project_ids(self):
+        """
+        Returns the pks of the projects of this user per role (see
+        PROJECT_ROLES). They are kept on the user object for the rest of the
+        request, and in the cache for PROJECT_PERMISSION_CACHE_TIMEOUT
+        seconds.
+        """
+        if getattr(self, '_project_ids', None) is not None:
+            return self._project_ids
+
+        key = self.project_permission_cache_key()
+        project_ids = cache.get(key)
+        if project_ids is None:
+            #   One query over the four membership tables
+            queries = [
+                getattr(star_models.Project, field).through.objects
+                .filter(user_id=self.pk)
+                .annotate(role=Value(role, output_field=CharField()))
+                .values_list('role', 'project_id')
+                for role, field in PROJECT_ROLES.items()
+            ]
+            project_ids = {role: set() for role in PROJECT_ROLES}
+            for role, project_id in queries[0].union(*queries[1:], all=True):
+                project_ids[role].add(project_id)
+            cache.set(key, project_ids, timeout=getattr(settings, 'PROJECT_PERMISSION_CACHE_TIMEOUT', 60))
+
+        self._project_ids = project_ids
+        return project_ids
+
+    def clear_project_ids(self):
+        self._project_ids = None
+        cache.delete(self.project_permission_cache_key())
+
+    def get_read_project_ids(self):
+        """
+        Returns the pks of the projects this user has read access to, besides
+        the public projects
+        """
+        project_ids = self.get_project_ids()
+        return project_ids['readonly'] | project_ids['readwriteown'] | project_ids['readwrite']
+
     def get_read_projects(self):
         if self.is_superuser:
             return star_models.Project.objects.all()
         else:
-            return self.readonly_projects.all().union(self.readwriteown_projects.all(),
-                                                      self.readwrite_projects.all())
+            return star_models.Project.objects.filter(pk__in=self.get_read_project_ids())
 
     def can_read(self, project):
         """
@@ -42,9 +100,7 @@ class User(AbstractUser):
         if project.is_public or self.is_superuser:
             # Public projects can be read by everyone
             return True
-        elif project in self.readonly_projects.all() or \
-                project in self.readwriteown_projects.all() or \
-                project in self.readwrite_projects.all():
+        elif project.pk in self.get_read_project_ids():
             # private projects require read access
             return True
         else:
@@ -54,11 +110,12 @@ class User(AbstractUser):
         """
         Returns true if this user can add new objects to this project
         """
+        project_ids = self.get_project_ids()
 
         if self.is_superuser:
             return True
-        elif project in self.readwriteown_projects.all() or \
-                project in self.readwrite_projects.all():
+        elif project.pk in project_ids['readwriteown'] or \
+                project.pk in project_ids['readwrite']:
             return True
         else:
             return False
@@ -67,11 +124,13 @@ class User(AbstractUser):
         """
         Returns true if this user can edit this specific object
         """
+        project_ids = self.get_project_ids()
+
         if self.is_superuser:
             return True
-        elif obj.project in self.readwrite_projects.all():
+        elif obj.project_id in project_ids['readwrite']:
             return True
-        elif obj.project in self.readwriteown_projects.all() and \
+        elif obj.project_id in project_ids['readwriteown'] and \
                 obj.history.earliest().history_user == self:
             return True
         else:
@@ -81,15 +140,87 @@ class User(AbstractUser):
         """
         Returns true if this user can delete this specific object
         """
+        project_ids = self.get_project_ids()
+
         if self.is_superuser:
             return True
-        elif obj.project in self.readwrite_projects.all() and \
+        elif obj.project_id in project_ids['readwrite'] and \
                 obj.history.earliest().history_user == self:
             return True
-        elif obj.project in self.readwriteown_projects.all() and \
+        elif obj.project_id in project_ids['readwriteown'] and \
                 obj.history.earliest().history_user == self:
             return True
-        elif obj.project in self.managed_projects.all():
+        elif obj.project_id in project_ids['managed']:
             return True
         else:
             return False
+
+
+def clear_project_permissions(user_ids):
+    """
+    Delete the cached projects of the users
+    """
+    users = User.objects.filter(pk__in=user_ids).only('pk', 'date_joined')
+    cache.delete_many([user.project_permission_cache_key() for user in users])
+
+
+def clear_project_permissions_on_commit(user_ids):
+    """
+    Delete the cached projects of the users once the transaction is
+    committed. Deleting them before would let a concurrent request cache the
+    old memberships again.
+    """
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: clear_project_permissions(user_ids))
+
+
+def project_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Clear the cached projects of the users whose project memberships changed
+    """
+    if action == 'pre_clear':
+        #   The members are only known before they are removed
+        if not reverse:
+            instance._cleared_member_ids = set(
+                sender.objects.filter(project_id=instance.pk).values_list('user_id', flat=True)
+            )
+        return
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        #   Changed through the user
+        instance._project_ids = None
+        user_ids = [instance.pk]
+    elif action == 'post_clear':
+        user_ids = instance.__dict__.pop('_cleared_member_ids', set())
+    else:
+        user_ids = pk_set or []
+
+    clear_project_permissions_on_commit(user_ids)
+
+
+def project_deleted(sender, instance, **kwargs):
+    """
+    Clear the cached projects of the members of a deleted project
+    """
+    user_ids = set()
+    for field in PROJECT_ROLES.values():
+        user_ids |= set(getattr(instance, field).values_list('pk', flat=True))
+    clear_project_permissions_on_commit(user_ids)
+
+
+for field in PROJECT_ROLES.values():
+    m2m_changed.connect(
+        project_members_changed,
+        sender=getattr(star_models.Project, field).through,
+        dispatch_uid='project_members_changed_{}'.format(field),
+    )
+
+pre_delete.connect(
+    project_deleted,
+    sender=star_models.Project,
+    dispatch_uid='project_deleted_permissions',
+)
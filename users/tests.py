@@ -1 +1,90 @@
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+
+from AOTS.custom_permissions import get_allowed_objects_to_view_for_user
+from stars.models import Project, Star
+from users.models import User
+
+
+class ProjectPermissions(TestCase):
+
+    def setUp(self):
+        self.public = Project.objects.create(name='Public', is_public=True)
+        self.private = Project.objects.create(name='Private', is_public=False)
+        self.other = Project.objects.create(name='Other', is_public=False)
+        for project in [self.public, self.private, self.other]:
+            Star.objects.create(name=project.name, project=project, ra=1., dec=1.)
+
+        self.user = User.objects.create(username='reader')
+        self.user.readonly_projects.add(self.private)
+
+    def fresh_user(self):
+        #   As loaded at the start of a request
+        return User.objects.get(pk=self.user.pk)
+
+    def names(self, user):
+        stars = get_allowed_objects_to_view_for_user(Star.objects.all(), user)
+        return sorted(stars.values_list('name', flat=True))
+
+    def test_permissions_are_cached(self):
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertTrue(user.can_read(self.private))
+            self.assertFalse(user.can_read(self.other))
+            self.assertFalse(user.can_add(self.private))
+            self.assertEqual(user.get_read_project_ids(), {self.private.pk})
+
+        #   Cached between requests as well
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.can_read(self.private))
+
+    def test_membership_changes_clear_the_cache(self):
+        self.assertFalse(self.fresh_user().can_add(self.other))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.readwrite_users.add(self.user)
+        user = self.fresh_user()
+        self.assertTrue(user.can_add(self.other))
+        self.assertTrue(user.can_edit(Star.objects.get(name='Other')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.readwrite_users.clear()
+        self.assertFalse(self.fresh_user().can_read(self.other))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.readwrite_projects.add(self.other)
+        self.assertTrue(self.fresh_user().can_read(self.other))
+
+    def test_cache_is_cleared_after_commit(self):
+        self.assertTrue(self.fresh_user().can_read(self.private))
+
+        #   A request before the commit still sees the cached membership,
+        #   the cache is only cleared when the removal is visible
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.private.readonly_users.clear()
+        self.assertTrue(self.fresh_user().can_read(self.private))
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(self.fresh_user().can_read(self.private))
+
+    def test_project_deletion_clears_the_cache(self):
+        self.assertEqual(self.fresh_user().get_read_project_ids(), {self.private.pk})
+
+        pk = self.private.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private.delete()
+        self.assertNotIn(pk, self.fresh_user().get_read_project_ids())
+
+    def test_allowed_objects(self):
+        self.assertEqual(self.names(AnonymousUser()), ['Public'])
+
+        #   Project ids, exists() and the stars themselves
+        user = self.fresh_user()
+        user.clear_project_ids()
+        with self.assertNumQueries(3):
+            self.assertEqual(self.names(user), ['Private'])
+
+        nobody = User.objects.create(username='nobody')
+        self.assertEqual(self.names(nobody), ['Public'])